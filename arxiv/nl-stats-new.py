@@ -1,190 +1,177 @@
-import requests
-import pandas as pd
-import yaml
-import datetime
-import time
-
-# Load configuration
-def load_config(file_path):
-    with open(file_path, 'r') as file:
-        return yaml.safe_load(file)
-
-# Authenticate and retrieve access_token
-def get_access_token(client_id, client_secret):
-    print("Requesting access token...")
-    url = "https://aai.openaire.eu/oidc/token"
-    response = requests.post(
-        url,
-        auth=(client_id, client_secret),
-        data={'grant_type': 'client_credentials'}
-    )
-    if response.status_code == 200:
-        print("Access token retrieved successfully.")
-        return response.json().get('access_token')
-    else:
-        raise Exception(f"Failed to retrieve access token: {response.status_code}, {response.text}")
-
-# Fetch data from API with error handling and retries
-def fetch_api_data(api_url, access_token, params=None):
-    print(f"Fetching data from {api_url} with params {params}...")
-    headers = {'Authorization': f'Bearer {access_token}'}
-    retries = 3
-    for attempt in range(retries):
-        response = requests.get(api_url, headers=headers, params=params)
-        if response.status_code == 200:
-            print("Data fetched successfully.")
-            return response.json()
-        elif response.status_code == 500:
-            print(f"Server error (500). Retrying in {2 ** attempt} seconds...")
-            time.sleep(2 ** attempt)
-        else:
-            raise Exception(f"API request failed: {response.status_code}, {response.text}")
-    raise Exception(f"Persistent server error after {retries} attempts: {response.status_code}, {response.text}")
-
-# Process the data file with all the Dutch institutions
-def process_institutions(data_file):
-    print(f"Loading data file from {data_file}...")
-    df = pd.read_csv(data_file)
-    if 'ROR_LINK' in df.columns:
-        # Deduplicate based on the ROR_LINK column
-        df = df.drop_duplicates(subset='ROR_LINK').reset_index(drop=True)
-        print("Duplicates removed based on the ROR_LINK column.")
-    else:
-        print("ROR_LINK column not found in the data.")
-    return df
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from nlportal.client import OpenAIREClient
+from nlportal.engine import FetchEngine
+from nlportal.history import HistoryStore
+from nlportal.run import count_api_data, fetch_api_data, load_config, open_output, process_institutions
+
+# Fetch the research product counts of one data source (steps 8 and 9)
+def fetch_datasource_counts(client, openorg_id, datasource_id):
+    try:
+        # Step 8: Get number of research products in data source
+        num_found_datasource = count_api_data(
+            'researchProducts',
+            client,
+            params={'relCollectedFromDatasourceId': datasource_id}
+        )
+        # Step 9: Get research products in data source associated with organization
+        num_found_datasource_and_openorg = count_api_data(
+            'researchProducts',
+            client,
+            params={
+                'relOrganizationId': openorg_id,
+                'relCollectedFromDatasourceId': datasource_id
+            }
+        )
+        return num_found_datasource, num_found_datasource_and_openorg, None
+    except Exception as e:
+        return None, None, e
+
+# Collect all result rows for a single institution, and whether it was processed without errors
+def process_institution(index, row, total, client, engine):
+    print(f"Processing institution {index + 1}/{total}: {row['full_name_in_English']}...")
+    ror_link = row['ROR_LINK']
+    institution_name = row['full_name_in_English']
+    institution_acronym_en = row['acronym_EN']
+    institution_acronym_agg = row['acronym_AGG']
+    institution_group = row['main_grouping']
+    results = []
+    completed = True
+
+    try:
+        # Step 3: Get OpenAIRE Organization ID
+        with client.instrumentation.step('org lookup'):
+            org_response = fetch_api_data(
+                'organizations',
+                client,
+                params={'pid': ror_link}
+            )
+        openorg_ids = [org['id'] for org in org_response['results'] if org['id'].startswith('openorgs')]
+
+        for openorg_id in openorg_ids:
+            print(f"Processing {openorg_id}...")
+
+            # Steps 4-7 only depend on the OpenOrg ID, so they are fetched together.
+            # Steps 5 and 6 (number of research products and projects) only fetch the count.
+            with client.instrumentation.step('org details, products, projects, dataSources'):
+                organisations_response, num_found_research_products_openorgs, num_found_research_projects_openorgs, data_sources_response = engine.fetch_all([
+                    (fetch_api_data, (f"organizations/{openorg_id}", client), None),
+                    (count_api_data, ('researchProducts', client), {'params': {'relOrganizationId': openorg_id}}),
+                    (count_api_data, ('projects', client), {'params': {'relOrganizationId': openorg_id}}),
+                    (fetch_api_data, ('dataSources', client), {'params': {'relOrganizationId': openorg_id}}),
+                ])
+
+            # Step 4: Get Organisation name and url
+            openorg_name = organisations_response['legalName']
+            openorg_websiteUrl = organisations_response['websiteUrl']
+
+            # Step 7: Get data sources
+            data_sources = data_sources_response['results']
+            with client.instrumentation.step('per-datasource counts'):
+                ds_counts = engine.fetch_all([
+                    (fetch_datasource_counts, (client, openorg_id, ds['id']), None)
+                    for ds in data_sources
+                ])
+            for ds, (num_found_research_products_datasource, num_found_research_products_datasource_and_openorgs, error) in zip(data_sources, ds_counts):
+                datasource_id = ds['id']
+                datasource_name = ds.get('officialName', '')
+                datasource_compatibility = ds.get('openaireCompatibility', '')
+                datasource_last_validated = ds.get('dateOfValidation', '')
+                datasource_url = ds.get('websiteUrl', '')
+
+                print(f"Processing Data Source: {datasource_name} (ID: {datasource_id})...")
+                if error is not None:
+                    print(f"Error processing data source {datasource_id}: {error}")
+                    completed = False
+                    continue
+
+                # Step 10: Calculate missing research products
+                num_missing_research_products_in_datasource = num_found_research_products_datasource - num_found_research_products_datasource_and_openorgs
+                num_missing_research_products_in_openorgs = num_found_research_products_openorgs - num_found_research_products_datasource_and_openorgs
+
+                results.append({
+                    'ROR_ID': ror_link,
+                    'ROR_Name': institution_name,
+                    'ROR_Acronym': institution_acronym_en,
+                    'ROR_Acronym_Agg': institution_acronym_agg,
+                    'ROR_Group': institution_group,
+                    'OpenOrg_ID': openorg_id,
+                    'OpenOrg_Name': openorg_name,
+                    'OpenOrg_Website': openorg_websiteUrl,
+                    'DataSource_ID': datasource_id,
+                    'DataSource_Name': datasource_name,
+                    'DataSource_Compatibility': datasource_compatibility,
+                    'DataSource_LastValidated': datasource_last_validated,
+                    'DataSource_URL': datasource_url,
+                    'Num_Found_ResearchProducts_for_OpenOrg': num_found_research_products_openorgs,
+                    'Num_Found_ResearchProducts_for_DataSource': num_found_research_products_datasource,
+                    'Num_Found_ResearchProducts_for_OpenOrg_AND_DataSource': num_found_research_products_datasource_and_openorgs,
+                    'Num_Missing_ResearchProducts_in_DataSource': num_missing_research_products_in_datasource,
+                    'Num_Missing_ResearchProducts_in_OpenOrg': num_missing_research_products_in_openorgs,
+                })
+
+    except Exception as e:
+        print(f"Error processing institution {institution_name}: {e}")
+        # Keep the rows of the OpenOrgs that were completed before the error
+        completed = False
+    return results, completed
+
+# Command line options
+def parse_args():
+    parser = argparse.ArgumentParser(description="Retrieve OpenAIRE research output counts for Dutch institutions and their data sources.")
+    cache_mode = parser.add_mutually_exclusive_group()
+    cache_mode.add_argument('--refresh', action='store_true', help="ignore cached API responses and fetch everything again")
+    cache_mode.add_argument('--offline', action='store_true', help="only use cached API responses, never call the API")
+    parser.add_argument('--resume', action='store_true', help="continue the last interrupted run, skipping the institutions it completed")
+    parser.add_argument('--profile', action='store_true', help="print latency percentiles per endpoint and the time spent per step at the end")
+    parser.add_argument('--trace', metavar='FILE', help="write a JSON line per API request and pipeline step to FILE")
+    return parser.parse_args()
 
 # Main script
 def main():
+    args = parse_args()
     print("Loading configuration...")
     config = load_config('config.yaml')
 
-    client_id = config['CLIENT_ID']
-    client_secret = config['CLIENT_SECRET']
     data_file = config['Org_data_file']
-
-    access_token = get_access_token(client_id, client_secret)
+    # Number of API requests that may run at the same time (1 = sequential)
+    max_in_flight = config.get('Max_in_flight', 1)
+
+    # One pooled client for all requests, it refreshes the access token when it is about to expire
+    cache_mode = 'refresh' if args.refresh else 'offline' if args.offline else None
+    client = OpenAIREClient.from_config(config, cache_mode=cache_mode, trace_file=args.trace)
+    if not args.offline:
+        client.token.get()
     institutions = process_institutions(data_file)
 
-    results = []
-
-    for index, row in institutions.iterrows():
-        print(f"Processing institution {index + 1}/{len(institutions)}: {row['full_name_in_English']}...")
-        ror_link = row['ROR_LINK']
-        institution_name = row['full_name_in_English']
-        institution_acronym_en = row['acronym_EN']
-        institution_acronym_agg = row['acronym_AGG']
-        institution_group = row['main_grouping']
-
-        try:
-            # Step 3: Get OpenAIRE Organization ID
-            org_response = fetch_api_data(
-                f"{config['OpenAIRE_API']}organizations",
-                access_token,
-                params={'pid': ror_link}
-            )
-            openorg_ids = [org['id'] for org in org_response['results'] if org['id'].startswith('openorgs')]
-
-            for openorg_id in openorg_ids:
-                print(f"Processing {openorg_id}...")
-
-                # Step 4: Get Organisation name and url
-                organisations_response = fetch_api_data(
-                    f"{config['OpenAIRE_API']}organizations/{openorg_id}",
-                    access_token
-                )
-                openorg_name = organisations_response['legalName']
-                openorg_websiteUrl = organisations_response['websiteUrl']
-
-                # Step 5: Get number of research products
-                research_products_response = fetch_api_data(
-                    f"{config['OpenAIRE_API']}researchProducts",
-                    access_token,
-                    params={'relOrganizationId': openorg_id}
-                )
-                num_found_research_products_openorgs = research_products_response['header']['numFound']
-
-                # Step 6: Get number of projects
-                projects_response = fetch_api_data(
-                    f"{config['OpenAIRE_API']}projects",
-                    access_token,
-                    params={'relOrganizationId': openorg_id}
-                )
-                num_found_research_projects_openorgs = projects_response['header']['numFound']
-
-                # Step 7: Get data sources
-                data_sources_response = fetch_api_data(
-                    f"{config['OpenAIRE_API']}dataSources",
-                    access_token,
-                    params={'relOrganizationId': openorg_id}
-                )
-                for ds in data_sources_response['results']:
-                    datasource_id = ds['id']
-                    datasource_name = ds.get('officialName', '')
-                    datasource_compatibility = ds.get('openaireCompatibility', '')
-                    datasource_last_validated = ds.get('dateOfValidation', '')
-                    datasource_url = ds.get('websiteUrl', '')
-
-                    try:
-                        print(f"Processing Data Source: {datasource_name} (ID: {datasource_id})...")
-
-                        # Step 8: Get number of research products in data source
-                        ds_research_products_response = fetch_api_data(
-                            f"{config['OpenAIRE_API']}researchProducts",
-                            access_token,
-                            params={'relCollectedFromDatasourceId': datasource_id}
-                        )
-                        num_found_research_products_datasource = ds_research_products_response['header']['numFound']
-
-                        # Step 9: Get research products in data source associated with organization
-                        ds_org_research_products_response = fetch_api_data(
-                            f"{config['OpenAIRE_API']}researchProducts",
-                            access_token,
-                            params={
-                                'relOrganizationId': openorg_id,
-                                'relCollectedFromDatasourceId': datasource_id
-                            }
-                        )
-                        num_found_research_products_datasource_and_openorgs = ds_org_research_products_response['header']['numFound']
-
-                        # Step 10: Calculate missing research products
-                        num_missing_research_products_in_datasource = num_found_research_products_datasource - num_found_research_products_datasource_and_openorgs
-                        num_missing_research_products_in_openorgs = num_found_research_products_openorgs - num_found_research_products_datasource_and_openorgs
-
-                        results.append({
-                            'ROR_ID': ror_link,
-                            'ROR_Name': institution_name,
-                            'ROR_Acronym': institution_acronym_en,
-                            'ROR_Acronym_Agg': institution_acronym_agg,
-                            'ROR_Group': institution_group,
-                            'OpenOrg_ID': openorg_id,
-                            'OpenOrg_Name': openorg_name,
-                            'OpenOrg_Website': openorg_websiteUrl,
-                            'DataSource_ID': datasource_id,
-                            'DataSource_Name': datasource_name,
-                            'DataSource_Compatibility': datasource_compatibility,
-                            'DataSource_LastValidated': datasource_last_validated,
-                            'DataSource_URL': datasource_url,
-                            'Num_Found_ResearchProducts_for_OpenOrg': num_found_research_products_openorgs,
-                            'Num_Found_ResearchProducts_for_DataSource': num_found_research_products_datasource,
-                            'Num_Found_ResearchProducts_for_OpenOrg_AND_DataSource': num_found_research_products_datasource_and_openorgs,
-                            'Num_Missing_ResearchProducts_in_DataSource': num_missing_research_products_in_datasource,
-                            'Num_Missing_ResearchProducts_in_OpenOrg': num_missing_research_products_in_openorgs,
-                        })
-                    except Exception as e:
-                        print(f"Error processing data source {datasource_id}: {e}")
-                        continue
-
-        except Exception as e:
-            print(f"Error processing institution {institution_name}: {e}")
-            continue
-
-    # Save results to CSV
-    timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M')
-    output_file = f"{timestamp}_nl-stats.csv"
-    df = pd.DataFrame(results)
-    df['Retrieved_On'] = datetime.datetime.now()
-    df.to_csv(output_file, index=False)
-    print(f"Results saved to {output_file}")
+    # Rows are written per institution, and completed institutions are recorded for --resume
+    writer, checkpoint = open_output(config, args, 'nl-stats-new-checkpoint.jsonl')
+    pending = [(index, row) for index, row in institutions.iterrows() if row['ROR_LINK'] not in checkpoint]
+
+    with FetchEngine(max_in_flight) as engine:
+        institution_results = engine.imap(
+            lambda item: process_institution(item[0], item[1], len(institutions), client, engine),
+            pending
+        )
+        for (index, row), (institution_rows, completed) in zip(pending, institution_results):
+            writer.write_rows(institution_rows)
+            # Institutions with errors are not marked, --resume tries them again
+            if completed:
+                checkpoint.mark(row['ROR_LINK'])
+    if client.cache is not None:
+        print(f"Cache hits: {client.cache.hits}, misses: {client.cache.misses}")
+    if args.profile:
+        print(client.instrumentation.summary())
+    client.close()
+
+    print(f"Results saved to {writer.csv_path}")
+
+    # Add the run to the history of all runs, for comparisons over time
+    if config.get('History_dir'):
+        HistoryStore(config['History_dir']).import_file(writer.csv_path)
 
 if __name__ == "__main__":
     main()
@@ -1,209 +1,449 @@
-import requests
+import argparse
+import os
+import sys
 import pandas as pd
-import yaml
-import datetime
-
-# Load configuration
-def load_config(file_path):
-    with open(file_path, 'r') as file:
-        return yaml.safe_load(file)
-
-# Authenticate and retrieve access_token
-def get_access_token(client_id, client_secret):
-    print("Requesting access token...")
-    url = "https://aai.openaire.eu/oidc/token"
-    response = requests.post(
-        url,
-        auth=(client_id, client_secret),
-        data={'grant_type': 'client_credentials'}
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from nlportal.client import OpenAIREClient
+from nlportal.engine import FetchEngine
+from nlportal.history import HistoryStore
+from nlportal.incremental import delta_report, find_latest_snapshot, load_snapshot, plan_refresh, snapshot_rows
+from nlportal.missing import write_missing_lists
+from nlportal.plan import QueryPlan
+from nlportal.providers import comparison_table, comparison_years, make_provider, start_counts
+from nlportal.resolution import ResolutionIndex
+from nlportal.run import OUTPUT_COLUMNS, count_api_data, fetch_api_data, load_config, open_output, process_institutions
+from nlportal.scheduler import SCHEDULES, estimate_costs, largest_first, latency_model_for, plan_text
+from nlportal.shard import SharedRateLimiter, merge_parts, part_file, part_files, run_shards
+from nlportal.writer import Checkpoint, StreamingWriter, write_parquet
+
+# Register the requests of a batch of institutions in the query plan and execute them, stage by stage.
+# Each stage only depends on the results of the previous one; identical requests (OpenOrgs shared by
+# several ROR ids, data sources shared by several OpenOrgs) are executed once for the whole run.
+# With a resolution index the OpenOrgs of known ROR links are not looked up again.
+def fetch_institutions(batch, plan, engine, instrumentation, resolution=None):
+    # Step 3: Get OpenAIRE Organization IDs
+    looked_up = []
+    for index, row in batch:
+        if resolution is None or not resolution.provide(plan, row['ROR_LINK']):
+            looked_up.append(row['ROR_LINK'])
+        plan.add('organizations', {'pid': row['ROR_LINK']})
+    with instrumentation.step('org lookup'):
+        plan.execute(engine)
+
+    # Steps 4-7: Get organisation details, research products, projects and data sources
+    openorg_ids = [openorg_id for index, row in batch for openorg_id in get_openorg_ids(plan, row['ROR_LINK'])]
+    for openorg_id in openorg_ids:
+        plan.add(f"organizations/{openorg_id}")
+        plan.add('researchProducts', {'relOrganizationId': openorg_id}, count=True)
+        plan.add('projects', {'relOrganizationId': openorg_id}, count=True)
+        plan.add('dataSources', {'relOrganizationId': openorg_id})
+    with instrumentation.step('org details, products, projects, dataSources'):
+        plan.execute(engine)
+    if resolution is not None:
+        resolution.record(plan, looked_up)
+
+    # Steps 8-9: Get research products per data source, and per data source and organisation
+    for openorg_id in openorg_ids:
+        for ds in plan.result('dataSources', {'relOrganizationId': openorg_id})['results']:
+            plan.add('researchProducts', {'relCollectedFromDatasourceId': ds['id']}, count=True)
+            plan.add('researchProducts', {'relOrganizationId': openorg_id, 'relCollectedFromDatasourceId': ds['id']}, count=True)
+    with instrumentation.step('per-datasource counts'):
+        plan.execute(engine)
+
+# The OpenOrg IDs found for a ROR link (only id's with the "openorgs" prefix)
+def get_openorg_ids(plan, ror_link):
+    org_response = plan.result('organizations', {'pid': ror_link})
+    return [org['id'] for org in org_response['results'] if org['id'].startswith('openorgs')]
+
+# Collect all result rows for a single institution from the executed query plan
+def process_institution(index, row, total, plan):
+    print(f"Processing institution {index + 1}/{total}: {row['full_name_in_English']}...")
+    ror_link = row['ROR_LINK']
+    institution_name = row['full_name_in_English']
+    institution_acronym_en = row['acronym_EN']
+    institution_acronym_agg = row['acronym_AGG']
+    institution_group = row['main_grouping']
+    results = []
+
+    # Step 3: Get OpenAIRE Organization ID
+    openorg_ids = get_openorg_ids(plan, ror_link)
+
+    for openorg_id in openorg_ids:
+        print(f"Processing {openorg_id}...")
+
+        # Step 4: Get Organisation name and url
+        organisations_response = plan.result(f"organizations/{openorg_id}")
+        openorg_name = organisations_response['legalName']
+        print(f"Organisatioin Name: {openorg_name}")
+        openorg_websiteUrl = organisations_response['websiteUrl']
+        print(f"Organisation URL: {openorg_websiteUrl}")
+
+        # Step 5: Get number of research products
+        num_found_research_products_openorgs = plan.result('researchProducts', {'relOrganizationId': openorg_id}, count=True)
+        print(f"Research products count: {num_found_research_products_openorgs}")
+
+        # Step 6: Get number of projects
+        num_found_research_projects_openorgs = plan.result('projects', {'relOrganizationId': openorg_id}, count=True)
+        print(f"Projects count: {num_found_research_projects_openorgs}")
+
+        # Step 7: Get data sources
+        data_sources_response = plan.result('dataSources', {'relOrganizationId': openorg_id})
+        if not data_sources_response['results']:
+            # Handle case when no data sources are found
+            print(f"No data sources found for {openorg_name} ({openorg_id}).")
+            results.append({
+                'ROR_ID': ror_link,
+                'ROR_Name': institution_name,
+                'ROR_Acronym': institution_acronym_en,
+                'ROR_Acronym_Agg': institution_acronym_agg,
+                'ROR_Group': institution_group,
+                'OpenOrg_ID': openorg_id,
+                'OpenOrg_Name': openorg_name,
+                'OpenOrg_Website': openorg_websiteUrl,
+                'DataSource_ID': None,
+                'DataSource_Name': None,
+                'DataSource_Compatibility': None,
+                'DataSource_LastValidated': None,
+                'DataSource_URL': None,
+                'Num_Found_ResearchProducts_for_OpenOrg': num_found_research_products_openorgs,
+                'Num_Found_ResearchProducts_for_DataSource': 0,
+                'Num_Found_ResearchProducts_for_OpenOrg_AND_DataSource': 0,
+                'Num_Missing_ResearchProducts_in_DataSource': 0,
+                'Num_Missing_ResearchProducts_in_OpenOrg': num_found_research_products_openorgs
+            })
+            continue
+
+        # Process data sources if found
+        for ds in data_sources_response['results']:
+            datasource_id = ds['id']
+            datasource_name = ds.get('officialName', '')
+            datasource_compatibility = ds.get('openaireCompatibility', '')
+            datasource_last_validated = ds.get('dateOfValidation', '')
+            datasource_url = ds.get('websiteUrl', '')
+
+            print(f"Processing Data Source: {datasource_name} (ID: {datasource_id})...")
+
+            # Step 8: Get number of research products in data source
+            num_found_research_products_datasource = plan.result('researchProducts', {'relCollectedFromDatasourceId': datasource_id}, count=True)
+            print(f"Research products in data source: {num_found_research_products_datasource}")
+
+            # Step 9: Get research products in data source associated with organization
+            num_found_research_products_datasource_and_openorgs = plan.result('researchProducts', {
+                'relOrganizationId': openorg_id,
+                'relCollectedFromDatasourceId': datasource_id
+            }, count=True)
+            print(f"Research products in data source associated with organization: {num_found_research_products_datasource_and_openorgs}")
+
+            # Step 10: Calculate missing research products in data source
+            num_missing_research_products_in_datasource = num_found_research_products_datasource - num_found_research_products_datasource_and_openorgs
+            print(f"Missing research products in data source: {num_missing_research_products_in_datasource}")
+
+            # Step 11: Calculate missing research products in organization
+            num_missing_research_products_in_openorgs = num_found_research_products_openorgs - num_found_research_products_datasource_and_openorgs
+            print(f"Missing research products in organization: {num_missing_research_products_in_openorgs}")
+
+            results.append({
+                'ROR_ID': ror_link,
+                'ROR_Name': institution_name,
+                'ROR_Acronym': institution_acronym_en,
+                'ROR_Acronym_Agg': institution_acronym_agg,
+                'ROR_Group': institution_group,
+                'OpenOrg_ID': openorg_id,
+                'OpenOrg_Name': openorg_name,
+                'OpenOrg_Website': openorg_websiteUrl,
+                'DataSource_ID': datasource_id,
+                'DataSource_Name': datasource_name,
+                'DataSource_Compatibility': datasource_compatibility,
+                'DataSource_LastValidated': datasource_last_validated,
+                'DataSource_URL': datasource_url,
+                'Num_Found_ResearchProducts_for_OpenOrg': num_found_research_products_openorgs,
+                'Num_Found_ResearchProducts_for_DataSource': num_found_research_products_datasource,
+                'Num_Found_ResearchProducts_for_OpenOrg_AND_DataSource': num_found_research_products_datasource_and_openorgs,
+                'Num_Missing_ResearchProducts_in_DataSource': num_missing_research_products_in_datasource,
+                'Num_Missing_ResearchProducts_in_OpenOrg': num_missing_research_products_in_openorgs,
+            })
+
+    return results
+
+# Worker process of a sharded run: fetch the batches of institutions on the queue and write their rows
+# to the part file of this shard. All shards share the rate limiter and the checkpoint manifest.
+def run_shard(shard, queue, config, cache_mode, trace_file, limiter, output_file, checkpoint_file, total, profile):
+    client = OpenAIREClient.from_config(config, cache_mode=cache_mode, trace_file=trace_file, limiter=limiter)
+    instrumentation = client.instrumentation
+    if cache_mode != 'offline':
+        client.token.get()
+    resolution = open_resolution(config, client, cache_mode)
+    writer = StreamingWriter(part_file(output_file, shard), OUTPUT_COLUMNS, append=True)
+    checkpoint = Checkpoint(checkpoint_file)
+    plan = QueryPlan(
+        lambda endpoint, params: fetch_api_data(endpoint, client, params=params),
+        count=lambda endpoint, params: count_api_data(endpoint, client, params=params)
+    )
+    with FetchEngine(config.get('Max_in_flight', 1)) as engine:
+        for batch in iter(queue.get, None):
+            fetch_institutions(batch, plan, engine, instrumentation, resolution)
+            with instrumentation.step('write output'):
+                for index, row in batch:
+                    writer.write_rows(process_institution(index, row, total, plan))
+                    checkpoint.mark(row['ROR_LINK'])
+    print(f"Shard {shard}: {writer.rows_written} rows written to {writer.csv_path}. {plan.summary()}")
+    if profile:
+        print(f"Shard {shard} {instrumentation.summary()}")
+    if resolution is not None:
+        resolution.close()
+    client.close()
+
+# Replace the Parquet dataset of the output (Output_parquet) by one part with the rows of the output
+# file, after the output file was merged or put back in the order of the data file
+def rewrite_parquet(writer):
+    if not writer.parquet_dir:
+        return
+    os.makedirs(writer.parquet_dir, exist_ok=True)
+    for name in os.listdir(writer.parquet_dir):
+        os.remove(os.path.join(writer.parquet_dir, name))
+    write_parquet(pd.read_csv(writer.csv_path, parse_dates=['Retrieved_On']), os.path.join(writer.parquet_dir, 'part-00000.parquet'))
+
+# Fetch the institutions in shards: worker processes taking batches from one work queue, each
+# writing its own part, merged into the output file at the end. Reused snapshot rows are
+# written to a part by the main process.
+def run_sharded(shards, config, args, cache_mode, writer, checkpoint, institutions, pending, refresh, snapshot):
+    os.makedirs(os.path.dirname(part_file(writer.csv_path, 0)), exist_ok=True)
+    # Parts of an interrupted run only keep the rows of the completed institutions
+    for part in part_files(writer.csv_path):
+        StreamingWriter.resume(part, OUTPUT_COLUMNS, checkpoint.completed)
+    # Rows in the output file itself were written by a run without shards that is resumed with --shards.
+    # They are moved to a part of their own, the merge at the end replaces the output file.
+    if os.path.exists(writer.csv_path) and os.path.getsize(writer.csv_path):
+        merged = set()
+        for part in part_files(writer.csv_path):
+            if os.path.getsize(part):
+                merged.update(pd.read_csv(part, dtype=str, keep_default_na=False)['ROR_ID'])
+        written = pd.read_csv(writer.csv_path, dtype=str, keep_default_na=False)
+        written = written[~written['ROR_ID'].isin(merged)]
+        if len(written):
+            resumed = part_file(writer.csv_path, 'resumed')
+            written.to_csv(resumed, mode='a', header=not os.path.exists(resumed), index=False)
+            print(f"Moved {len(written)} rows of the output file to {resumed}.")
+    if refresh is not None:
+        reused = StreamingWriter(part_file(writer.csv_path, 'reused'), OUTPUT_COLUMNS, append=True)
+        for index, row in pending:
+            if str(row['ROR_LINK']) not in refresh:
+                reused.write_rows(snapshot_rows(snapshot, row['ROR_LINK']))
+                checkpoint.mark(row['ROR_LINK'])
+        pending = [(index, row) for index, row in pending if str(row['ROR_LINK']) in refresh]
+
+    # Rate_limit is the budget of the whole run, shared by all shards
+    rate = float(config.get('Rate_limit') or 10)
+    limiter = SharedRateLimiter(rate=rate, max_rate=max(rate, float(config.get('Rate_limit_max') or 50)))
+    print(f"Fetching {len(pending)} institutions in {shards} shards...")
+    run_shards(
+        [(index, row.to_dict()) for index, row in pending], run_shard, shards,
+        args=(config, cache_mode, args.trace, limiter, writer.csv_path, checkpoint.path, len(institutions), args.profile),
+        batch_size=config.get('Batch_size', 10),
     )
-    if response.status_code == 200:
-        print("Access token retrieved successfully.")
-        return response.json().get('access_token')
-    else:
-        raise Exception(f"Failed to retrieve access token: {response.status_code}, {response.text}")
-
-# Fetch data from API
-def fetch_api_data(api_url, access_token, params=None):
-    print(f"Fetching data from {api_url} with params {params}...")
-    headers = {'Authorization': f'Bearer {access_token}'}
-    response = requests.get(api_url, headers=headers, params=params)
-    if response.status_code == 200:
-        print("Data fetched successfully.")
-        return response.json()
-    else:
-        raise Exception(f"API request failed: {response.status_code}, {response.text}")
-
-# Process the data file with all the Dutch institutions
-def process_institutions(data_file):
-    print(f"Loading data file from {data_file}...")
-    df = pd.read_csv(data_file)
-    if 'ROR_LINK' in df.columns:
-        # Deduplicate based on the ROR_LINK column
-        df = df.drop_duplicates(subset='ROR_LINK').reset_index(drop=True)
-        print("Duplicates removed based on the ROR_LINK column.")
-    else:
-        print("ROR_LINK column not found in the data.")
-    return df
+
+    rows = merge_parts(part_files(writer.csv_path), writer.csv_path, 'ROR_ID', institutions['ROR_LINK'])
+    rewrite_parquet(writer)
+    print(f"Merged {rows} rows of {len(part_files(writer.csv_path))} parts.")
+
+# Expected cost per institution (nlportal.scheduler.estimate_costs) from the snapshot of an incremental
+# run, or else the latest output file; None when there is no earlier output
+def estimate_schedule(config, args, institutions, snapshot=None, exclude=None):
+    if snapshot is None:
+        snapshot_file = args.incremental if args.incremental and args.incremental != 'latest' else find_latest_snapshot(exclude=exclude)
+        if snapshot_file is None:
+            return None
+        snapshot = load_snapshot(snapshot_file)
+    return estimate_costs(institutions, snapshot, latency_model_for(config, snapshot, args.trace))
+
+# Open the resolution index of ROR links when Resolution_index is set; stale entries are revalidated
+# in the background, except in offline runs
+def open_resolution(config, client, cache_mode):
+    if not config.get('Resolution_index'):
+        return None
+    resolution = ResolutionIndex.from_config(config)
+    if cache_mode != 'offline':
+        resolution.start_revalidation(client)
+    return resolution
+
+# Start counting the works of the institutions in OpenAlex (--openalex or OpenAlex_compare), in total and per
+# year. The counts are fetched on a thread of their own, with their own connections and rate budget, while
+# the OpenAIRE requests run. Returns the provider and the future of its counts, or None.
+def start_comparison(config, args, institutions):
+    if not (args.openalex or config.get('OpenAlex_compare')):
+        return None
+    if args.offline:
+        print("Offline run, not comparing with OpenAlex.")
+        return None
+    if 'OpenAlex_ID' not in institutions.columns:
+        print(f"{config['Org_data_file']} has no OpenAlex_ID column, not comparing with OpenAlex.")
+        return None
+    provider = make_provider('openalex', config)
+    from_year, to_year = comparison_years(config)
+    return provider, start_counts([provider], institutions, from_year, to_year)[provider.name]
+
+# Command line options
+def parse_args():
+    parser = argparse.ArgumentParser(description="Retrieve OpenAIRE research output counts for Dutch institutions and their data sources.")
+    cache_mode = parser.add_mutually_exclusive_group()
+    cache_mode.add_argument('--refresh', action='store_true', help="ignore cached API responses and fetch everything again")
+    cache_mode.add_argument('--offline', action='store_true', help="only use cached API responses, never call the API")
+    parser.add_argument('--resume', action='store_true', help="continue the last interrupted run, skipping the institutions it completed")
+    parser.add_argument('--incremental', nargs='?', const='latest', metavar='SNAPSHOT',
+                        help="reuse the rows of a previous output file (default: the latest one) for institutions that did not change and are recent enough")
+    parser.add_argument('--profile', action='store_true', help="print latency percentiles per endpoint and the time spent per step at the end")
+    parser.add_argument('--trace', metavar='FILE', help="write a JSON line per API request and pipeline step to FILE")
+    parser.add_argument('--shards', type=int, metavar='N', help="fetch the institutions in N worker processes sharing the rate limit (default: Shards from config.yaml, or 1)")
+    parser.add_argument('--schedule', choices=SCHEDULES,
+                        help="order in which institutions are fetched: as in the data file, or the most expensive first, estimated from the previous output file (default: Schedule from config.yaml, or file)")
+    parser.add_argument('--plan', action='store_true', help="only print the expected requests and duration of the run per schedule, without calling the API")
+    parser.add_argument('--missing-ids', metavar='DIR', help="after the run, write the IDs of the missing research products of every organisation and data source to DIR")
+    parser.add_argument('--openalex', action='store_true', help="also count the works of every institution in OpenAlex, in total and per year, written next to the output file")
+    return parser.parse_args()
 
 # Main script
 def main():
+    args = parse_args()
+    if args.missing_ids and args.offline:
+        raise Exception("--missing-ids fetches the research products from the API, it can not be used with --offline")
+    if args.openalex and args.offline:
+        raise Exception("--openalex fetches the counts from OpenAlex, it can not be used with --offline")
     print("Loading configuration...")
     config = load_config('config.yaml')
 
-    client_id = config['CLIENT_ID']
-    client_secret = config['CLIENT_SECRET']
     data_file = config['Org_data_file']
+    # Number of API requests that may run at the same time (1 = sequential)
+    max_in_flight = config.get('Max_in_flight', 1)
+    schedule = args.schedule or config.get('Schedule', 'file')
+    shards = int(args.shards or config.get('Shards', 1))
+
+    # Dry run: the expected requests and duration, from the previous output file
+    if args.plan:
+        institutions = process_institutions(data_file)
+        costs = estimate_schedule(config, args, institutions)
+        if costs is None:
+            raise Exception("--plan needs the output file of an earlier run (*_nl-stats.csv) to estimate the requests from")
+        print(plan_text(costs, schedule, config.get('Batch_size', 10), max_in_flight, shards, config.get('Rate_limit_max')))
+        return
 
-    access_token = get_access_token(client_id, client_secret)
+    # One pooled client for all requests, it refreshes the access token when it is about to expire
+    cache_mode = 'refresh' if args.refresh else 'offline' if args.offline else None
+    client = OpenAIREClient.from_config(config, cache_mode=cache_mode, trace_file=args.trace)
+    instrumentation = client.instrumentation
+    if not args.offline:
+        client.token.get()
     institutions = process_institutions(data_file)
+    run_started = time.time()
+    comparison = start_comparison(config, args, institutions)
+    resolution = open_resolution(config, client, cache_mode)
+    if resolution is not None:
+        print(f"{resolution.seed_from_input(institutions)} ROR links added to the resolution index from {data_file}.")
 
-    results = []
+    # Rows are written per institution, and completed institutions are recorded for --resume
+    writer, checkpoint = open_output(config, args, 'nl-stats-checkpoint.jsonl')
+    pending = [(index, row) for index, row in institutions.iterrows() if row['ROR_LINK'] not in checkpoint]
+    # Number of institutions whose requests are planned and executed together
+    batch_size = config.get('Batch_size', 10)
+
+    # Incremental run: only institutions that are new, changed in the data file or too old are fetched again
+    snapshot = None
+    refresh = None
+    if args.incremental:
+        snapshot_file = find_latest_snapshot(exclude=writer.csv_path) if args.incremental == 'latest' else args.incremental
+        if snapshot_file is None:
+            print("No previous snapshot found, fetching all institutions.")
+        else:
+            snapshot = load_snapshot(snapshot_file)
+            refresh = plan_refresh(institutions, snapshot, config.get('Max_snapshot_age_days', 7))
+            reasons = pd.Series(list(refresh.values()), dtype=object).value_counts().to_dict()
+            print(f"Reusing {len(institutions) - len(refresh)} institutions from {snapshot_file}, refreshing {len(refresh)} {reasons}.")
+
+    # Most expensive institutions first, so the run does not end with a tail of large institutions
+    # (see nlportal/scheduler.py). The output file is put back in the order of the data file.
+    if schedule == 'largest-first':
+        costs = estimate_schedule(config, args, institutions, snapshot, exclude=writer.csv_path)
+        if costs is None:
+            print("No previous output file to estimate the institutions from, fetching them in the order of the data file.")
+        else:
+            pending = largest_first(pending, costs)
+            print(f"Fetching the institutions largest first, {int(costs['requests'].sum())} requests expected.")
+
+    # Large institution lists: worker processes sharing a work queue and the rate budget
+    if shards > 1:
+        run_sharded(shards, config, args, cache_mode, writer, checkpoint, institutions, pending, refresh, snapshot)
+        if resolution is not None:
+            print(resolution.report(since=run_started))
+            resolution.close()
+        finish_run(config, writer, snapshot, client, args.missing_ids, comparison)
+        return
+
+    # Build the query plan per batch of institutions, execute every unique request once for the whole run
+    plan = QueryPlan(
+        lambda endpoint, params: fetch_api_data(endpoint, client, params=params),
+        count=lambda endpoint, params: count_api_data(endpoint, client, params=params)
+    )
+    with FetchEngine(max_in_flight) as engine:
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            fetch_institutions([item for item in batch if refresh is None or str(item[1]['ROR_LINK']) in refresh], plan, engine, instrumentation, resolution)
+            with instrumentation.step('write output'):
+                for index, row in batch:
+                    if refresh is None or str(row['ROR_LINK']) in refresh:
+                        writer.write_rows(process_institution(index, row, len(institutions), plan))
+                    else:
+                        writer.write_rows(snapshot_rows(snapshot, row['ROR_LINK']))
+                    checkpoint.mark(row['ROR_LINK'])
+    print(plan.summary())
+    if resolution is not None:
+        resolution.finish()
+        print(resolution.report(since=run_started))
+        resolution.close()
+    if client.cache is not None:
+        print(f"Cache hits: {client.cache.hits}, misses: {client.cache.misses}")
+    if args.profile:
+        print(instrumentation.summary())
+    if schedule == 'largest-first':
+        merge_parts([writer.csv_path], writer.csv_path, 'ROR_ID', institutions['ROR_LINK'])
+        rewrite_parquet(writer)
+    finish_run(config, writer, snapshot, client, args.missing_ids, comparison)
+
+# Report where the results are, add them to the history, report the changes since the snapshot,
+# write the lists of missing research products and the comparison with OpenAlex
+def finish_run(config, writer, snapshot, client, missing_dir=None, comparison=None):
+    print(f"Results saved to {writer.csv_path}")
+
+    # Add the run to the history of all runs, for comparisons over time
+    if config.get('History_dir'):
+        HistoryStore(config['History_dir']).import_file(writer.csv_path)
 
-    for index, row in institutions.iterrows():
-        print(f"Processing institution {index + 1}/{len(institutions)}: {row['full_name_in_English']}...")
-        ror_link = row['ROR_LINK']
-        institution_name = row['full_name_in_English']
-        institution_acronym_en = row['acronym_EN']
-        institution_acronym_agg = row['acronym_AGG']
-        institution_group = row['main_grouping']
-
-        # Step 3: Get OpenAIRE Organization ID
-        org_response = fetch_api_data(
-            f"{config['OpenAIRE_API']}organizations",
-            access_token,
-            params={'pid': ror_link}
+    # Report the counts that changed since the previous snapshot
+    if snapshot is not None:
+        report = delta_report(snapshot, pd.read_csv(writer.csv_path))
+        delta_file = f"{writer.csv_path[:-4]}-delta.csv"
+        report.to_csv(delta_file, index=False)
+        print(f"{len(report)} changed rows written to {delta_file}")
+
+    # Exact lists of the missing research products instead of counts (see nlportal/missing.py)
+    if missing_dir:
+        summary_file = write_missing_lists(
+            lambda endpoint, params: client.get(endpoint, params, cache=False), writer.csv_path, missing_dir,
+            config.get('Missing_ids_memory_mb', 64) * 1024 * 1024,
         )
-        openorg_ids = [org['id'] for org in org_response['results'] if org['id'].startswith('openorgs')]
-
-        for openorg_id in openorg_ids:
-            print(f"Processing {openorg_id}...")
-
-             # Step 4: Get Organisation name and url
-            organisations_response = fetch_api_data(
-                f"{config['OpenAIRE_API']}organizations/{openorg_id}",
-                access_token
-            )
-            openorg_name = organisations_response['legalName']
-            print(f"Organisatioin Name: {openorg_name}")
-            openorg_websiteUrl = organisations_response['websiteUrl']
-            print(f"Organisation URL: {openorg_websiteUrl}")
-
-            # Step 5: Get number of research products
-            research_products_response = fetch_api_data(
-                f"{config['OpenAIRE_API']}researchProducts",
-                access_token,
-                params={'relOrganizationId': openorg_id}
-            )
-            num_found_research_products_openorgs = research_products_response['header']['numFound']
-            print(f"Research products count: {num_found_research_products_openorgs}")
-
-            # Step 6: Get number of projects
-            projects_response = fetch_api_data(
-                f"{config['OpenAIRE_API']}projects",
-                access_token,
-                params={'relOrganizationId': openorg_id}
-            )
-            num_found_research_projects_openorgs = projects_response['header']['numFound']
-            print(f"Projects count: {num_found_research_projects_openorgs}")
-
-            # Step 7: Get data sources
-            data_sources_response = fetch_api_data(
-                f"{config['OpenAIRE_API']}dataSources",
-                access_token,
-                params={'relOrganizationId': openorg_id}
-            )
-            if not data_sources_response['results']:
-                # Handle case when no data sources are found
-                print(f"No data sources found for {openorg_name} ({openorg_id}).")
-                results.append({
-                    'ROR_ID': ror_link,
-                    'ROR_Name': institution_name,
-                    'ROR_Acronym': institution_acronym_en,
-                    'ROR_Acronym_Agg': institution_acronym_agg,
-                    'ROR_Group': institution_group,
-                    'OpenOrg_ID': openorg_id,
-                    'OpenOrg_Name': openorg_name,
-                    'OpenOrg_Website': openorg_websiteUrl,
-                    'DataSource_ID': None,
-                    'DataSource_Name': None,
-                    'DataSource_Compatibility': None,
-                    'DataSource_LastValidated': None,
-                    'DataSource_URL': None,
-                    'Num_Found_ResearchProducts_for_OpenOrg': num_found_research_products_openorgs,
-                    'Num_Found_ResearchProducts_for_DataSource': 0,
-                    'Num_Found_ResearchProducts_for_OpenOrg_AND_DataSource': 0,
-                    'Num_Missing_ResearchProducts_in_DataSource': 0,
-                    'Num_Missing_ResearchProducts_in_OpenOrg': num_found_research_products_openorgs
-                })
-            else:
-                # Process data sources if found
-                for ds in data_sources_response['results']:
-                    datasource_id = ds['id']
-                    datasource_name = ds.get('officialName', '')
-                    datasource_compatibility = ds.get('openaireCompatibility', '')
-                    datasource_last_validated = ds.get('dateOfValidation', '')
-                    datasource_url = ds.get('websiteUrl', '')
-
-                    print(f"Processing Data Source: {datasource_name} (ID: {datasource_id})...")
-
-                    # Step 8: Get number of research products in data source
-                    ds_research_products_response = fetch_api_data(
-                        f"{config['OpenAIRE_API']}researchProducts",
-                        access_token,
-                        params={'relCollectedFromDatasourceId': datasource_id}
-                    )
-                    num_found_research_products_datasource = ds_research_products_response['header']['numFound']
-                    print(f"Research products in data source: {num_found_research_products_datasource}")
-
-                    # Step 9: Get research products in data source associated with organization
-                    ds_org_research_products_response = fetch_api_data(
-                        f"{config['OpenAIRE_API']}researchProducts",
-                        access_token,
-                        params={
-                            'relOrganizationId': openorg_id,
-                            'relCollectedFromDatasourceId': datasource_id
-                        }
-                    )
-                    num_found_research_products_datasource_and_openorgs = ds_org_research_products_response['header']['numFound']
-                    print(f"Research products in data source associated with organization: {num_found_research_products_datasource_and_openorgs}")
-
-                    # Step 10: Calculate missing research products in data source
-                    num_missing_research_products_in_datasource = num_found_research_products_datasource - num_found_research_products_datasource_and_openorgs
-                    print(f"Missing research products in data source: {num_missing_research_products_in_datasource}")
-
-                    # Step 11: Calculate missing research products in organization
-                    num_missing_research_products_in_openorgs = num_found_research_products_openorgs - num_found_research_products_datasource_and_openorgs
-                    print(f"Missing research products in organization: {num_missing_research_products_in_openorgs}")
-
-                    results.append({
-                        'ROR_ID': ror_link,
-                        'ROR_Name': institution_name,
-                        'ROR_Acronym': institution_acronym_en,
-                        'ROR_Acronym_Agg': institution_acronym_agg,
-                        'ROR_Group': institution_group,
-                        'OpenOrg_ID': openorg_id,
-                        'OpenOrg_Name': openorg_name,
-                        'OpenOrg_Website': openorg_websiteUrl,
-                        'DataSource_ID': datasource_id,
-                        'DataSource_Name': datasource_name,
-                        'DataSource_Compatibility': datasource_compatibility,
-                        'DataSource_LastValidated': datasource_last_validated,
-                        'DataSource_URL': datasource_url,
-                        'Num_Found_ResearchProducts_for_OpenOrg': num_found_research_products_openorgs,
-                        'Num_Found_ResearchProducts_for_DataSource': num_found_research_products_datasource,
-                        'Num_Found_ResearchProducts_for_OpenOrg_AND_DataSource': num_found_research_products_datasource_and_openorgs,
-                        'Num_Missing_ResearchProducts_in_DataSource': num_missing_research_products_in_datasource,
-                        'Num_Missing_ResearchProducts_in_OpenOrg': num_missing_research_products_in_openorgs,
-                    })
-
-    # Save results to CSV
-    timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M')
-    output_file = f"{timestamp}_nl-stats.csv"
-    df = pd.DataFrame(results)
-    df['Retrieved_On'] = datetime.datetime.now()
-    df.to_csv(output_file, index=False)
-    print(f"Results saved to {output_file}")
+        print(f"Missing research product IDs written to {missing_dir}, see {summary_file}")
+
+    # Works in OpenAlex next to the research products of the run (see nlportal/providers.py)
+    if comparison is not None:
+        provider, counts = comparison
+        try:
+            comparison_file = f"{writer.csv_path[:-4]}-providers.csv"
+            comparison_table(pd.read_csv(writer.csv_path), [counts.result()]).to_csv(comparison_file, index=False)
+            print(f"Works counts of OpenAIRE and OpenAlex written to {comparison_file}")
+        except Exception as e:
+            print(f"Counting the works in OpenAlex failed: {e}")
+        provider.close()
+    client.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,80 @@
+import argparse
+import ast
+import os
+import sys
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from mock_graph_api import default_snapshot
+from nlportal.datasources import combine_datasources, expand_datasources
+
+# Columns of df_orgs in nl-metadata-stats.ipynb when the data sources are expanded
+ORG_COLUMNS = [
+    'full_name_in_English', 'acronym_EN', 'acronym_AGG', 'main_grouping', 'ROR', 'ROR_LINK',
+    'OpenAlex_ID', 'OpenAlex_LINK', 'OpenAIRE_ID', 'OpenAIRE_LINK', 'OpenAIRE_Org_ID', 'OpenAIRE_Org_ID_Explore_URL',
+    'numFound_ResearchProducts_OpenOrgs', 'numFound_ResearchProjects_OpenOrgs', 'DataSources',
+]
+
+# df_orgs as the notebook has it after step 6, rebuilt from a wide nl-metadata-stats file. With scale > 1
+# the organisations are repeated under other OpenOrg IDs, for a larger list.
+def load_orgs(path, scale=1):
+    df = pd.read_csv(path)
+    df_orgs = df[ORG_COLUMNS].drop_duplicates(subset=['OpenAIRE_Org_ID']).reset_index(drop=True)
+    df_orgs['DataSources'] = df_orgs['DataSources'].map(lambda value: ast.literal_eval(value) if isinstance(value, str) else None)
+    copies = [df_orgs]
+    for copy in range(1, scale):
+        copies.append(df_orgs.assign(OpenAIRE_Org_ID=df_orgs['OpenAIRE_Org_ID'].dropna() + f"-{copy}"))
+    return pd.concat(copies, ignore_index=True).drop_duplicates(subset=['OpenAIRE_Org_ID']).reset_index(drop=True)
+
+# Cells 18-20 of nl-metadata-stats.ipynb before the data source expansion moved to nlportal/datasources.py
+def expand_with_apply(df_orgs):
+    df_data_sources = df_orgs[['OpenAIRE_Org_ID', 'DataSources']].explode('DataSources').reset_index(drop=True)
+    df_data_sources = pd.concat([df_data_sources.drop(['DataSources'], axis=1), df_data_sources['DataSources'].apply(pd.Series)], axis=1)
+    if '0' in df_data_sources.columns:
+        df_data_sources = df_data_sources.drop(columns=['0'])
+    df_data_sources['DataSource_Explore_URL'] = df_data_sources['DataSource_ID'].apply(
+        lambda x: f"https://explore.openaire.eu/search/dataprovider?datasourceId={x}" if pd.notnull(x) else None
+    )
+    return pd.merge(df_orgs, df_data_sources, on='OpenAIRE_Org_ID', how='inner', suffixes=('_orgs', '_data_sources'))
+
+def expand_vectorized(df_orgs):
+    return combine_datasources(df_orgs, expand_datasources(df_orgs))
+
+# Best wall time of repeat calls, in milliseconds, and the result of the last one
+def best_time(func, df_orgs, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(df_orgs)
+        times.append((time.perf_counter() - start) * 1000)
+    return min(times), result
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Time the data source expansion of nl-metadata-stats.ipynb: explode + apply(pd.Series) + merge against nlportal.datasources.")
+    parser.add_argument('--snapshot', help="wide nl-metadata-stats CSV (default: the latest one for the long RPO list)")
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 10], help="number of copies of the organisations (default: 1 10)")
+    parser.add_argument('--repeat', type=int, default=10, help="calls per variant, the best is reported (default: 10)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    snapshot = args.snapshot or default_snapshot()
+    print(f"Organisations and data sources from {os.path.basename(snapshot)}")
+    results = []
+    for scale in args.scale:
+        df_orgs = load_orgs(snapshot, scale)
+        before, expected = best_time(expand_with_apply, df_orgs, args.repeat)
+        after, combined = best_time(expand_vectorized, df_orgs, args.repeat)
+        # The same frame, apart from the empty column 0 that apply(pd.Series) adds
+        expected = expected.drop(columns=[column for column in expected.columns if column == 0])
+        pd.testing.assert_frame_equal(expected, combined, check_column_type=False)
+        results.append({
+            'organisations': len(df_orgs), 'rows': len(combined),
+            'apply_ms': round(before, 2), 'vectorized_ms': round(after, 2), 'speedup': round(before / after, 1),
+        })
+    print(pd.DataFrame(results).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+import argparse
+import ast
+import base64
+import glob
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+import pandas as pd
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Stand-in for the OpenAIRE Graph API and its OIDC token endpoint, for benchmarks and offline testing.
+#
+# The organizations, data sources and counts come from an nl-metadata-stats snapshot in the
+# repository, so nl-stats.py run against it gets the same numbers as the run that made the
+# snapshot. Result pages contain synthetic research products of a realistic size.
+# Usage: python benchmarks/mock_graph_api.py --port 8080 --latency 50 --throttle-rate 0.02
+# and set OpenAIRE_API to http://127.0.0.1:8080/graph/ and OpenAIRE_AAI_URL to
+# http://127.0.0.1:8080/oidc/token in config.yaml. The works counts of OpenAlex are served
+# under http://127.0.0.1:8080/openalex/ (OpenAlex_API).
+
+# The snapshot the mock is seeded from by default: the latest one for the long RPO list
+def default_snapshot():
+    return max(glob.glob(os.path.join(REPO_DIR, 'nl-metadata-stats_*_for_rpo_nl_list_long_*.csv')))
+
+def _count(value):
+    return 0 if pd.isna(value) else int(value)
+
+def _text(value):
+    return None if pd.isna(value) else value
+
+# Organizations, data sources and counts served by the mock
+class GraphData:
+    def __init__(self, snapshot_file=None, window_files=None):
+        snapshot = pd.read_csv(snapshot_file or default_snapshot())
+        # ROR link -> OpenOrg IDs, OpenOrg ID -> details and counts
+        self.orgs_by_ror = {}
+        self.orgs = {}
+        # OpenOrg ID -> data sources (as the dataSources endpoint returns them)
+        self.datasources = {}
+        # Research product counts per data source, per (OpenOrg, data source) pair and per (OpenOrg, from, to) window
+        self.datasource_counts = {}
+        self.pair_counts = {}
+        self.window_counts = {}
+        # Data source ID -> (OpenOrg ID, count) of its pairs
+        self.datasource_pairs = {}
+        # OpenAlex institution ID -> the OpenOrg IDs of its ROR link
+        self.openalex_orgs = {}
+
+        for ror_link, rows in snapshot.groupby('ROR_LINK', sort=False):
+            org_ids = [org_id for org_id in rows['OpenAIRE_Org_ID'].dropna().unique()]
+            self.orgs_by_ror[ror_link] = org_ids
+            if 'OpenAlex_ID' in rows and rows['OpenAlex_ID'].notna().any():
+                self.openalex_orgs[rows['OpenAlex_ID'].dropna().iloc[0]] = org_ids
+            for org_id in org_ids:
+                org_rows = rows[rows['OpenAIRE_Org_ID'] == org_id]
+                first = org_rows.iloc[0]
+                self.orgs[org_id] = {
+                    'id': org_id,
+                    'legalName': first['full_name_in_English'],
+                    'legalShortName': _text(first['acronym_EN']),
+                    'websiteUrl': None,
+                    'country': {'code': 'NL', 'label': 'Netherlands'},
+                    'pids': [{'scheme': 'ROR', 'value': ror_link}],
+                    'products': _count(first['numFound_ResearchProducts_OpenOrgs']),
+                    'projects': _count(first['numFound_ResearchProjects_OpenOrgs']),
+                }
+                datasources = ast.literal_eval(first['DataSources']) if isinstance(first['DataSources'], str) else []
+                self.datasources[org_id] = [{
+                    'id': ds['DataSource_ID'],
+                    'officialName': ds.get('DataSource_Name'),
+                    'openaireCompatibility': ds.get('DataSource_Compatibility'),
+                    'dateOfValidation': ds.get('DataSource_LastValidated'),
+                    'websiteUrl': ds.get('DataSource_URL'),
+                } for ds in datasources]
+                for index, row in org_rows.iterrows():
+                    if pd.isna(row['DataSource_ID']):
+                        continue
+                    self.datasource_counts[row['DataSource_ID']] = _count(row['numFound_ResearchProducts_DataSource'])
+                    self.pair_counts[(org_id, row['DataSource_ID'])] = _count(row['numFound_ResearchProducts_DataSource_AND_OpenOrgs'])
+                    self.datasource_pairs.setdefault(row['DataSource_ID'], []).append((org_id, self.pair_counts[(org_id, row['DataSource_ID'])]))
+
+        # Publication date windows of the org_stats files, e.g. org_stats_2021_2024.csv
+        for path in window_files if window_files is not None else glob.glob(os.path.join(REPO_DIR, 'org_stats_*_*.csv')):
+            start, end = os.path.basename(path)[:-4].split('_')[-2:]
+            stats = pd.read_csv(path)
+            for index, row in stats.iterrows():
+                if pd.isna(row['OpenAIRE_Org_ID']):
+                    continue
+                self.window_counts[(row['OpenAIRE_Org_ID'], start, end)] = _count(row[f"numFound_ResearchProducts_{start}_{end}"])
+        # OpenOrg ID -> its windows (start, end, count), earliest first
+        self.org_windows = {}
+        for (org_id, start, end), count in sorted(self.window_counts.items()):
+            self.org_windows.setdefault(org_id, []).append((int(start), int(end), count))
+        # OpenOrg ID -> {year: count}, so that the years of every known window add up to its count:
+        # a year in several windows gets the smallest per-year share of those windows, the years that
+        # are in one window only get the rest of its count (the remainder one by one over the first)
+        self.org_years = {}
+        for org_id, windows in self.org_windows.items():
+            containing = {}
+            for start, end, count in windows:
+                for year in range(start, end + 1):
+                    containing.setdefault(year, []).append((start, end, count))
+            years = {year: min(count // (end - start + 1) for start, end, count in found)
+                     for year, found in containing.items() if len(found) > 1}
+            for start, end, count in windows:
+                own_years = [year for year in range(start, end + 1) if len(containing[year]) == 1]
+                if own_years:
+                    rest = count - sum(years.get(year, 0) for year in range(start, end + 1))
+                    share, remainder = divmod(rest, len(own_years))
+                    for position, year in enumerate(own_years):
+                        years[year] = share + (1 if position < remainder else 0)
+            self.org_years[org_id] = years
+
+    # Number of research products matching the filters of a researchProducts query
+    def count_products(self, query):
+        org_id = query.get('relOrganizationId')
+        datasource_id = query.get('relCollectedFromDatasourceId')
+        if org_id and datasource_id:
+            return self.pair_counts.get((org_id, datasource_id), 0)
+        if datasource_id:
+            return self.datasource_counts.get(datasource_id, 0)
+        if org_id not in self.orgs and org_id not in self.org_years:
+            return 0
+        # OpenOrgs that are only in the org_stats files have the products of their windows
+        total = self.orgs[org_id]['products'] if org_id in self.orgs else sum(self.org_years[org_id].values())
+        if 'fromPublicationDate' in query or 'toPublicationDate' in query:
+            start = query.get('fromPublicationDate', '1900')[:4]
+            end = query.get('toPublicationDate', '2100')[:4]
+            if (org_id, start, end) in self.window_counts:
+                return self.window_counts[(org_id, start, end)]
+            # Other windows: the sum of the counts of their years, at most all products (or the products
+            # of the known windows, which in the org_stats files can be more than the snapshot total)
+            ceiling = max(total, sum(self.org_years.get(org_id, {}).values()))
+            return min(ceiling, sum(self.year_count(org_id, year) for year in range(max(int(start), 1995), min(int(end), 2025) + 1)))
+        return total
+
+    # Identity of the product at a position of the results of an organisation and/or data source query,
+    # such that the products of a pair are also among the products of the organisation and of the data
+    # source: an organisation lists the products it shares with each of its data sources first, then its
+    # other products, and a data source likewise. None for other queries.
+    def product_key(self, query, position):
+        org_id = query.get('relOrganizationId')
+        datasource_id = query.get('relCollectedFromDatasourceId')
+        if set(query) - {'relOrganizationId', 'relCollectedFromDatasourceId', 'page', 'pageSize', 'cursor'}:
+            return None
+        if org_id and datasource_id:
+            return f"{org_id}|{datasource_id}|{position}"
+        if datasource_id:
+            pairs = [(pair_org_id, datasource_id, count) for pair_org_id, count in self.datasource_pairs.get(datasource_id, [])]
+        elif org_id:
+            pairs = [(org_id, ds['id'], self.pair_counts.get((org_id, ds['id']), 0)) for ds in self.datasources.get(org_id, [])]
+        else:
+            return None
+        offset = position
+        for pair_org_id, pair_datasource_id, count in pairs:
+            if offset < count:
+                return f"{pair_org_id}|{pair_datasource_id}|{offset}"
+            offset -= count
+        return f"{org_id or datasource_id}|{position}"
+
+    # Products of an organisation in one publication year: its share of the known windows
+    # containing the year (see org_years), or else a fixed share of all its products
+    def year_count(self, org_id, year):
+        if year in self.org_years.get(org_id, {}):
+            return self.org_years[org_id][year]
+        return self.orgs[org_id]['products'] // 30 if org_id in self.orgs else 0
+
+    # Works of an OpenAlex institution (in one publication year): the research products of its
+    # OpenOrgs, give or take up to 20% depending on the institution
+    def openalex_works(self, openalex_id, year=None):
+        org_ids = self.openalex_orgs.get(openalex_id, [])
+        share = 0.8 + 0.4 * int(hashlib.md5(openalex_id.encode()).hexdigest()[:4], 16) / 0xffff
+        if year is None:
+            return int(share * sum(self.orgs[org_id]['products'] for org_id in org_ids))
+        return int(share * sum(self.year_count(org_id, year) for org_id in org_ids))
+
+# A synthetic research product of about the size of a real Graph API record. Like real records,
+# not all have a DOI, abstract, license, funder, ORCID iDs or publisher (decided by the digest).
+def make_product(seed):
+    digest = hashlib.md5(seed.encode()).hexdigest()
+    has = lambda position, sixteenths: int(digest[position], 16) < sixteenths
+    product = {
+        'id': f"50|mock________::{digest}",
+        'type': 'publication',
+        'mainTitle': f"Synthetic research product {digest[:8]}",
+        'publicationDate': f"{2000 + int(digest[:2], 16) % 25}-{1 + int(digest[2:4], 16) % 12:02d}-01",
+        'pids': [{'scheme': 'doi', 'value': f"10.5555/{digest[:12]}"}] if has(4, 13) else [],
+        'authors': [
+            dict({'fullName': f"Author {digest[i:i + 4]}", 'rank': i // 4 + 1},
+                 **({'pid': {'id': {'scheme': 'orcid', 'value': f"0000-0002-{digest[i:i + 4]}-0000"}}} if has(8, 6) and i < 8 else {}))
+            for i in range(0, 20, 4)
+        ],
+        'descriptions': [' '.join(['Lorem ipsum dolor sit amet, consectetur adipiscing elit.'] * 12)] if has(5, 11) else [],
+        'bestAccessRight': {'code': 'c_abf2', 'label': 'OPEN'},
+        'instances': [dict({'type': 'Article', 'urls': [f"https://example.org/{digest}"]}, **({'license': 'CC BY'} if has(6, 8) else {}))],
+    }
+    if has(7, 5):
+        product['projects'] = [{'id': f"40|mock________::{digest[:16]}", 'code': digest[:6], 'funder': {'shortName': 'NWO', 'name': 'Dutch Research Council'}}]
+    if has(9, 14):
+        product['publisher'] = 'Mock Publisher'
+    return product
+
+# Request handler; data and the injection settings are set on a subclass by make_server()
+class GraphAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Write responses in one go, small writes run into delayed ACKs on keep-alive connections
+    wbufsize = 65536
+    data = None
+    latency = 0.0
+    jitter = 0.0
+    # Extra response time of a researchProducts query per 100,000 results
+    size_latency = 0.0
+    error_rate = 0.0
+    throttle_rate = 0.0
+    retry_after = 1
+    stats = None
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+        self.count('bytes', len(payload))
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + amount
+
+    # Token endpoint: any client id and secret are accepted
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.count('token')
+        self.send_json(200, {'access_token': f"mock-token-{self.stats['token']}", 'token_type': 'Bearer', 'expires_in': 3600})
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/stats':
+            with self.lock:
+                stats = dict(self.stats)
+            return self.send_json(200, stats)
+        self.count('requests')
+        openalex = url.path.startswith('/openalex/')
+        if not openalex and not self.headers.get('Authorization', '').startswith('Bearer '):
+            return self.send_json(401, {'error': 'Missing access token'})
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+        if random.random() < self.throttle_rate:
+            self.count('throttled')
+            return self.send_json(429, {'error': 'Too many requests'}, {'Retry-After': str(self.retry_after)})
+        if random.random() < self.error_rate:
+            self.count('errors')
+            return self.send_json(random.choice([500, 502, 503]), {'error': 'Injected server error'})
+
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        if openalex:
+            return self.send_works(query)
+        segments = [unquote(segment) for segment in url.path.split('/') if segment]
+        if len(segments) < 2:
+            return self.send_json(404, {'error': 'Not found'})
+        if segments[-2] == 'organizations':
+            org = self.data.orgs.get(segments[-1])
+            if org is None:
+                return self.send_json(404, {'error': 'Organization not found'})
+            return self.send_json(200, {key: value for key, value in org.items() if key not in ('products', 'projects')})
+        endpoint = segments[-1]
+        if endpoint == 'organizations':
+            org_ids = self.data.orgs_by_ror.get(query.get('pid'), [])
+            results = [{key: value for key, value in self.data.orgs[org_id].items() if key not in ('products', 'projects')} for org_id in org_ids]
+            return self.send_page(query, len(results), results)
+        if endpoint == 'dataSources':
+            results = self.data.datasources.get(query.get('relOrganizationId'), [])
+            return self.send_page(query, len(results), results)
+        if endpoint == 'projects':
+            org = self.data.orgs.get(query.get('relOrganizationId'))
+            return self.send_page(query, org['projects'] if org else 0)
+        if endpoint == 'researchProducts':
+            num_found = self.data.count_products(query)
+            if self.size_latency:
+                time.sleep(self.size_latency * num_found / 100000)
+            return self.send_page(query, num_found)
+        return self.send_json(404, {'error': f"Unknown endpoint {endpoint}"})
+
+    # Answer with one page of results; without given results, synthetic records are generated.
+    # With a cursor ('*' for the first page) the page is the one after the cursor, and the header
+    # has the nextCursor of the page after it, as long as there is one.
+    def send_page(self, query, num_found, results=None):
+        page_size = int(query.get('pageSize', 10))
+        page = int(query.get('page', 1))
+        cursor = query.get('cursor')
+        first = (page - 1) * page_size
+        if cursor is not None:
+            first = 0 if cursor == '*' else int(base64.urlsafe_b64decode(cursor.encode()).decode())
+        if results is None:
+            seed = json.dumps(sorted((name, value) for name, value in query.items() if name not in ('page', 'cursor')))
+            results = [make_product(self.data.product_key(query, position) or f"{seed}{position}") for position in range(first, min(num_found, first + page_size))]
+        else:
+            results = results[first:first + page_size]
+        header = {'numFound': num_found, 'maxScore': 1.0, 'queryTime': 1, 'pageSize': page_size}
+        if cursor is None:
+            header['page'] = page
+        elif first + page_size < num_found:
+            header['nextCursor'] = base64.urlsafe_b64encode(str(first + page_size).encode()).decode()
+        self.send_json(200, {'header': header, 'results': results})
+
+    # OpenAlex works query (/openalex/works): meta.count for filter=institutions.id:I...[,publication_year:2020-2024],
+    # with group_by=publication_year also the count of every year. No work records are returned.
+    def send_works(self, query):
+        filters = dict(item.split(':', 1) for item in query.get('filter', '').split(',') if ':' in item)
+        openalex_id = filters.get('institutions.id', '').rsplit('/', 1)[-1]
+        if openalex_id not in self.data.openalex_orgs:
+            return self.send_json(200, {'meta': {'count': 0, 'page': 1, 'per_page': 25}, 'results': [], 'group_by': []})
+        if 'publication_year' not in filters:
+            count = self.data.openalex_works(openalex_id)
+            years = range(1995, 2026) if query.get('group_by') == 'publication_year' else []
+        else:
+            start, end = (filters['publication_year'].split('-') + [filters['publication_year']])[:2]
+            years = range(int(start), int(end) + 1)
+            count = sum(self.data.openalex_works(openalex_id, year) for year in years)
+        group_by = [{'key': str(year), 'key_display_name': str(year), 'count': self.data.openalex_works(openalex_id, year)} for year in years]
+        meta = {'count': count, 'page': 1, 'per_page': int(query.get('per-page', 25))}
+        if query.get('group_by') == 'publication_year':
+            meta['groups_count'] = len(group_by)
+            return self.send_json(200, {'meta': meta, 'results': [], 'group_by': group_by})
+        self.send_json(200, {'meta': meta, 'results': []})
+
+# An HTTP server with the mock API, not started yet (call serve_forever(), e.g. on a thread)
+def make_server(port=0, data=None, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=1, size_latency=0.0):
+    # latency, jitter and size_latency in seconds
+    handler = type('Handler', (GraphAPIHandler,), {
+        'data': data or GraphData(),
+        'latency': latency,
+        'jitter': jitter,
+        'size_latency': size_latency,
+        'error_rate': error_rate,
+        'throttle_rate': throttle_rate,
+        'retry_after': retry_after,
+        'stats': {'token': 0, 'requests': 0, 'throttled': 0, 'errors': 0, 'bytes': 0},
+        'lock': threading.Lock(),
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    return server
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAIRE Graph API, seeded from an nl-metadata-stats snapshot.")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--snapshot', help="nl-metadata-stats CSV to serve (default: the latest one for the long RPO list)")
+    parser.add_argument('--latency', type=float, default=0, help="mean response time in milliseconds")
+    parser.add_argument('--jitter', type=float, default=0, help="standard deviation of the response time in milliseconds")
+    parser.add_argument('--size-latency', type=float, default=0, help="extra response time of researchProducts queries in milliseconds per 100,000 results")
+    parser.add_argument('--error-rate', type=float, default=0, help="share of requests answered with 500, 502 or 503")
+    parser.add_argument('--throttle-rate', type=float, default=0, help="share of requests answered with 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After seconds sent with a 429")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    server = make_server(
+        args.port, GraphData(args.snapshot), args.latency / 1000, args.jitter / 1000,
+        args.error_rate, args.throttle_rate, args.retry_after, args.size_latency / 1000,
+    )
+    print(f"Mock Graph API on http://127.0.0.1:{server.server_address[1]}/graph/, token endpoint http://127.0.0.1:{server.server_address[1]}/oidc/token")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
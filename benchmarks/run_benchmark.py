@@ -0,0 +1,121 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import pandas as pd
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mock_graph_api import REPO_DIR, GraphData, make_server
+
+# Input lists that can be benchmarked, by short name
+LISTS = {
+    'test': 'rpo_nl_list_test_20240201.csv',
+    'long': 'rpo_nl_list_long_20240201.csv',
+}
+
+# Runs the script in a child process and reports its peak memory (in KB, as ru_maxrss on Linux) on stderr
+RUNNER = """
+import resource, runpy, sys
+script = sys.argv[1]
+sys.argv = sys.argv[1:]
+try:
+    runpy.run_path(script, run_name='__main__')
+finally:
+    sys.stderr.write(f"\\nPEAK_RSS_KB={resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}\\n")
+"""
+
+def get_stats(port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/stats") as response:
+        return json.load(response)
+
+# Run the script once in a fresh directory against the mock, return the measurements
+def run_once(script, list_name, port, settings, script_args):
+    workdir = tempfile.mkdtemp(prefix='nl-stats-benchmark-')
+    try:
+        shutil.copy(os.path.join(REPO_DIR, LISTS[list_name]), workdir)
+        config = {
+            'CLIENT_ID': 'benchmark',
+            'CLIENT_SECRET': 'benchmark',
+            'OpenAIRE_API': f"http://127.0.0.1:{port}/graph/",
+            'OpenAIRE_AAI_URL': f"http://127.0.0.1:{port}/oidc/token",
+            'Org_data_file': LISTS[list_name],
+        }
+        config.update(settings)
+        with open(os.path.join(workdir, 'config.yaml'), 'w') as file:
+            yaml.safe_dump(config, file)
+
+        before = get_stats(port)
+        start = time.monotonic()
+        process = subprocess.run(
+            [sys.executable, '-c', RUNNER, os.path.abspath(script)] + script_args,
+            cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+        )
+        wall_time = time.monotonic() - start
+        after = get_stats(port)
+        if process.returncode != 0:
+            raise Exception(f"{script} failed on the {list_name} list:\n{process.stderr[-2000:]}")
+        peak = [line for line in process.stderr.splitlines() if line.startswith('PEAK_RSS_KB=')]
+        calls = after['requests'] - before['requests']
+        return {
+            'wall_time_s': round(wall_time, 2),
+            'api_calls': calls,
+            'calls_per_s': round(calls / wall_time, 1) if wall_time else None,
+            'throttled': after['throttled'] - before['throttled'],
+            'errors': after['errors'] - before['errors'],
+            'mb_received': round((after['bytes'] - before['bytes']) / 1e6, 2),
+            'peak_memory_mb': round(int(peak[-1].split('=')[1]) / 1024, 1) if peak else None,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark nl-stats.py end to end against the local mock Graph API.")
+    parser.add_argument('--script', default=os.path.join(REPO_DIR, 'arxiv', 'nl-stats.py'), help="script to benchmark (default: arxiv/nl-stats.py)")
+    parser.add_argument('--lists', nargs='+', choices=sorted(LISTS), default=['test', 'long'], help="input lists to run")
+    parser.add_argument('--max-in-flight', nargs='+', type=int, default=[1, 8], help="Max_in_flight settings to compare")
+    parser.add_argument('--repeat', type=int, default=1, help="runs per setting, the fastest one is reported")
+    parser.add_argument('--latency', type=float, default=50, help="mean API response time in milliseconds")
+    parser.add_argument('--jitter', type=float, default=10, help="standard deviation of the response time in milliseconds")
+    parser.add_argument('--error-rate', type=float, default=0, help="share of requests answered with 500, 502 or 503")
+    parser.add_argument('--throttle-rate', type=float, default=0, help="share of requests answered with 429")
+    parser.add_argument('--retry-after', type=int, default=0, help="Retry-After seconds sent with a 429")
+    parser.add_argument('--rate-limit', type=float, default=1000, help="Rate_limit and Rate_limit_max for the client, high by default so the mock latency dominates")
+    parser.add_argument('--output', help="also write the results to this CSV file")
+    parser.add_argument('script_args', nargs=argparse.REMAINDER, help="arguments passed on to the script, after --")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    script_args = [arg for arg in args.script_args if arg != '--']
+    server = make_server(0, GraphData(), args.latency / 1000, args.jitter / 1000, args.error_rate, args.throttle_rate, args.retry_after)
+    port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Mock Graph API running on port {port} (latency {args.latency} ms, errors {args.error_rate:.0%}, throttled {args.throttle_rate:.0%})")
+
+    results = []
+    for list_name in args.lists:
+        for max_in_flight in args.max_in_flight:
+            settings = {'Max_in_flight': max_in_flight, 'Rate_limit': args.rate_limit, 'Rate_limit_max': args.rate_limit}
+            runs = [run_once(args.script, list_name, port, settings, script_args) for _ in range(args.repeat)]
+            best = min(runs, key=lambda run: run['wall_time_s'])
+            result = {'script': os.path.basename(args.script), 'list': list_name, 'max_in_flight': max_in_flight}
+            result.update(best)
+            print(', '.join(f"{key}={value}" for key, value in result.items()))
+            results.append(result)
+    server.shutdown()
+
+    report = pd.DataFrame(results)
+    print(report.to_string(index=False))
+    if args.output:
+        report.to_csv(args.output, index=False)
+        print(f"Results saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
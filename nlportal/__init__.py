@@ -0,0 +1 @@
+# Shared building blocks for the nl-stats scripts and the notebooks
@@ -0,0 +1,114 @@
+import json
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit, parse_qsl
+
+# How long (in seconds) a cached response stays valid, per Graph API endpoint
+DEFAULT_TTLS = {
+    'organizations': 30 * 24 * 3600,  # names, urls and pids rarely change
+    'dataSources': 7 * 24 * 3600,
+    'projects': 7 * 24 * 3600,
+    'researchProducts': 24 * 3600,  # counts change daily
+}
+DEFAULT_TTL = 24 * 3600
+
+# Cache modes: use fresh entries, ignore what is cached (and overwrite it), or never go to the API
+CACHE_MODES = ('normal', 'refresh', 'offline')
+
+# Persistent SQLite cache of API responses, keyed by url and normalized query parameters
+class ResponseCache:
+    def __init__(self, path, ttls=None, max_entries=200000, mode='normal'):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}, expected one of {CACHE_MODES}")
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.max_entries = max_entries
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # A lost write only means a request is made again, no need to sync every commit
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            ' key TEXT PRIMARY KEY,'
+            ' endpoint TEXT NOT NULL,'
+            ' body TEXT NOT NULL,'
+            ' stored_at REAL NOT NULL,'
+            ' accessed_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)')
+        self._conn.commit()
+
+    # Build the cache key: the url without its query string plus the sorted, stringified parameters.
+    # Parameters given in the url and in params are treated the same.
+    @staticmethod
+    def make_key(url, params=None):
+        parts = urlsplit(url)
+        items = parse_qsl(parts.query, keep_blank_values=True)
+        items += [(k, str(v)) for k, v in (params or {}).items() if v is not None]
+        base = f"{parts.scheme}://{parts.netloc}{parts.path.rstrip('/')}"
+        return f"{base}?{json.dumps(sorted(items))}"
+
+    # The Graph API endpoint a url belongs to, e.g. 'organizations' for .../organizations/{id}
+    def endpoint_of(self, url):
+        for segment in urlsplit(url).path.split('/'):
+            if segment in self.ttls:
+                return segment
+        return ''
+
+    # Return the cached response for the url, or None when it is missing or expired
+    def get(self, url, params=None):
+        if self.mode == 'refresh':
+            return None
+        key = self.make_key(url, params)
+        with self._lock:
+            row = self._conn.execute('SELECT body, stored_at FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            body, stored_at = row
+            ttl = self.ttls.get(self.endpoint_of(url), DEFAULT_TTL)
+            # Offline runs use whatever is there, however old
+            if self.mode != 'offline' and time.time() - stored_at > ttl:
+                self.misses += 1
+                return None
+            self._conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(body)
+
+    def set(self, url, params, data):
+        key = self.make_key(url, params)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (key, endpoint, body, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+                (key, self.endpoint_of(url), json.dumps(data), now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    # Drop the least recently used entries once the cache holds more than max_entries.
+    # The size is only checked every 1000 writes, counting rows is not free on large caches.
+    def _evict(self):
+        self._writes += 1
+        if not self.max_entries or self._writes % 1000 != 1:
+            return
+        (count,) = self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()
+        if count <= self.max_entries:
+            return
+        # Remove an extra 10% so eviction does not run on every insert
+        excess = count - self.max_entries + self.max_entries // 10
+        self._conn.execute(
+            'DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed_at LIMIT ?)',
+            (excess,)
+        )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,231 @@
+import threading
+import time
+from urllib.parse import parse_qsl, urlsplit, urlunsplit
+import requests
+from requests.adapters import HTTPAdapter
+from .cache import ResponseCache
+from .instrumentation import Instrumentation
+from .ratelimit import THROTTLE_STATUSES, AdaptiveRateLimiter, CircuitBreaker, RetryPolicy, parse_retry_after
+
+OPENAIRE_AAI_URL = "https://aai.openaire.eu/oidc/token"
+OPENAIRE_API_URL = "https://api-beta.openaire.eu/graph/"
+
+# Parameters that do not change the number of results of a query
+COUNT_DROPPED_PARAMS = ('page', 'pageSize', 'sortBy', 'cursor')
+
+# Raised when the API answers with anything but 200
+class APIError(Exception):
+    def __init__(self, status_code, text):
+        super().__init__(f"API request failed: {status_code}, {text}")
+        self.status_code = status_code
+        self.text = text
+
+# Keep the OIDC access token and fetch a new one shortly before it expires
+class AccessToken:
+    def __init__(self, session, client_id, client_secret, aai_url=OPENAIRE_AAI_URL, refresh_margin=120):
+        self.session = session
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.aai_url = aai_url
+        # Seconds before expiry at which the token is refreshed
+        self.refresh_margin = refresh_margin
+        self._token = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._token is None or time.monotonic() >= self._expires_at - self.refresh_margin:
+                self._refresh()
+            return self._token
+
+    # Drop the current token, e.g. after the API answered 401
+    def invalidate(self):
+        with self._lock:
+            self._token = None
+
+    def _refresh(self):
+        print("Requesting access token...")
+        response = self.session.post(
+            self.aai_url,
+            auth=(self.client_id, self.client_secret),
+            data={'grant_type': 'client_credentials'}
+        )
+        if response.status_code != 200:
+            raise Exception(f"Failed to retrieve access token: {response.status_code}, {response.text}")
+        data = response.json()
+        self._token = data.get('access_token')
+        # Tokens are valid for one hour when the server does not say otherwise
+        self._expires_at = time.monotonic() + int(data.get('expires_in', 3600))
+        print("Access token retrieved successfully.")
+
+# Shared client for the OpenAIRE Graph API, reusing pooled keep-alive connections for all calls
+class OpenAIREClient:
+    def __init__(self, client_id, client_secret, api_url=OPENAIRE_API_URL, aai_url=OPENAIRE_AAI_URL, pool_size=10, cache=None,
+                 limiter=None, breaker=None, retry=None, instrumentation=None):
+        self.api_url = api_url if api_url.endswith('/') else f"{api_url}/"
+        # Optional ResponseCache consulted by get()
+        self.cache = cache
+        # Shared by all threads: pacing of the requests, per-endpoint circuits and the retry schedule
+        self.limiter = limiter or AdaptiveRateLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self.retry = retry or RetryPolicy()
+        # Timing records of all requests, see Instrumentation
+        self.instrumentation = instrumentation or Instrumentation()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate',
+        })
+        self.token = AccessToken(self.session, client_id, client_secret, aai_url)
+
+    # Build a client from the settings in config.yaml.
+    # cache_mode ('normal', 'refresh' or 'offline') overrides Cache_mode from the config,
+    # trace_file (JSON lines with a record per request) overrides Trace_file, and limiter replaces
+    # the rate limiter made from Rate_limit (e.g. with one shared by several processes).
+    @classmethod
+    def from_config(cls, config, cache_mode=None, trace_file=None, limiter=None):
+        api_url = config.get('OpenAIRE_API') or config.get('OpenAIRE_API_URL') or OPENAIRE_API_URL
+        pool_size = config.get('Pool_size') or max(10, int(config.get('Max_in_flight') or 1))
+        cache = None
+        cache_mode = cache_mode or config.get('Cache_mode') or 'normal'
+        if config.get('Cache_file') or cache_mode != 'normal':
+            cache = ResponseCache(
+                config.get('Cache_file') or 'nl-stats-cache.sqlite',
+                ttls=config.get('Cache_ttl'),
+                max_entries=config.get('Cache_max_entries', 200000),
+                mode=cache_mode,
+            )
+        rate = float(config.get('Rate_limit') or 10)
+        return cls(
+            config['CLIENT_ID'],
+            config['CLIENT_SECRET'],
+            api_url=api_url,
+            aai_url=config.get('OpenAIRE_AAI_URL') or OPENAIRE_AAI_URL,
+            pool_size=pool_size,
+            cache=cache,
+            limiter=limiter or AdaptiveRateLimiter(rate=rate, max_rate=max(rate, float(config.get('Rate_limit_max') or 50))),
+            retry=RetryPolicy(max_retries=int(config.get('Max_retries', 4))),
+            instrumentation=Instrumentation(trace_file or config.get('Trace_file')),
+        )
+
+    # Endpoints are relative to the API url (e.g. 'researchProducts'), full urls are used as they are
+    def url(self, endpoint):
+        if endpoint.startswith('http://') or endpoint.startswith('https://'):
+            return endpoint
+        return f"{self.api_url}{endpoint.lstrip('/')}"
+
+    # Name of the endpoint a url belongs to, e.g. 'organizations/{id}' for organizations/openorgs____::0000
+    def endpoint_name(self, url):
+        if not url.startswith(self.api_url):
+            return urlsplit(url).path.rstrip('/').split('/')[-1]
+        segments = [segment for segment in urlsplit(url).path[len(urlsplit(self.api_url).path):].split('/') if segment]
+        if not segments:
+            return ''
+        return segments[0] if len(segments) == 1 else f"{segments[0]}/{{id}}"
+
+    def _send(self, url, params):
+        self.limiter.acquire()
+        response = self.session.get(url, params=params, headers={'Authorization': f'Bearer {self.token.get()}'})
+        if response.status_code == 401:
+            # The token was revoked or expired early, try once more with a new one
+            self.token.invalidate()
+            response = self.session.get(url, params=params, headers={'Authorization': f'Bearer {self.token.get()}'})
+        return response
+
+    # Send an authenticated GET request and return the response, whatever its status.
+    # Throttling (429/503), server errors and connection errors are retried with backoff first.
+    def request(self, endpoint, params=None):
+        url = self.url(endpoint)
+        name = self.endpoint_name(url)
+        self.breaker.check(name)
+        attempt = 0
+        while True:
+            try:
+                response = self._send(url, params)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.retry.max_retries:
+                    self.breaker.record_failure(name)
+                    raise
+                delay = self.retry.delay(attempt)
+                print(f"Connection error ({e.__class__.__name__}). Retrying in {delay:.1f} seconds...")
+            except Exception:
+                # Any other error (e.g. a failed token request or a broken response body) still ends a
+                # half-open trial, otherwise the endpoint would stay closed for the rest of the run
+                self.breaker.record_failure(name)
+                raise
+            else:
+                response.retries = attempt
+                if response.status_code not in self.retry.statuses:
+                    self.limiter.on_success()
+                    self.breaker.record_success(name)
+                    return response
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if response.status_code in THROTTLE_STATUSES:
+                    self.limiter.on_throttle(retry_after)
+                if attempt >= self.retry.max_retries:
+                    self.breaker.record_failure(name)
+                    return response
+                delay = self.retry.delay(attempt, retry_after)
+                print(f"Server answered {response.status_code}. Retrying in {delay:.1f} seconds...")
+            time.sleep(delay)
+            attempt += 1
+
+    # Send an authenticated GET request and return the decoded JSON body, from the cache when possible.
+    # With header_only only the header of the response is returned (and cached), with cache=False the
+    # response cache is not used (e.g. for the pages of an export, which are read once).
+    def get(self, endpoint, params=None, header_only=False, cache=True):
+        url = self.url(endpoint)
+        use_cache = cache and self.cache is not None
+        # Parameters in the url itself (as in the notebooks) count for the report as well
+        label = dict(parse_qsl(urlsplit(url).query), **(params or {}))
+        name = self.endpoint_name(url)
+        start = time.monotonic()
+        # Header-only bodies are cached apart from full responses to the same query
+        cache_params = dict(params or {}, _header_only=1) if header_only else params
+        if use_cache:
+            data = self.cache.get(url, cache_params)
+            if data is not None:
+                self.instrumentation.request(name, label, time.monotonic() - start, cache='hit')
+                return data
+            if self.cache.mode == 'offline':
+                raise Exception(f"No cached response for {url} with params {params} (offline mode)")
+        cache = 'miss' if use_cache else None
+        try:
+            response = self.request(url, params)
+        except Exception as e:
+            self.instrumentation.request(name, label, time.monotonic() - start, cache=cache, error=str(e))
+            raise
+        if response.status_code != 200:
+            self.instrumentation.request(name, label, time.monotonic() - start, response.status_code, len(response.content),
+                                         response.retries, cache, error=response.text[:200])
+            raise APIError(response.status_code, response.text)
+        data = response.json()
+        if header_only:
+            data = {'header': data['header']}
+        self.instrumentation.request(name, label, time.monotonic() - start, response.status_code, len(response.content),
+                                     response.retries, cache)
+        if use_cache:
+            self.cache.set(url, cache_params, data)
+        return data
+
+    # Number of results of a search query (header.numFound). Only one result is requested,
+    # without sorting, so the API does not build and send a full page just to be counted.
+    # Paging and sorting parameters, also in the url itself, are dropped.
+    def count(self, endpoint, params=None):
+        parts = urlsplit(self.url(endpoint))
+        query = dict(parse_qsl(parts.query, keep_blank_values=True), **(params or {}))
+        for name in COUNT_DROPPED_PARAMS:
+            query.pop(name, None)
+        query['pageSize'] = 1
+        url = urlunsplit(parts._replace(query=''))
+        return self.get(url, query, header_only=True)['header']['numFound']
+
+    def close(self):
+        self.session.close()
+        self.instrumentation.close()
+        if self.cache is not None:
+            self.cache.close()
@@ -0,0 +1,160 @@
+import itertools
+import numpy as np
+import pandas as pd
+
+# Lower bounds of the size categories, smallest first: organisations with 40000 or more
+# research outputs are category 1 (zeer groot), less than 1000 category 5 (zeer klein)
+THRESHOLDS = (1000, 5000, 10000, 40000)
+CATEGORY_NAMES = {1: 'Zeer groot', 2: 'Groot', 3: 'Aanzienlijk', 4: 'Klein', 5: 'Zeer klein'}
+# Categories that pay the OpenAIRE membership; all categories but the smallest share the portal costs
+MEMBER_CATEGORIES = (1, 2)
+
+# The cost model of the consortium notebook. A scenario is a dict with (some of) these keys,
+# the ones it leaves out keep these values.
+DEFAULT_SCENARIO = {
+    'thresholds': THRESHOLDS,
+    'category_step_percentage': 0.50,    # 50% increase for each category
+    'membership_cost': 1860,             # €1,860 including 24% VAT
+    'group_discount': 558,               # €558 discount for 7+ national memberships
+    'openaire_bundle_cost': 12400,       # €12,400
+    'openaire_discount': -3720,          # -€3,720
+    'portal_development_fund': 3720,     # €3,720
+    'functional_management_cost': 14400, # €14,400
+}
+PORTAL_COST_KEYS = ['openaire_bundle_cost', 'openaire_discount', 'portal_development_fund', 'functional_management_cost']
+
+def scenario_of(scenario=None):
+    full = dict(DEFAULT_SCENARIO)
+    full.update(scenario or {})
+    unknown = set(full) - set(DEFAULT_SCENARIO)
+    if unknown:
+        raise Exception(f"Unknown scenario settings: {', '.join(sorted(unknown))}")
+    full['thresholds'] = tuple(sorted(full['thresholds']))
+    return full
+
+def total_portal_costs(scenario=None):
+    scenario = scenario_of(scenario)
+    return sum(scenario[key] for key in PORTAL_COST_KEYS)
+
+# Category of each number of outputs: 1 for the largest organisations up to len(thresholds) + 1
+# for the smallest. Integers, or floats with NaN where a number is missing (as the row-wise
+# categorize_outputs of the notebook gave), so the Category column is written as before.
+def categorize(counts, thresholds=THRESHOLDS):
+    counts = np.asarray(counts, dtype='float64')
+    thresholds = np.sort(np.asarray(thresholds, dtype='float64'))
+    categories = len(thresholds) + 1 - np.searchsorted(thresholds, counts, side='right')
+    missing = np.isnan(counts)
+    if not missing.any():
+        return categories.astype('int64')
+    categories = categories.astype('float64')
+    categories[missing] = np.nan
+    return categories
+
+# Share of the portal costs per paying category, as a table indexed by category with the number of
+# organisations, the weight, the cost of the category and the cost per organisation.
+# Each category weighs (1 + category_step_percentage) times the next smaller one; categories
+# without organisations get no share.
+def cost_shares(categories, scenario=None):
+    scenario = scenario_of(scenario)
+    organizations = pd.Series(categories).value_counts().sort_index()
+    organizations = organizations[organizations.index <= len(scenario['thresholds'])]
+    organizations.index = organizations.index.astype(int)
+    weights = (1 + scenario['category_step_percentage']) ** (len(organizations) - organizations.index.to_numpy(dtype='float64'))
+    weights = weights / weights.sum()
+    costs = total_portal_costs(scenario) * weights
+    return pd.DataFrame({
+        'organizations': organizations.to_numpy(),
+        'weight': weights,
+        'cost': costs,
+        'cost_per_organization': costs / organizations.to_numpy(),
+    }, index=pd.Index(organizations.index, name='Category'))
+
+# The cost columns of the notebook for one scenario: Category, annual OpenAIRE membership costs,
+# portal_costs and total_costs, added to a copy of df from the number of outputs in column
+def allocate(df, column, scenario=None):
+    scenario = scenario_of(scenario)
+    df = df.copy()
+    categories = categorize(df[column], scenario['thresholds'])
+    df['Category'] = categories
+    membership = np.where(np.isin(categories, MEMBER_CATEGORIES), scenario['membership_cost'] - scenario['group_discount'], np.nan)
+    df['annual OpenAIRE membership costs'] = membership
+    per_organization = cost_shares(categories, scenario)['cost_per_organization']
+    df['portal_costs'] = pd.Series(categories, index=df.index).map(per_organization)
+    df['total_costs'] = df['annual OpenAIRE membership costs'].fillna(0) + df['portal_costs'].fillna(0)
+    return df
+
+# All combinations of the given values as a scenario table, e.g.
+# scenario_grid(category_step_percentage=[0.25, 0.5, 1.0], thresholds=[(1000, 5000, 10000, 40000), (500, 5000, 20000, 50000)])
+def scenario_grid(**values):
+    scenario_of({name: options[0] for name, options in values.items()})
+    names = list(values)
+    return pd.DataFrame(list(itertools.product(*values.values())), columns=names)
+
+def _sweep_chunk(counts, scenarios, group_codes, group_count):
+    thresholds = np.sort(np.array(scenarios['thresholds'].tolist(), dtype='float64'), axis=1)
+    category_count = thresholds.shape[1] + 1
+    categories = np.arange(1, category_count + 1)
+    known = ~np.isnan(counts)
+
+    # Category of every organisation in every scenario: (scenarios, organisations), 0 if unknown
+    org_categories = category_count - (counts[None, None, :] >= thresholds[:, :, None]).sum(axis=1)
+    org_categories[:, ~known] = 0
+    in_category = org_categories[:, :, None] == categories[None, None, :]
+    organizations = in_category.sum(axis=1)
+
+    # Weights of the paying categories that have organisations, normalised per scenario
+    step = scenarios['category_step_percentage'].to_numpy(dtype='float64')
+    paying = (organizations > 0) & (categories[None, :] < category_count)
+    weights = (1 + step[:, None]) ** (paying.sum(axis=1, keepdims=True) - categories[None, :]).astype('float64')
+    weights = np.where(paying, weights, 0.0)
+    totals = weights.sum(axis=1, keepdims=True)
+    shares = np.divide(weights, totals, out=np.zeros_like(weights), where=totals > 0)
+    portal = sum(scenarios[key].to_numpy(dtype='float64') for key in PORTAL_COST_KEYS)
+    per_organization = np.divide(portal[:, None] * shares, organizations, out=np.zeros_like(shares), where=organizations > 0)
+
+    membership = (scenarios['membership_cost'] - scenarios['group_discount']).to_numpy(dtype='float64')
+    org_portal = np.take_along_axis(np.hstack([np.zeros((len(scenarios), 1)), per_organization]), org_categories, axis=1)
+    org_membership = np.where(np.isin(org_categories, MEMBER_CATEGORIES), membership[:, None], 0.0)
+    org_totals = org_portal + org_membership
+
+    result = {
+        'portal_costs': portal,
+        'distributed_portal_costs': org_portal.sum(axis=1),
+        'membership_costs': org_membership.sum(axis=1),
+        'total_costs': org_totals.sum(axis=1),
+        'paying_organizations': (org_totals > 0).sum(axis=1),
+        'max_org_costs': org_totals.max(axis=1, initial=0.0),
+    }
+    for index, category in enumerate(categories):
+        result[f"organizations_{category}"] = organizations[:, index]
+        result[f"cost_per_organization_{category}"] = per_organization[:, index]
+    if group_codes is not None:
+        group_totals = org_totals @ (group_codes[:, None] == np.arange(group_count)[None, :])
+        result['group_totals'] = group_totals
+    return result
+
+# Evaluate many scenarios at once. counts are the numbers of outputs of the organisations,
+# scenarios a list of scenario dicts or a table such as scenario_grid() returns, groups optionally
+# the main_grouping of each organisation (adds a total_costs_<group> column per group).
+# Returns one row per scenario: its settings, the portal costs and how they are distributed,
+# and the number of organisations and cost per organisation of every category.
+# Scenarios are evaluated chunk_size at a time to bound the memory used.
+def sweep(counts, scenarios, groups=None, chunk_size=2000):
+    counts = np.asarray(counts, dtype='float64')
+    scenarios = pd.DataFrame([scenario_of(scenario) for scenario in (scenarios.to_dict('records') if isinstance(scenarios, pd.DataFrame) else scenarios)])
+    if scenarios['thresholds'].map(len).nunique() > 1:
+        raise Exception("All scenarios of a sweep need the same number of thresholds")
+    group_codes, group_names = (None, [])
+    if groups is not None:
+        group_codes, group_names = pd.factorize(pd.Series(groups).fillna('unknown'), sort=True)
+
+    chunks = []
+    for start in range(0, len(scenarios), chunk_size):
+        chunk = scenarios.iloc[start:start + chunk_size].reset_index(drop=True)
+        result = _sweep_chunk(counts, chunk, group_codes, len(group_names))
+        group_totals = result.pop('group_totals', None)
+        table = pd.concat([chunk, pd.DataFrame(result)], axis=1)
+        for index, name in enumerate(group_names):
+            table[f"total_costs_{name}"] = group_totals[:, index]
+        chunks.append(table)
+    return pd.concat(chunks, ignore_index=True)
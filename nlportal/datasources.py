@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+# Fields of a dataSources result and the keys they get in the DataSources list of an organisation
+DATASOURCE_FIELDS = {
+    'id': 'DataSource_ID',
+    'officialName': 'DataSource_Name',
+    'openaireCompatibility': 'DataSource_Compatibility',
+    'dateOfValidation': 'DataSource_LastValidated',
+    'websiteUrl': 'DataSource_URL',
+}
+DATASOURCE_KEYS = list(DATASOURCE_FIELDS.values())
+EXPLORE_URL = "https://explore.openaire.eu/search/dataprovider?datasourceId="
+
+# The DataSources list of an organisation from the results of its dataSources response
+def datasource_list(results):
+    return [{key: result[field] for field, key in DATASOURCE_FIELDS.items()} for result in results]
+
+# Number of rows each organisation gets: one per data source, and one (without a data source)
+# when the list is empty or missing, as DataFrame.explode() does
+def _row_counts(lists):
+    lengths = np.fromiter((len(value) if isinstance(value, list) else 0 for value in lists), dtype=np.int64, count=len(lists))
+    return lengths, np.maximum(lengths, 1)
+
+# One row per data source of each organisation of df_orgs, in order: OpenAIRE_Org_ID, the
+# DataSource_* keys of its DataSources list and DataSource_Explore_URL. Organisations without data
+# sources get one row with empty DataSource_* columns.
+#
+# The records of all lists go into one frame (json_normalize) and are put at their row positions
+# with NumPy, instead of exploding the lists and making a Series per row with apply(pd.Series).
+# The rows and values are those of explode() + apply(pd.Series), without the column 0 that
+# apply(pd.Series) adds for the organisations without data sources.
+def expand_datasources(df_orgs):
+    lists = list(df_orgs['DataSources'])
+    lengths, counts = _row_counts(lists)
+    organisations = np.repeat(np.arange(len(lists)), counts)
+    columns = {'OpenAIRE_Org_ID': df_orgs['OpenAIRE_Org_ID'].iloc[organisations].reset_index(drop=True)}
+
+    records = pd.json_normalize([record for value, length in zip(lists, lengths) if length for record in value])
+    # Row of every record: the first row of its organisation plus its position in the list
+    starts = np.repeat(np.cumsum(counts) - counts, lengths)
+    rows = starts + np.arange(len(records)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    for key in DATASOURCE_KEYS:
+        values = np.full(len(organisations), np.nan, dtype=object)
+        if key in records:
+            values[rows] = records[key].to_numpy(dtype=object)
+        columns[key] = values
+    df = pd.DataFrame(columns)
+
+    ids = df['DataSource_ID']
+    df['DataSource_Explore_URL'] = (EXPLORE_URL + ids.where(ids.notna(), '')).where(ids.notna(), None)
+    return df
+
+# The organisations of df_orgs joined with their data sources (from expand_datasources()):
+# what pd.merge(df_orgs, df_data_sources, on='OpenAIRE_Org_ID', how='inner') gives. When every
+# organisation occurs once, the rows of each organisation are taken by position instead of
+# joining on the ID; otherwise (the same OpenOrg on several rows) pd.merge does the join.
+def combine_datasources(df_orgs, df_data_sources):
+    lists = list(df_orgs['DataSources'])
+    lengths, counts = _row_counts(lists)
+    organisations = np.repeat(np.arange(len(lists)), counts)
+    keys = df_orgs['OpenAIRE_Org_ID']
+    overlap = set(df_orgs.columns) & set(df_data_sources.columns) - {'OpenAIRE_Org_ID'}
+    aligned = len(df_data_sources) == len(organisations) and keys.iloc[organisations].reset_index(drop=True).equals(df_data_sources['OpenAIRE_Org_ID'].reset_index(drop=True))
+    if keys.duplicated().any() or overlap or not aligned:
+        return pd.merge(df_orgs, df_data_sources, on='OpenAIRE_Org_ID', how='inner', suffixes=('_orgs', '_data_sources'))
+    combined = df_orgs.iloc[organisations].reset_index(drop=True)
+    return pd.concat([combined, df_data_sources.drop(columns='OpenAIRE_Org_ID').reset_index(drop=True)], axis=1)
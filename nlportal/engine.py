@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+
+# Run API calls on a bounded thread pool, always returning results in submission order.
+#
+# Two separate pools are used: one for whole tasks (e.g. an institution) and one for
+# the individual requests those tasks fan out. Request jobs never wait on other jobs,
+# so a task blocking on its own requests can not starve the pool it is waiting on.
+class FetchEngine:
+    def __init__(self, max_in_flight=1):
+        self.max_in_flight = max(1, int(max_in_flight or 1))
+        self._task_pool = None
+        self._request_pool = None
+        if self.max_in_flight > 1:
+            self._task_pool = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='task')
+            self._request_pool = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='request')
+
+    @property
+    def concurrent(self):
+        return self._request_pool is not None
+
+    # Run independent calls, given as (func, args, kwargs) tuples, and return their results in order
+    def fetch_all(self, calls):
+        if not self.concurrent:
+            return [func(*args, **(kwargs or {})) for func, args, kwargs in calls]
+        futures = [self._request_pool.submit(func, *args, **(kwargs or {})) for func, args, kwargs in calls]
+        return [future.result() for future in futures]
+
+    # Apply func to every item as a task and return the results in the order of items
+    def map(self, func, items):
+        return list(self.imap(func, items))
+
+    # Like map, but yield each result as soon as it and all results before it are done
+    def imap(self, func, items):
+        if not self.concurrent:
+            for item in items:
+                yield func(item)
+            return
+        yield from self._task_pool.map(func, items)
+
+    def close(self):
+        for pool in (self._task_pool, self._request_pool):
+            if pool is not None:
+                pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,199 @@
+import argparse
+import gzip
+import json
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import yaml
+from .client import OpenAIREClient
+
+# Largest page the Graph API returns with cursor pagination
+MAX_PAGE_SIZE = 100
+FORMATS = ('jsonl', 'parquet')
+
+# Walk all result pages of a query with cursor pagination, yielding (cursor, next_cursor, header, results)
+# per page. fetch(endpoint, params) performs one request, e.g. fetch_api_data or client.get.
+# Start from a cursor of an earlier walk to continue it; the walk ends when no nextCursor is returned.
+def iter_pages(fetch, endpoint, params=None, page_size=MAX_PAGE_SIZE, cursor='*'):
+    params = {name: value for name, value in (params or {}).items() if name not in ('page', 'cursor')}
+    params['pageSize'] = min(int(page_size), MAX_PAGE_SIZE)
+    while cursor:
+        data = fetch(endpoint, dict(params, cursor=cursor))
+        next_cursor = data['header'].get('nextCursor')
+        yield cursor, next_cursor, data['header'], data.get('results') or []
+        if not data.get('results'):
+            break
+        cursor = next_cursor
+
+# All records of a query, one by one; only one page is held in memory
+def iter_records(fetch, endpoint, params=None, page_size=MAX_PAGE_SIZE):
+    for cursor, next_cursor, header, results in iter_pages(fetch, endpoint, params, page_size):
+        yield from results
+
+# Parquet rows: the top-level fields of a record, nested values (lists, objects) as JSON text.
+# Every column is a string, so the parts of one export always have compatible schemas.
+def _parquet_row(record):
+    return {name: None if value is None else json.dumps(value) if isinstance(value, (list, dict)) else str(value) for name, value in record.items()}
+
+# Appends records to a gzip compressed JSON lines file. Every page becomes one gzip member, so the
+# file can be cut back to the end of the last completed page when an export is resumed.
+class JsonlSink:
+    def __init__(self, path):
+        self.path = path
+
+    def position(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def truncate(self, position):
+        if os.path.exists(self.path):
+            with open(self.path, 'r+b') as file:
+                file.truncate(position)
+
+    def write(self, records):
+        if not records:
+            return
+        with open(self.path, 'ab') as file:
+            with gzip.GzipFile(fileobj=file, mode='wb') as member:
+                member.write(''.join(json.dumps(record) + '\n' for record in records).encode())
+            file.flush()
+            os.fsync(file.fileno())
+
+    def flush(self):
+        pass
+
+# Writes records as Parquet part files in a directory, part_size records per part
+class ParquetSink:
+    def __init__(self, path, part_size=10000):
+        self.path = path
+        self.part_size = part_size
+        self._rows = []
+        os.makedirs(path, exist_ok=True)
+
+    def _parts(self):
+        return sorted(name for name in os.listdir(self.path) if name.endswith('.parquet'))
+
+    # The number of completed parts; records that were not in a part yet are fetched again
+    def position(self):
+        return len(self._parts())
+
+    def truncate(self, position):
+        self._rows = []
+        for name in self._parts()[position:]:
+            os.remove(os.path.join(self.path, name))
+
+    def write(self, records):
+        self._rows.extend(_parquet_row(record) for record in records)
+        if len(self._rows) >= self.part_size:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        columns = list(dict.fromkeys(name for row in self._rows for name in row))
+        table = pa.Table.from_pylist(self._rows, schema=pa.schema([(name, pa.string()) for name in columns]))
+        pq.write_table(table, os.path.join(self.path, f"part-{self.position():05d}.parquet"))
+        self._rows = []
+
+    # True when no records are waiting for the next part
+    @property
+    def empty(self):
+        return not self._rows
+
+# Export all records of a query to output (a .jsonl.gz file or a Parquet directory), page by page.
+#
+# Progress is kept in <output>.state.json: the cursor to continue from, the number of records
+# written and the position in the output where they end. With resume=True an interrupted export
+# continues from there; output written after the last saved state is cut off first, so no
+# record is written twice. Cursors expire on the API side after a while, an export that is
+# resumed much later has to start again.
+def export(fetch, endpoint, params, output, fmt='jsonl', page_size=MAX_PAGE_SIZE, resume=False, part_size=10000, progress_every=50):
+    if fmt not in FORMATS:
+        raise Exception(f"Unknown export format {fmt}, expected one of {FORMATS}")
+    sink = JsonlSink(output) if fmt == 'jsonl' else ParquetSink(output, part_size)
+    state_file = f"{output}.state.json"
+    state = {'endpoint': endpoint, 'params': params, 'format': fmt, 'cursor': '*', 'records': 0, 'position': 0, 'done': False}
+    if resume and os.path.exists(state_file):
+        with open(state_file) as file:
+            saved = json.load(file)
+        if (saved['endpoint'], saved['params'], saved['format']) != (endpoint, params, fmt):
+            raise Exception(f"{state_file} belongs to an export of {saved['endpoint']} with {saved['params']} ({saved['format']})")
+        if saved['done']:
+            print(f"{output} is complete ({saved['records']} records).")
+            return saved['records']
+        state = saved
+        print(f"Resuming the export to {output} after {state['records']} records...")
+    sink.truncate(state['position'])
+
+    def save():
+        state['position'] = sink.position()
+        with open(f"{state_file}.tmp", 'w') as file:
+            json.dump(state, file)
+        os.replace(f"{state_file}.tmp", state_file)
+
+    records = state['records']
+    for number, (cursor, next_cursor, header, results) in enumerate(iter_pages(fetch, endpoint, params, page_size, state['cursor'])):
+        sink.write(results)
+        records += len(results)
+        # The state may only move past records that are on disk: every page for JSON lines,
+        # every completed part for Parquet
+        if fmt == 'jsonl' or sink.empty:
+            state['cursor'] = next_cursor
+            state['records'] = records
+            save()
+        if progress_every and number % progress_every == 0:
+            print(f"{records} of {header.get('numFound')} records exported...")
+    sink.flush()
+    state.update(records=records, done=True)
+    save()
+    print(f"{records} records exported to {output}")
+    return records
+
+# The records of an export, one by one: dicts from JSON lines, rows of the Parquet parts
+# (nested values as JSON text) from a directory. Only one part is read at a time.
+def iter_export(path):
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith('.parquet'):
+                df = pd.read_parquet(os.path.join(path, name))
+                yield from df.astype(object).where(df.notna(), None).to_dict('records')
+        return
+    with gzip.open(path, 'rt') as file:
+        for line in file:
+            yield json.loads(line)
+
+# Command line: python -m nlportal.export --org OPENORG_ID [--datasource DATASOURCE_ID] --output FILE
+def main():
+    parser = argparse.ArgumentParser(description="Export the research product records of an organisation and/or data source.")
+    parser.add_argument('--org', help="OpenOrg ID (relOrganizationId)")
+    parser.add_argument('--datasource', help="data source ID (relCollectedFromDatasourceId)")
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE', help="other query parameters, e.g. type=publication")
+    parser.add_argument('--endpoint', default='researchProducts')
+    parser.add_argument('--format', choices=FORMATS, default='jsonl', help="gzip compressed JSON lines (default) or a directory of Parquet parts")
+    parser.add_argument('--output', required=True, help="output file (.jsonl.gz) or directory (Parquet)")
+    parser.add_argument('--page-size', type=int, default=MAX_PAGE_SIZE)
+    parser.add_argument('--part-size', type=int, default=10000, help="records per Parquet part")
+    parser.add_argument('--resume', action='store_true', help="continue an interrupted export from its last cursor")
+    parser.add_argument('--config', default='config.yaml')
+    args = parser.parse_args()
+
+    params = dict(param.split('=', 1) for param in args.param)
+    if args.org:
+        params['relOrganizationId'] = args.org
+    if args.datasource:
+        params['relCollectedFromDatasourceId'] = args.datasource
+    if not params:
+        raise Exception("Give --org, --datasource or --param to select the records to export")
+
+    with open(args.config) as file:
+        config = yaml.safe_load(file)
+    client = OpenAIREClient.from_config(config)
+    client.token.get()
+    try:
+        export(lambda endpoint, params: client.get(endpoint, params, cache=False), args.endpoint, params, args.output,
+               fmt=args.format, page_size=args.page_size, resume=args.resume, part_size=args.part_size)
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import argparse
+import datetime
+import os
+import re
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Format of the run timestamps, the same as in the names of the output files
+RUN_FORMAT = '%Y-%m-%d_%H-%M'
+RUN_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}_\d{2}-\d{2}')
+
+# Output files and the dataset they belong to, matched on the file name
+DATASETS = [
+    (re.compile(r'_nl-stats\.csv$'), 'nl-stats'),
+    (re.compile(r'^nl-metadata-stats_'), 'nl-metadata-stats'),
+    (re.compile(r'^org_stats_'), 'org_stats'),
+    (re.compile(r'^grouped_stats_'), 'grouped_stats'),
+    (re.compile(r'^org_shared-costs_'), 'org_shared-costs'),
+]
+
+def run_name(timestamp):
+    return timestamp.strftime(RUN_FORMAT)
+
+# The dataset an output file belongs to, from its file name
+def dataset_of(path):
+    name = os.path.basename(path)
+    for pattern, dataset in DATASETS:
+        if pattern.search(name):
+            return dataset
+    raise Exception(f"Unknown output file {name}, pass the dataset name")
+
+# The run timestamp of an output file: from its name, or else its modification time
+def run_of(path):
+    match = RUN_PATTERN.search(os.path.basename(path))
+    if match:
+        return match.group(0)
+    return run_name(datetime.datetime.fromtimestamp(os.path.getmtime(path)))
+
+# Column types are fixed per column so every run has the same schema: text as string,
+# counts as float64 (they are missing for some rows in some runs). Columns without any
+# value get the null type, which merges with the type the column has in other runs.
+def _to_table(df):
+    df = df.copy()
+    df.columns = [str(column) for column in df.columns]
+    empty = [column for column in df.columns if df[column].isna().all()]
+    for column in df.columns:
+        if column in empty:
+            continue
+        if pd.api.types.is_numeric_dtype(df[column]) and not pd.api.types.is_bool_dtype(df[column]):
+            df[column] = df[column].astype('float64')
+        elif not pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = df[column].astype('string')
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for column in empty:
+        index = table.schema.get_field_index(column)
+        table = table.set_column(index, pa.field(column, pa.null()), pa.nulls(len(table)))
+    return table
+
+# History of all runs as a Parquet dataset, partitioned by dataset and run timestamp:
+#   <root>/dataset=nl-stats/run=2025-05-09_13-00/part-0.parquet
+# A run can have several parts, e.g. the org_stats files of two publication windows.
+#
+# Queries only read the columns they need, and filters on dataset and run skip whole
+# directories, so looking up a few institutions over dozens of runs stays fast.
+class HistoryStore:
+    def __init__(self, root='history'):
+        self.root = root
+
+    def _path(self, dataset, run=None):
+        path = os.path.join(self.root, f"dataset={dataset}")
+        return os.path.join(path, f"run={run}") if run else path
+
+    # Store (a part of) the output of one run; a part that was stored before is replaced
+    def append(self, df, dataset='nl-stats', run=None, part='part-0'):
+        run = run or run_name(datetime.datetime.now())
+        path = self._path(dataset, run)
+        os.makedirs(path, exist_ok=True)
+        pq.write_table(_to_table(df), os.path.join(path, f"{part}.parquet"))
+        return run
+
+    # Store an output file (CSV) of an earlier run, as a part named after the file
+    def import_file(self, path, dataset=None, run=None):
+        dataset = dataset or dataset_of(path)
+        run = run or run_of(path)
+        print(f"Adding {path} to the history as {dataset} run {run}...")
+        return self.append(pd.read_csv(path), dataset=dataset, run=run, part=os.path.splitext(os.path.basename(path))[0])
+
+    # Names of the stored datasets
+    def datasets(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name.split('=', 1)[1] for name in os.listdir(self.root) if name.startswith('dataset='))
+
+    # Run timestamps of a dataset, oldest first
+    def runs(self, dataset='nl-stats'):
+        path = self._path(dataset)
+        if not os.path.isdir(path):
+            return []
+        return sorted(name.split('=', 1)[1] for name in os.listdir(path) if name.startswith('run='))
+
+    def _dataset(self, dataset):
+        path = self._path(dataset)
+        files = [
+            os.path.join(path, f"run={run}", name)
+            for run in self.runs(dataset)
+            for name in sorted(os.listdir(os.path.join(path, f"run={run}"))) if name.endswith('.parquet')
+        ]
+        if not files:
+            raise Exception(f"No runs of {dataset} in {self.root}")
+        # Later runs can have columns that earlier runs did not have (or the other way around)
+        schema = pa.unify_schemas([pq.read_schema(file) for file in files], promote_options='permissive')
+        schema = schema.append(pa.field('run', pa.string()))
+        return ds.dataset(files, schema=schema, format='parquet', partitioning=ds.partitioning(pa.schema([('run', pa.string())]), flavor='hive'), partition_base_dir=path)
+
+    # Rows of a dataset as a DataFrame with a 'run' column. columns limits the columns that are read,
+    # runs the runs, and where is a dict column -> value or list of values the rows must match.
+    def read(self, dataset='nl-stats', columns=None, runs=None, where=None):
+        data = self._dataset(dataset)
+        expression = None
+        conditions = dict(where or {})
+        if runs is not None:
+            conditions['run'] = list(runs)
+        for column, value in conditions.items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            condition = ds.field(column).isin([str(v) if column == 'run' else v for v in values])
+            expression = condition if expression is None else expression & condition
+        if columns is not None:
+            columns = list(dict.fromkeys(['run'] + list(columns)))
+        return data.to_table(columns=columns, filter=expression).to_pandas().sort_values('run', kind='stable').reset_index(drop=True)
+
+    # Values of one or more columns over time for the rows where key_column equals key,
+    # e.g. history.timeseries('https://ror.org/057w15z03', 'Num_Found_ResearchProducts_for_OpenOrg')
+    def timeseries(self, key, value_columns, dataset='nl-stats', key_column='ROR_ID', by=None):
+        value_columns = [value_columns] if isinstance(value_columns, str) else list(value_columns)
+        by = [by] if isinstance(by, str) else list(by or [])
+        rows = self.read(dataset, columns=[key_column] + by + value_columns, where={key_column: key})
+        # Counts repeat on every data source row of an organisation, keep one value per run
+        return rows.drop_duplicates(subset=['run'] + by + value_columns).reset_index(drop=True)
+
+    # All rows of the latest run at or before the given date (a datetime or 'yyyy-mm-dd'), or None
+    def as_of(self, date, dataset='nl-stats', columns=None):
+        if isinstance(date, str):
+            date = datetime.datetime.fromisoformat(date) if len(date) > 10 else datetime.date.fromisoformat(date)
+        if type(date) is datetime.date:
+            date = datetime.datetime.combine(date, datetime.time.max)
+        runs = [run for run in self.runs(dataset) if run <= run_name(date)]
+        if not runs:
+            return None
+        return self.read(dataset, columns=columns, runs=[runs[-1]])
+
+# Command line: python -m nlportal.history import FILE... / runs
+def main():
+    parser = argparse.ArgumentParser(description="Keep the outputs of all runs in a partitioned Parquet history.")
+    parser.add_argument('--root', default='history', help="directory of the history (default: history)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('import', help="add output files of earlier runs")
+    add.add_argument('files', nargs='+')
+    add.add_argument('--dataset', help="dataset name (default: from the file name)")
+    add.add_argument('--run', help="run timestamp yyyy-mm-dd_HH-MM (default: from the file name or its modification time)")
+    commands.add_parser('runs', help="list the stored runs per dataset")
+    args = parser.parse_args()
+
+    history = HistoryStore(args.root)
+    if args.command == 'import':
+        for path in args.files:
+            history.import_file(path, dataset=args.dataset, run=args.run)
+    else:
+        for dataset in history.datasets():
+            print(f"{dataset}: {', '.join(history.runs(dataset))}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import datetime
+import glob
+import os
+import pandas as pd
+
+# Input columns of the institutions file and the output columns they end up in
+INPUT_TO_OUTPUT = {
+    'full_name_in_English': 'ROR_Name',
+    'acronym_EN': 'ROR_Acronym',
+    'acronym_AGG': 'ROR_Acronym_Agg',
+    'main_grouping': 'ROR_Group',
+}
+
+# Count columns compared in the delta report
+COUNT_COLUMNS = [
+    'Num_Found_ResearchProducts_for_OpenOrg',
+    'Num_Found_ResearchProducts_for_DataSource',
+    'Num_Found_ResearchProducts_for_OpenOrg_AND_DataSource',
+    'Num_Missing_ResearchProducts_in_DataSource',
+    'Num_Missing_ResearchProducts_in_OpenOrg',
+]
+
+# Rows are matched on these columns between two snapshots
+ROW_KEY = ['ROR_ID', 'OpenOrg_ID', 'DataSource_ID']
+
+# The most recent nl-stats output in a directory, or None
+def find_latest_snapshot(directory='.', exclude=None):
+    exclude = os.path.abspath(exclude) if exclude else None
+    files = [path for path in glob.glob(os.path.join(directory, '*_nl-stats.csv')) if os.path.abspath(path) != exclude]
+    # File names start with the timestamp of the run, so they sort chronologically
+    return max(files) if files else None
+
+def load_snapshot(path):
+    print(f"Loading previous snapshot from {path}...")
+    snapshot = pd.read_csv(path)
+    snapshot['Retrieved_On'] = pd.to_datetime(snapshot['Retrieved_On'])
+    return snapshot
+
+def _same(a, b):
+    if pd.isna(a) and pd.isna(b):
+        return True
+    return str(a) == str(b)
+
+# Decide per institution whether its rows in the snapshot can be reused.
+# Returns a dict ROR link -> reason to refresh ('new', 'changed' or 'stale'); institutions not in it are reused.
+# Institutions without rows in the snapshot (e.g. no OpenOrg found last time) count as new.
+def plan_refresh(institutions, snapshot, max_age_days, now=None):
+    now = now or datetime.datetime.now()
+    max_age = datetime.timedelta(days=max_age_days)
+    by_ror = {ror: rows for ror, rows in snapshot.groupby(snapshot['ROR_ID'].astype(str))}
+    refresh = {}
+    for index, row in institutions.iterrows():
+        ror_link = str(row['ROR_LINK'])
+        rows = by_ror.get(ror_link)
+        if rows is None:
+            refresh[ror_link] = 'new'
+        elif any(not _same(row[column], rows.iloc[0][output]) for column, output in INPUT_TO_OUTPUT.items() if column in row):
+            refresh[ror_link] = 'changed'
+        elif now - rows['Retrieved_On'].min() > max_age:
+            refresh[ror_link] = 'stale'
+    return refresh
+
+# The snapshot rows of one institution, as dicts ready for the StreamingWriter
+def snapshot_rows(snapshot, ror_link):
+    rows = snapshot[snapshot['ROR_ID'].astype(str) == str(ror_link)]
+    return rows.astype(object).where(rows.notna(), None).to_dict('records')
+
+# Compare the counts of two snapshots, one row per added, removed or changed output row
+def delta_report(old, new):
+    old = old.drop_duplicates(subset=ROW_KEY)
+    new = new.drop_duplicates(subset=ROW_KEY)
+    merged = pd.merge(
+        old[ROW_KEY + COUNT_COLUMNS], new[ROW_KEY + COUNT_COLUMNS],
+        on=ROW_KEY, how='outer', suffixes=('_old', '_new'), indicator=True
+    )
+    merged['Change'] = merged['_merge'].astype(str).map({'left_only': 'removed', 'right_only': 'added', 'both': 'unchanged'})
+    changed = merged['_merge'].eq('both') & pd.concat(
+        [merged[f"{column}_old"].ne(merged[f"{column}_new"]) for column in COUNT_COLUMNS], axis=1
+    ).any(axis=1)
+    merged.loc[changed, 'Change'] = 'changed'
+    for column in COUNT_COLUMNS:
+        merged[f"{column}_delta"] = merged[f"{column}_new"] - merged[f"{column}_old"]
+    report = merged[merged['Change'] != 'unchanged'].drop(columns='_merge')
+    return report.reset_index(drop=True)
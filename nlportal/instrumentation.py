@@ -0,0 +1,94 @@
+import contextlib
+import json
+import math
+import threading
+import time
+
+# Nearest-rank percentile of a sorted list
+def percentile(values, p):
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[rank - 1]
+
+# Name under which a request is reported: the endpoint plus the names of its parameters,
+# e.g. 'researchProducts[relCollectedFromDatasourceId,relOrganizationId]'
+def request_label(endpoint, params=None):
+    if not params:
+        return endpoint
+    return f"{endpoint}[{','.join(sorted(params))}]"
+
+# Collect timing records of API requests and pipeline steps.
+#
+# Every record is kept in memory for the profile report and, when trace_file is given,
+# also written to that file as one JSON line (written and flushed per record, so the
+# trace can be followed while the run is going).
+class Instrumentation:
+    def __init__(self, trace_file=None):
+        self.records = []
+        self.started = time.monotonic()
+        self._trace = open(trace_file, 'a') if trace_file else None
+        self._lock = threading.Lock()
+
+    def record(self, **fields):
+        fields['time'] = round(time.time(), 3)
+        with self._lock:
+            self.records.append(fields)
+            if self._trace is not None:
+                self._trace.write(json.dumps(fields) + '\n')
+                self._trace.flush()
+
+    # Record one API request; latency in seconds, bytes of the (decoded) body, 'hit' or 'miss' for the cache
+    def request(self, endpoint, params, latency, status=None, bytes=0, retries=0, cache=None, error=None):
+        self.record(
+            type='request', endpoint=request_label(endpoint, params), params=params,
+            latency=round(latency, 6), status=status, bytes=bytes, retries=retries, cache=cache, error=error,
+        )
+
+    # Time a step of the pipeline: with instrumentation.step('org lookup'): ...
+    @contextlib.contextmanager
+    def step(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(type='step', step=name, duration=round(time.monotonic() - start, 6))
+
+    # Per-endpoint latency percentiles, call counts and the time spent per step, as printable text
+    def summary(self):
+        with self._lock:
+            records = list(self.records)
+        total = time.monotonic() - self.started
+        requests = [record for record in records if record['type'] == 'request']
+        lines = [f"Run profile: {len(requests)} requests in {total:.1f} s"]
+
+        by_endpoint = {}
+        for record in requests:
+            by_endpoint.setdefault(record['endpoint'], []).append(record)
+        width = max([len(name) for name in by_endpoint] + [len(record['step']) for record in records if record['type'] == 'step'] + [8])
+        lines.append(f"{'endpoint':<{width}} {'calls':>6} {'hits':>6} {'errors':>6} {'retries':>7} {'MB':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for endpoint, rows in sorted(by_endpoint.items()):
+            # Cache hits take microseconds, they would hide the latency of the API in the percentiles
+            latencies = sorted(row['latency'] * 1000 for row in rows if row['cache'] != 'hit')
+            lines.append(
+                f"{endpoint:<{width}} {len(rows):>6} {sum(row['cache'] == 'hit' for row in rows):>6} "
+                f"{sum(row['error'] is not None for row in rows):>6} {sum(row['retries'] for row in rows):>7} "
+                f"{sum(row['bytes'] for row in rows) / 1e6:>7.2f} {percentile(latencies, 50):>8.1f} "
+                f"{percentile(latencies, 95):>8.1f} {percentile(latencies, 99):>8.1f}"
+            )
+
+        steps = {}
+        for record in records:
+            if record['type'] == 'step':
+                steps[record['step']] = steps.get(record['step'], 0.0) + record['duration']
+        if steps:
+            # Steps of tasks running at the same time overlap, their shares can add up to more than 100%
+            lines.append(f"{'step':<{width}} {'seconds':>8} {'share':>6}")
+            for name, duration in steps.items():
+                lines.append(f"{name:<{width}} {duration:>8.2f} {duration / total:>6.0%}")
+        return '\n'.join(lines)
+
+    def close(self):
+        if self._trace is not None:
+            self._trace.close()
+            self._trace = None
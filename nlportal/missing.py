@@ -0,0 +1,201 @@
+import argparse
+import gzip
+import math
+import os
+import re
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import yaml
+from .client import OpenAIREClient
+from .export import iter_records
+
+# Memory for the IDs of one comparison (default 64 MB)
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024
+# Bytes per ID while it is buffered: the 8-byte hash and the ID text (about 50 characters)
+BYTES_PER_ID = 120
+SUMMARY_COLUMNS = [
+    'OpenOrg_ID', 'DataSource_ID', 'Num_IDs_for_OpenOrg', 'Num_IDs_for_DataSource',
+    'Num_Missing_ResearchProducts_in_DataSource', 'Num_Missing_ResearchProducts_in_OpenOrg', 'File',
+]
+
+# 64-bit hashes of IDs (SipHash with a fixed key, so the same in every process and run)
+def hash_ids(ids):
+    return pd.util.hash_array(np.asarray(ids, dtype=object))
+
+# A set of research product IDs kept on disk, partitioned by hash.
+#
+# IDs are buffered up to buffer_size and then appended to the file of their partition: the
+# 64-bit hashes to <directory>/part-NNNN.hashes and the IDs themselves, in the same order, to
+# part-NNNN.ids. Two sets with the same number of partitions are compared one partition at a
+# time (see difference()), so only the hashes of one partition of both sets are in memory.
+class HashedIdSet:
+    def __init__(self, directory, partitions=16, buffer_size=100000):
+        self.directory = directory
+        self.partitions = partitions
+        self.buffer_size = buffer_size
+        self.count = 0
+        self._buffer = []
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, partition, kind):
+        return os.path.join(self.directory, f"part-{partition:04d}.{kind}")
+
+    def add(self, ids):
+        for research_product_id in ids:
+            self._buffer.append(research_product_id)
+            if len(self._buffer) >= self.buffer_size:
+                self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        ids = np.asarray(self._buffer, dtype=object)
+        hashes = hash_ids(ids)
+        partitions = hashes % np.uint64(self.partitions)
+        order = np.argsort(partitions, kind='stable')
+        bounds = np.searchsorted(partitions[order], np.arange(self.partitions + 1))
+        for partition in range(self.partitions):
+            members = order[bounds[partition]:bounds[partition + 1]]
+            if not len(members):
+                continue
+            with open(self._path(partition, 'hashes'), 'ab') as file:
+                hashes[members].tofile(file)
+            with open(self._path(partition, 'ids'), 'a') as file:
+                file.write(''.join(f"{research_product_id}\n" for research_product_id in ids[members]))
+        self.count += len(ids)
+        self._buffer = []
+
+    def hashes(self, partition):
+        path = self._path(partition, 'hashes')
+        return np.fromfile(path, dtype=np.uint64) if os.path.exists(path) else np.empty(0, dtype=np.uint64)
+
+    # The IDs of a partition at the given positions (sorted), read line by line
+    def ids(self, partition, positions):
+        wanted = iter(positions)
+        position = next(wanted, None)
+        with open(self._path(partition, 'ids')) as file:
+            for number, line in enumerate(file):
+                if number == position:
+                    yield line.rstrip('\n')
+                    position = next(wanted, None)
+                    if position is None:
+                        return
+
+    def remove(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+# IDs in a that are not in b, each once, in the order of the partitions of a.
+# The IDs are compared by their 64-bit hashes: exact unless an ID of a has the same hash as a
+# different ID of b, a chance of about 1 in 20 million for two sets of a million IDs.
+def difference(a, b):
+    if a.partitions != b.partitions:
+        raise Exception(f"Can not compare ID sets with {a.partitions} and {b.partitions} partitions")
+    a.flush()
+    b.flush()
+    for partition in range(a.partitions):
+        hashes = a.hashes(partition)
+        if not len(hashes):
+            continue
+        missing = ~np.isin(hashes, b.hashes(partition))
+        # Only the first occurrence of an ID that was returned twice
+        first = np.zeros(len(hashes), dtype=bool)
+        first[np.unique(hashes, return_index=True)[1]] = True
+        yield from a.ids(partition, np.flatnonzero(missing & first))
+
+# Number of partitions for sets of up to largest IDs, so that the hashes of one partition of two
+# such sets stay within memory_budget (a power of two, at least 1)
+def partitions_for(largest, memory_budget=DEFAULT_MEMORY_BUDGET):
+    needed = max(1, math.ceil(2 * 8 * largest / (memory_budget / 2)))
+    return 2 ** math.ceil(math.log2(needed))
+
+# Stream the IDs of all research products of a query into an ID set
+def collect_ids(fetch, params, id_set):
+    id_set.add(record['id'] for record in iter_records(fetch, 'researchProducts', params))
+    id_set.flush()
+    return id_set
+
+def _file_name(value):
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', str(value))
+
+# Write the exact lists of missing research product IDs for the (OpenOrg, data source) pairs of an
+# nl-stats output file to directory:
+#   <OpenOrg>__<DataSource>.csv.gz with the columns id and missing_in: 'DataSource' for the products
+#     collected from the data source that are not linked to the organisation, 'OpenOrg' for the
+#     products of the organisation that are not in the data source, the records counted in
+#     Num_Missing_ResearchProducts_in_DataSource and Num_Missing_ResearchProducts_in_OpenOrg
+#   summary.csv with the number of IDs and missing IDs per pair
+# The IDs of an organisation are fetched once for all of its data sources. Pairs that are in
+# summary.csv already are skipped, so an interrupted run continues where it stopped.
+# fetch(endpoint, params) performs one request, e.g. client.get with cache=False. With org_ids only
+# the pairs of those organisations are compared.
+def write_missing_lists(fetch, stats_file, directory, memory_budget=DEFAULT_MEMORY_BUDGET, org_ids=None):
+    os.makedirs(directory, exist_ok=True)
+    summary_file = os.path.join(directory, 'summary.csv')
+    done = set()
+    if os.path.exists(summary_file):
+        summary = pd.read_csv(summary_file, dtype=str)
+        done = set(zip(summary['OpenOrg_ID'], summary['DataSource_ID']))
+
+    stats = pd.read_csv(stats_file)
+    stats = stats[stats['OpenOrg_ID'].notna() & stats['DataSource_ID'].notna()]
+    if org_ids is not None:
+        stats = stats[stats['OpenOrg_ID'].isin(list(org_ids))]
+    stats = stats.drop_duplicates(subset=['OpenOrg_ID', 'DataSource_ID'])
+    buffer_size = max(1000, memory_budget // 2 // BYTES_PER_ID)
+    for openorg_id, pairs in stats.groupby('OpenOrg_ID', sort=False):
+        pairs = pairs[[(openorg_id, datasource_id) not in done for datasource_id in pairs['DataSource_ID']]]
+        if pairs.empty:
+            continue
+        largest = pd.concat([pairs['Num_Found_ResearchProducts_for_OpenOrg'], pairs['Num_Found_ResearchProducts_for_DataSource']]).fillna(0).max()
+        partitions = partitions_for(largest, memory_budget)
+        work = tempfile.mkdtemp(prefix='missing-', dir=directory)
+        try:
+            print(f"Fetching the research product IDs of {openorg_id}...")
+            org_set = collect_ids(fetch, {'relOrganizationId': openorg_id}, HashedIdSet(os.path.join(work, 'org'), partitions, buffer_size))
+            for datasource_id in pairs['DataSource_ID']:
+                print(f"Comparing {openorg_id} with the research product IDs of {datasource_id}...")
+                datasource_set = collect_ids(fetch, {'relCollectedFromDatasourceId': datasource_id}, HashedIdSet(os.path.join(work, 'datasource'), partitions, buffer_size))
+                name = f"{_file_name(openorg_id)}__{_file_name(datasource_id)}.csv.gz"
+                counts = {'DataSource': 0, 'OpenOrg': 0}
+                with gzip.open(os.path.join(directory, f"{name}.tmp"), 'wt') as file:
+                    file.write('id,missing_in\n')
+                    for missing_in, ids in (('DataSource', difference(datasource_set, org_set)), ('OpenOrg', difference(org_set, datasource_set))):
+                        for research_product_id in ids:
+                            file.write(f"{research_product_id},{missing_in}\n")
+                            counts[missing_in] += 1
+                os.replace(os.path.join(directory, f"{name}.tmp"), os.path.join(directory, name))
+                datasource_set.remove()
+                row = pd.DataFrame([[openorg_id, datasource_id, org_set.count, datasource_set.count, counts['DataSource'], counts['OpenOrg'], name]], columns=SUMMARY_COLUMNS)
+                row.to_csv(summary_file, mode='a', header=not os.path.exists(summary_file), index=False)
+                print(f"{counts['DataSource']} missing in the data source, {counts['OpenOrg']} missing in the organisation, written to {name}")
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+    return summary_file
+
+# Command line: python -m nlportal.missing STATS_FILE [--output-dir DIR] [--memory-mb 64]
+def main():
+    parser = argparse.ArgumentParser(description="Write the IDs of the research products counted as missing in an nl-stats output file.")
+    parser.add_argument('stats_file', help="nl-stats output file (*_nl-stats.csv)")
+    parser.add_argument('--output-dir', help="directory for the lists (default: <stats file>-missing)")
+    parser.add_argument('--org', action='append', help="only these OpenOrg IDs")
+    parser.add_argument('--memory-mb', type=int, default=DEFAULT_MEMORY_BUDGET // (1024 * 1024), help="memory for the IDs of one comparison (default: 64)")
+    parser.add_argument('--config', default='config.yaml')
+    args = parser.parse_args()
+
+    with open(args.config) as file:
+        config = yaml.safe_load(file)
+    client = OpenAIREClient.from_config(config)
+    client.token.get()
+    try:
+        summary_file = write_missing_lists(
+            lambda endpoint, params: client.get(endpoint, params, cache=False), args.stats_file,
+            args.output_dir or f"{os.path.splitext(args.stats_file)[0]}-missing", args.memory_mb * 1024 * 1024, args.org,
+        )
+    finally:
+        client.close()
+    print(f"Summary written to {summary_file}")
+
+if __name__ == "__main__":
+    main()
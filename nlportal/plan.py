@@ -0,0 +1,64 @@
+# Collect the API requests of a run and execute every distinct request only once.
+#
+# Requests are added stage by stage (the organizations of all institutions, then the
+# counts of all OpenOrgs, then those of all data sources), identical requests collapse
+# onto one key, and execute() fetches the keys that have no result yet. Results are
+# kept for the whole run, so later stages and later batches reuse them as well.
+# Requests added with count=True only need numFound and are executed with count().
+class QueryPlan:
+    def __init__(self, fetch, count=None):
+        # fetch(endpoint, params) performs a single request and returns the decoded response,
+        # count(endpoint, params) returns the number of results of a query
+        self.fetch = fetch
+        self.count = count
+        self.requested = 0
+        self.provided = 0
+        self._results = {}
+        self._pending = {}
+
+    @staticmethod
+    def key(endpoint, params=None, count=False):
+        return (endpoint, tuple(sorted((k, str(v)) for k, v in (params or {}).items())), count)
+
+    # Register a request, returns its key
+    def add(self, endpoint, params=None, count=False):
+        self.requested += 1
+        key = self.key(endpoint, params, count)
+        if key not in self._results and key not in self._pending:
+            self._pending[key] = (self.count if count else self.fetch, endpoint, params)
+        return key
+
+    # Register a request whose result is already known (e.g. from the resolution index), it is not fetched
+    def provide(self, endpoint, params, result, count=False):
+        key = self.key(endpoint, params, count)
+        if key in self._results:
+            return
+        self._pending.pop(key, None)
+        self._results[key] = result
+        self.provided += 1
+
+    # Fetch all pending requests through the engine
+    def execute(self, engine):
+        keys = list(self._pending)
+        responses = engine.fetch_all([(self._pending[key][0], self._pending[key][1:], None) for key in keys])
+        for key, response in zip(keys, responses):
+            self._results[key] = response
+        self._pending.clear()
+
+    # The decoded response of a request, or the number of results for a count request
+    def result(self, endpoint, params=None, count=False):
+        return self._results[self.key(endpoint, params, count)]
+
+    @property
+    def executed(self):
+        return len(self._results) - self.provided
+
+    @property
+    def saved(self):
+        return self.requested - self.executed - self.provided - len(self._pending)
+
+    def summary(self):
+        summary = f"{self.requested} API requests planned, {self.executed} unique requests executed, {self.saved} duplicate requests saved."
+        if self.provided:
+            summary += f" {self.provided} results taken from the resolution index."
+        return summary
@@ -0,0 +1,186 @@
+import argparse
+import datetime
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import requests
+import yaml
+from .client import APIError, OpenAIREClient
+from .engine import FetchEngine
+from .instrumentation import Instrumentation
+from .ratelimit import AdaptiveRateLimiter, CircuitOpenError, RetryPolicy
+from .yearly import YearlyCounts
+
+OPENALEX_API_URL = "https://api.openalex.org/"
+PROVIDERS = ('openaire', 'openalex')
+
+# Client for the OpenAlex API: the pooled session, rate limiter, retries, circuit breaker and
+# instrumentation of OpenAIREClient, but without an access token. OpenAlex asks for a mailto
+# parameter to put the requests in its "polite pool", and allows 10 requests per second.
+class OpenAlexClient(OpenAIREClient):
+    def __init__(self, api_url=OPENALEX_API_URL, mailto=None, pool_size=10, limiter=None, breaker=None, retry=None, instrumentation=None):
+        super().__init__(None, None, api_url=api_url, pool_size=pool_size, limiter=limiter or AdaptiveRateLimiter(rate=10, max_rate=10),
+                         breaker=breaker, retry=retry, instrumentation=instrumentation)
+        self.mailto = mailto
+
+    # Build a client from the OpenAlex_* settings in config.yaml; its rate budget is separate from Rate_limit
+    @classmethod
+    def from_config(cls, config, trace_file=None):
+        rate = float(config.get('OpenAlex_rate_limit') or 10)
+        return cls(
+            api_url=config.get('OpenAlex_API') or OPENALEX_API_URL,
+            mailto=config.get('OpenAlex_mailto'),
+            pool_size=max(10, int(config.get('OpenAlex_max_in_flight') or 1)),
+            limiter=AdaptiveRateLimiter(rate=rate, max_rate=rate),
+            retry=RetryPolicy(max_retries=int(config.get('Max_retries', 4))),
+            instrumentation=Instrumentation(trace_file),
+        )
+
+    def _send(self, url, params):
+        self.limiter.acquire()
+        if self.mailto:
+            params = dict(params or {}, mailto=self.mailto)
+        return self.session.get(url, params=params)
+
+# A source of research output counts per institution.
+#
+# Every provider has a client of its own, so its own connection pool and rate budget, and
+# fetches the counts of all institutions on a FetchEngine of its own (max_in_flight requests at
+# a time). The institution is identified by the column id_column of the data file.
+class Provider(ABC):
+    name = None
+    id_column = None
+
+    def __init__(self, client, max_in_flight=1):
+        self.client = client
+        self.max_in_flight = max_in_flight
+
+    # Number of works of an institution, and with from_year and to_year also per publication year:
+    # (total, {year: count})
+    @abstractmethod
+    def works(self, institution_id, from_year=None, to_year=None):
+        pass
+
+    # Counts of one institution, or None when its requests failed. Connection errors that are still
+    # failing after the retries count as failed too, so one institution does not end the whole run.
+    def _institution(self, institution_id, from_year, to_year):
+        try:
+            total, years = self.works(institution_id, from_year, to_year)
+        except (APIError, CircuitOpenError, requests.RequestException) as e:
+            print(f"Failed to retrieve the works of {institution_id} from {self.name}: {e}")
+            return None
+        return dict({f"Num_Works_{self.name}": total}, **{f"Num_Works_{self.name}_{year}": count for year, count in years.items()})
+
+    # The counts of the institutions (a data file DataFrame) as a DataFrame with ROR_LINK, the ID at
+    # this provider, Num_Works_<name> and Num_Works_<name>_<year>. Institutions without an ID at
+    # the provider are left out, those whose requests failed get empty counts.
+    def counts(self, institutions, from_year=None, to_year=None):
+        rows = institutions[institutions[self.id_column].notna()].drop_duplicates(subset='ROR_LINK')
+        print(f"Fetching the works of {len(rows)} institutions from {self.name}...")
+        with FetchEngine(self.max_in_flight) as engine:
+            results = engine.fetch_all([(self._institution, (institution_id, from_year, to_year), None) for institution_id in rows[self.id_column]])
+        df = pd.DataFrame([result or {} for result in results], index=range(len(results))).astype('Int64')
+        df.insert(0, 'ROR_LINK', list(rows['ROR_LINK']))
+        df.insert(1, f"{self.name}_ID", list(rows[self.id_column]))
+        print(f"Works of {len(rows) - results.count(None)} institutions retrieved from {self.name}.")
+        return df
+
+    def close(self):
+        self.client.close()
+
+# Research products of an OpenOrg in the OpenAIRE Graph: one count request for the total and one
+# per publication year (as in nlportal.yearly)
+class OpenAIREProvider(Provider):
+    name = 'OpenAIRE'
+    id_column = 'OpenAIRE_ID'
+
+    def works(self, institution_id, from_year=None, to_year=None):
+        total = self.client.count('researchProducts', {'relOrganizationId': institution_id})
+        years = range(int(from_year), int(to_year) + 1) if from_year is not None else []
+        return total, {year: self.client.count('researchProducts', YearlyCounts.query(institution_id, year)) for year in years}
+
+# Works of an institution in OpenAlex, all from one request: a works query filtered on the
+# institution and grouped by publication_year has the total in meta.count and a group per year
+class OpenAlexProvider(Provider):
+    name = 'OpenAlex'
+    id_column = 'OpenAlex_ID'
+
+    def works(self, institution_id, from_year=None, to_year=None):
+        data = self.client.get('works', {'filter': f"institutions.id:{institution_id}", 'group_by': 'publication_year', 'per-page': 200})
+        groups = {int(group['key']): group['count'] for group in data.get('group_by') or [] if str(group['key']).isdigit()}
+        years = range(int(from_year), int(to_year) + 1) if from_year is not None else []
+        return data['meta']['count'], {year: groups.get(year, 0) for year in years}
+
+# Publication years of the per-year counts: OpenAlex_years from config.yaml, or the last five years
+def comparison_years(config):
+    if config.get('OpenAlex_years'):
+        from_year, to_year = config['OpenAlex_years']
+        return int(from_year), int(to_year)
+    this_year = datetime.date.today().year
+    return this_year - 4, this_year
+
+# A provider by name ('openaire' or 'openalex'), with its own client made from config.yaml
+def make_provider(name, config, trace_file=None):
+    if name == 'openaire':
+        client = OpenAIREClient.from_config(config, trace_file=trace_file)
+        client.token.get()
+        return OpenAIREProvider(client, config.get('Max_in_flight', 1))
+    if name == 'openalex':
+        return OpenAlexProvider(OpenAlexClient.from_config(config, trace_file), config.get('OpenAlex_max_in_flight', 4))
+    raise Exception(f"Unknown provider {name}, expected one of {PROVIDERS}")
+
+# Start fetching the counts of every provider at once, each on a thread of its own; returns
+# {provider name: Future of its counts()}. The calling thread is free to do other requests.
+def start_counts(providers, institutions, from_year=None, to_year=None):
+    executor = ThreadPoolExecutor(max_workers=max(1, len(providers)), thread_name_prefix='provider')
+    futures = {provider.name: executor.submit(provider.counts, institutions, from_year, to_year) for provider in providers}
+    executor.shutdown(wait=False)
+    return futures
+
+# One row per institution with the counts of all providers next to each other
+def merge_counts(frames):
+    merged = None
+    for df in frames:
+        merged = df if merged is None else merged.merge(df, on='ROR_LINK', how='outer', sort=False)
+    return merged if merged is not None else pd.DataFrame(columns=['ROR_LINK'])
+
+# Provider counts next to the research products of a run: per institution of an nl-stats output
+# file, Num_Works_OpenAIRE is the sum of Num_Found_ResearchProducts_for_OpenOrg over its OpenOrgs
+def comparison_table(stats, frames):
+    orgs = stats[stats['OpenOrg_ID'].notna()].drop_duplicates(subset=['ROR_ID', 'OpenOrg_ID'])
+    openaire = orgs.groupby('ROR_ID', sort=False)['Num_Found_ResearchProducts_for_OpenOrg'].sum().rename('Num_Works_OpenAIRE')
+    institutions = stats.drop_duplicates(subset='ROR_ID')[['ROR_ID', 'ROR_Name']].rename(columns={'ROR_ID': 'ROR_LINK'})
+    table = institutions.merge(openaire, left_on='ROR_LINK', right_index=True, how='left')
+    return table.merge(merge_counts(frames), on='ROR_LINK', how='left').rename(columns={'ROR_LINK': 'ROR_ID'})
+
+# Command line: python -m nlportal.providers [--providers openaire openalex] [--from-year 2020 --to-year 2024] --output FILE
+def main():
+    parser = argparse.ArgumentParser(description="Count the works of the institutions of the data file in OpenAIRE and OpenAlex, per year, concurrently.")
+    parser.add_argument('--providers', nargs='+', choices=PROVIDERS, default=list(PROVIDERS))
+    parser.add_argument('--data-file', help="institution data file with OpenAIRE_ID and OpenAlex_ID columns (default: Org_data_file)")
+    parser.add_argument('--from-year', type=int)
+    parser.add_argument('--to-year', type=int)
+    parser.add_argument('--output', help="CSV file for the counts (default: print them)")
+    parser.add_argument('--config', default='config.yaml')
+    args = parser.parse_args()
+
+    with open(args.config) as file:
+        config = yaml.safe_load(file)
+    from_year, to_year = comparison_years(config)
+    from_year, to_year = args.from_year or from_year, args.to_year or to_year
+    institutions = pd.read_csv(args.data_file or config['Org_data_file']).drop_duplicates(subset='ROR_LINK')
+    providers = [make_provider(name, config) for name in args.providers]
+    try:
+        futures = start_counts(providers, institutions, from_year, to_year)
+        df = institutions[['ROR_LINK', 'full_name_in_English']].merge(merge_counts([future.result() for future in futures.values()]), on='ROR_LINK', how='left')
+    finally:
+        for provider in providers:
+            provider.close()
+    if args.output:
+        df.to_csv(args.output, index=False)
+        print(f"Counts written to {args.output}")
+    else:
+        print(df.to_string(index=False))
+
+if __name__ == "__main__":
+    main()
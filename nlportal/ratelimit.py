@@ -0,0 +1,137 @@
+import email.utils
+import random
+import threading
+import time
+
+# HTTP statuses that are worth retrying, everything else is returned to the caller right away
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Statuses with which the API tells us to slow down
+THROTTLE_STATUSES = (429, 503)
+
+# Raised instead of sending a request while the circuit of its endpoint is open
+class CircuitOpenError(Exception):
+    def __init__(self, endpoint, retry_in):
+        super().__init__(f"Too many failures on '{endpoint}', not sending requests for another {retry_in:.0f} seconds")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+# Seconds to wait according to a Retry-After header (delay in seconds or an HTTP date), or None
+def parse_retry_after(value, now=None):
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date is None:
+        return None
+    now = now if now is not None else time.time()
+    return max(0.0, date.timestamp() - now)
+
+# Token bucket shared by all threads, whose rate adapts to the answers of the API (AIMD).
+#
+# Every successful request raises the rate a little (additive increase, up to max_rate),
+# every throttled request (429/503) cuts it (multiplicative decrease, down to min_rate).
+# Throttled answers arriving together are caused by the same burst, so the rate is cut at
+# most once per hold seconds.
+# A Retry-After from the server pauses all requests until that moment has passed.
+class AdaptiveRateLimiter:
+    def __init__(self, rate=10.0, min_rate=0.5, max_rate=50.0, burst=None, increase=0.5, decrease=0.5, hold=1.0):
+        # Requests per second
+        self.rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        # Number of requests that may be sent at once after an idle period
+        self.burst = float(burst or max(1.0, self.rate))
+        self.increase = increase
+        self.decrease = decrease
+        self.hold = hold
+        self.throttled = 0
+        self._decreased_at = float('-inf')
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    # Block until a request may be sent
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Take the token now, possibly going into debt, and sleep outside the lock until it is paid off
+            self._tokens -= 1
+            wait = max(-self._tokens / self.rate, self._paused_until - now, 0.0)
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    # The API answered 429/503, retry_after is the number of seconds it asked us to wait (or None)
+    def on_throttle(self, retry_after=None):
+        with self._lock:
+            now = time.monotonic()
+            self.throttled += 1
+            if now - self._decreased_at >= self.hold:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._tokens = min(self._tokens, 0.0)
+                self._decreased_at = now
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+
+# Stop sending requests to an endpoint after repeated failures, so a broken endpoint does not
+# eat the whole retry budget of a run. After cooldown seconds one trial request is let through
+# (half-open); its success closes the circuit again, its failure reopens it.
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, cooldown=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._failures = {}
+        self._opened_at = {}
+        self._trial = set()
+        self._lock = threading.Lock()
+
+    # Raise CircuitOpenError when no request may be sent to the endpoint
+    def check(self, endpoint):
+        with self._lock:
+            opened_at = self._opened_at.get(endpoint)
+            if opened_at is None:
+                return
+            retry_in = opened_at + self.cooldown - time.monotonic()
+            if retry_in > 0 or endpoint in self._trial:
+                raise CircuitOpenError(endpoint, max(retry_in, 0.0))
+            self._trial.add(endpoint)
+
+    def record_success(self, endpoint):
+        with self._lock:
+            self._failures.pop(endpoint, None)
+            self._opened_at.pop(endpoint, None)
+            self._trial.discard(endpoint)
+
+    def record_failure(self, endpoint):
+        with self._lock:
+            self._failures[endpoint] = self._failures.get(endpoint, 0) + 1
+            if endpoint in self._trial or self._failures[endpoint] >= self.failure_threshold:
+                if endpoint not in self._opened_at or endpoint in self._trial:
+                    print(f"Circuit for '{endpoint}' opened after {self._failures[endpoint]} failures.")
+                self._opened_at[endpoint] = time.monotonic()
+                self._trial.discard(endpoint)
+
+# Retries with exponential backoff and full jitter, so parallel requests do not retry in lockstep
+class RetryPolicy:
+    def __init__(self, max_retries=4, base_delay=1.0, max_delay=60.0, statuses=RETRY_STATUSES):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.statuses = statuses
+
+    # Seconds to wait before retry number attempt (0-based); a Retry-After from the server wins
+    def delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
@@ -0,0 +1,233 @@
+import argparse
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+
+# Persistent index of how ROR links resolve to OpenOrgs, kept in SQLite.
+#
+# Resolving an institution takes two requests: organizations?pid=<ROR_LINK> for its OpenOrg
+# IDs and organizations/{id} for the legalName and websiteUrl. These rarely change, so the
+# index answers them for the query plan instead (see provide()). Entries come from:
+#   'api':   the responses of earlier runs (record())
+#   'run':   the output files of earlier runs (seed_from_output())
+#   'input': the OpenAIRE_ID column of the institutions file (seed_from_input()). These are not
+#            used to answer lookups, the ID in the file can be outdated; the first run looks
+#            the ROR link up and reports a conflict when the API gives other OpenOrgs.
+# Entries older than ttl_days are still used, and are revalidated on a background thread
+# while the run goes on. A revalidation that finds other OpenOrg IDs updates the entry for
+# the next run and is recorded as a conflict, see report().
+class ResolutionIndex:
+    def __init__(self, path, ttl_days=30):
+        self.path = path
+        self.ttl = ttl_days * 24 * 3600
+        self.used = 0
+        self.revalidated = 0
+        self._client = None
+        self._executor = None
+        self._submitted = set()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS rors ('
+            ' ror_link TEXT PRIMARY KEY,'
+            ' openorg_ids TEXT NOT NULL,'
+            ' source TEXT NOT NULL,'
+            ' resolved_at REAL NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS openorgs ('
+            ' openorg_id TEXT PRIMARY KEY,'
+            ' legal_name TEXT,'
+            ' website_url TEXT,'
+            ' source TEXT NOT NULL,'
+            ' resolved_at REAL NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS conflicts ('
+            ' ror_link TEXT NOT NULL,'
+            ' old_ids TEXT NOT NULL,'
+            ' old_source TEXT NOT NULL,'
+            ' new_ids TEXT NOT NULL,'
+            ' detected_at REAL NOT NULL)'
+        )
+        self._conn.commit()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['Resolution_index'], ttl_days=config.get('Resolution_ttl_days', 30))
+
+    # The entry of a ROR link: (OpenOrg IDs, source, resolved_at), or None
+    def lookup(self, ror_link):
+        with self._lock:
+            row = self._conn.execute('SELECT openorg_ids, source, resolved_at FROM rors WHERE ror_link = ?', (str(ror_link),)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1], row[2]
+
+    # legalName and websiteUrl of an OpenOrg, as the organizations/{id} endpoint returns them, or None
+    def organization(self, openorg_id):
+        with self._lock:
+            row = self._conn.execute('SELECT legal_name, website_url FROM openorgs WHERE openorg_id = ?', (openorg_id,)).fetchone()
+        if row is None:
+            return None
+        return {'id': openorg_id, 'legalName': row[0], 'websiteUrl': row[1]}
+
+    def is_stale(self, resolved_at, now=None):
+        return (now or time.time()) - resolved_at > self.ttl
+
+    # Store how a ROR link resolves; with replace=False an existing entry is kept.
+    # An entry that changes is recorded as a conflict.
+    def store(self, ror_link, openorg_ids, source, resolved_at=None, organizations=None, replace=True):
+        ror_link = str(ror_link)
+        resolved_at = resolved_at or time.time()
+        openorg_ids = list(openorg_ids)
+        with self._lock:
+            row = self._conn.execute('SELECT openorg_ids, source FROM rors WHERE ror_link = ?', (ror_link,)).fetchone()
+            if row is not None and not replace:
+                return
+            if row is not None and sorted(json.loads(row[0])) != sorted(openorg_ids):
+                self._conn.execute(
+                    'INSERT INTO conflicts (ror_link, old_ids, old_source, new_ids, detected_at) VALUES (?, ?, ?, ?, ?)',
+                    (ror_link, row[0], row[1], json.dumps(openorg_ids), time.time())
+                )
+            self._conn.execute(
+                'INSERT OR REPLACE INTO rors (ror_link, openorg_ids, source, resolved_at) VALUES (?, ?, ?, ?)',
+                (ror_link, json.dumps(openorg_ids), source, resolved_at)
+            )
+            for org in (organizations or {}).values():
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO openorgs (openorg_id, legal_name, website_url, source, resolved_at) VALUES (?, ?, ?, ?, ?)',
+                    (org['id'], org.get('legalName'), org.get('websiteUrl'), source, resolved_at)
+                )
+            self._conn.commit()
+
+    # Add the OpenAIRE_ID of the institutions file for ROR links the index does not know yet.
+    # Only OpenOrg IDs ('openorgs' prefix) are used, e.g. a pending_org_ ID is left to the API.
+    def seed_from_input(self, institutions):
+        added = 0
+        for index, row in institutions.iterrows():
+            openorg_id = row.get('OpenAIRE_ID')
+            if pd.isna(row.get('ROR_LINK')) or not isinstance(openorg_id, str) or not openorg_id.startswith('openorgs'):
+                continue
+            if self.lookup(row['ROR_LINK']) is None:
+                self.store(row['ROR_LINK'], [openorg_id], 'input', resolved_at=1.0, replace=False)
+                added += 1
+        return added
+
+    # Add the OpenOrgs of an nl-stats output file, where the file is newer than what the index has
+    def seed_from_output(self, path):
+        df = pd.read_csv(path, usecols=['ROR_ID', 'OpenOrg_ID', 'OpenOrg_Name', 'OpenOrg_Website', 'Retrieved_On'])
+        df = df[df['ROR_ID'].notna() & df['OpenOrg_ID'].notna()].drop_duplicates(subset=['ROR_ID', 'OpenOrg_ID'])
+        added = 0
+        for ror_link, rows in df.groupby('ROR_ID', sort=False):
+            resolved_at = pd.to_datetime(rows['Retrieved_On']).min().timestamp()
+            entry = self.lookup(ror_link)
+            if entry is not None and entry[2] >= resolved_at:
+                continue
+            organizations = {
+                row['OpenOrg_ID']: {
+                    'id': row['OpenOrg_ID'],
+                    'legalName': None if pd.isna(row['OpenOrg_Name']) else row['OpenOrg_Name'],
+                    'websiteUrl': None if pd.isna(row['OpenOrg_Website']) else row['OpenOrg_Website'],
+                } for index, row in rows.iterrows()
+            }
+            self.store(ror_link, list(organizations), 'run', resolved_at=resolved_at, organizations=organizations)
+            added += 1
+        return added
+
+    # Revalidate stale entries on a background thread, with requests made through client
+    def start_revalidation(self, client):
+        self._client = client
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='revalidate')
+
+    def _revalidate(self, ror_link):
+        try:
+            data = self._client.get('organizations', {'pid': ror_link})
+            openorg_ids = [org['id'] for org in data['results'] if org['id'].startswith('openorgs')]
+            organizations = {openorg_id: self._client.get(f"organizations/{openorg_id}") for openorg_id in openorg_ids}
+        except Exception as e:
+            print(f"Revalidating {ror_link} in the resolution index failed: {e}")
+            return
+        self.store(ror_link, openorg_ids, 'api', organizations=organizations)
+        self.revalidated += 1
+
+    # Give the query plan the lookup results of a ROR link from the index. Returns False when the
+    # index does not know the ROR link (or only from the input file); OpenOrgs without a stored
+    # name are left to the plan.
+    def provide(self, plan, ror_link):
+        entry = self.lookup(ror_link)
+        if entry is None or entry[1] == 'input':
+            return False
+        openorg_ids, source, resolved_at = entry
+        plan.provide('organizations', {'pid': ror_link}, {'results': [{'id': openorg_id} for openorg_id in openorg_ids]})
+        for openorg_id in openorg_ids:
+            organization = self.organization(openorg_id)
+            if organization is not None:
+                plan.provide(f"organizations/{openorg_id}", None, organization)
+        self.used += 1
+        if self._executor is not None and self.is_stale(resolved_at) and str(ror_link) not in self._submitted:
+            self._submitted.add(str(ror_link))
+            self._executor.submit(self._revalidate, ror_link)
+        return True
+
+    # Store the lookups of ROR links that the plan fetched from the API
+    def record(self, plan, ror_links):
+        for ror_link in ror_links:
+            data = plan.result('organizations', {'pid': ror_link})
+            openorg_ids = [org['id'] for org in data['results'] if org['id'].startswith('openorgs')]
+            organizations = {openorg_id: plan.result(f"organizations/{openorg_id}") for openorg_id in openorg_ids}
+            self.store(ror_link, openorg_ids, 'api', organizations=organizations)
+
+    # Wait for the background revalidation to finish
+    def finish(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    # Number of entries per source, the stale ones and the conflicts found (since a timestamp), as text
+    def report(self, since=0):
+        now = time.time()
+        with self._lock:
+            entries = self._conn.execute('SELECT source, resolved_at FROM rors').fetchall()
+            conflicts = self._conn.execute(
+                'SELECT ror_link, old_ids, old_source, new_ids FROM conflicts WHERE detected_at >= ? ORDER BY detected_at', (since,)
+            ).fetchall()
+        sources = pd.Series([source for source, resolved_at in entries], dtype=object).value_counts().to_dict()
+        stale = sum(self.is_stale(resolved_at, now) for source, resolved_at in entries if source != 'input')
+        lines = [f"Resolution index: {len(entries)} ROR links {sources}, {stale} stale (older than {self.ttl / 86400:.0f} days)"]
+        if self.used or self.revalidated:
+            lines.append(f"{self.used} ROR links resolved from the index, {self.revalidated} revalidated")
+        for ror_link, old_ids, old_source, new_ids in conflicts:
+            lines.append(f"Conflict: {ror_link} resolved to {json.loads(old_ids)} ({old_source}), now to {json.loads(new_ids)}")
+        return '\n'.join(lines)
+
+    def close(self):
+        self.finish()
+        with self._lock:
+            self._conn.close()
+
+# Command line: python -m nlportal.resolution seed FILE... / report
+def main():
+    parser = argparse.ArgumentParser(description="Persistent index of ROR links resolved to OpenOrgs.")
+    parser.add_argument('--index', default='nl-resolution.sqlite', help="SQLite file of the index (default: nl-resolution.sqlite)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    seed = commands.add_parser('seed', help="add institutions files (OpenAIRE_ID column) and nl-stats output files")
+    seed.add_argument('files', nargs='+')
+    commands.add_parser('report', help="list the entries per source, the stale entries and the conflicts")
+    args = parser.parse_args()
+
+    index = ResolutionIndex(args.index)
+    if args.command == 'seed':
+        for path in args.files:
+            columns = pd.read_csv(path, nrows=0).columns
+            added = index.seed_from_output(path) if 'OpenOrg_ID' in columns else index.seed_from_input(pd.read_csv(path))
+            print(f"{path}: {added} ROR links added")
+    print(index.report())
+    index.close()
+
+if __name__ == "__main__":
+    main()
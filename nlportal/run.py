@@ -0,0 +1,65 @@
+import datetime
+import pandas as pd
+import yaml
+from .writer import Checkpoint, StreamingWriter
+
+# Columns of the output file of nl-stats.py and nl-stats-new.py, in order
+OUTPUT_COLUMNS = [
+    'ROR_ID', 'ROR_Name', 'ROR_Acronym', 'ROR_Acronym_Agg', 'ROR_Group',
+    'OpenOrg_ID', 'OpenOrg_Name', 'OpenOrg_Website',
+    'DataSource_ID', 'DataSource_Name', 'DataSource_Compatibility', 'DataSource_LastValidated', 'DataSource_URL',
+    'Num_Found_ResearchProducts_for_OpenOrg', 'Num_Found_ResearchProducts_for_DataSource',
+    'Num_Found_ResearchProducts_for_OpenOrg_AND_DataSource',
+    'Num_Missing_ResearchProducts_in_DataSource', 'Num_Missing_ResearchProducts_in_OpenOrg',
+]
+
+# Load configuration
+def load_config(file_path):
+    with open(file_path, 'r') as file:
+        return yaml.safe_load(file)
+
+# Fetch data from API, throttling and server errors are retried by the client
+def fetch_api_data(endpoint, client, params=None):
+    print(f"Fetching data from {endpoint} with params {params}...")
+    data = client.get(endpoint, params=params)
+    print("Data fetched successfully.")
+    return data
+
+# Fetch only the number of results (header.numFound) of a query from API
+def count_api_data(endpoint, client, params=None):
+    print(f"Counting {endpoint} with params {params}...")
+    num_found = client.count(endpoint, params=params)
+    print("Count fetched successfully.")
+    return num_found
+
+# Process the data file with all the Dutch institutions
+def process_institutions(data_file):
+    print(f"Loading data file from {data_file}...")
+    df = pd.read_csv(data_file)
+    if 'ROR_LINK' in df.columns:
+        # Deduplicate based on the ROR_LINK column
+        df = df.drop_duplicates(subset='ROR_LINK').reset_index(drop=True)
+        print("Duplicates removed based on the ROR_LINK column.")
+    else:
+        print("ROR_LINK column not found in the data.")
+    return df
+
+# Open the output file(s) and the checkpoint manifest, either for a new run or to resume the last one.
+# args are the command line options of the script (resume), default_checkpoint the manifest used
+# when Checkpoint_file is not set.
+def open_output(config, args, default_checkpoint):
+    checkpoint = Checkpoint(config.get('Checkpoint_file', default_checkpoint))
+    if args.resume and checkpoint.load():
+        output_file = checkpoint.output_file
+        parquet_dir = f"{output_file[:-4]}.parquet" if config.get('Output_parquet') else None
+        print(f"Resuming {output_file}, {len(checkpoint.completed)} institutions were already completed.")
+        writer = StreamingWriter.resume(output_file, OUTPUT_COLUMNS, checkpoint.completed, parquet_dir=parquet_dir)
+    else:
+        if args.resume:
+            print("No checkpoint found, starting a new run.")
+        timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M')
+        output_file = f"{timestamp}_nl-stats.csv"
+        parquet_dir = f"{output_file[:-4]}.parquet" if config.get('Output_parquet') else None
+        checkpoint.start(output_file)
+        writer = StreamingWriter(output_file, OUTPUT_COLUMNS, parquet_dir=parquet_dir)
+    return writer, checkpoint
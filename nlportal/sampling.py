@@ -0,0 +1,207 @@
+import argparse
+import math
+import random
+from statistics import NormalDist
+import pandas as pd
+import yaml
+from .client import APIError, OpenAIREClient
+from .engine import FetchEngine
+
+# The Graph API only pages through the first 10,000 results of a query
+MAX_PAGED_RESULTS = 10000
+
+def _pids(values):
+    return [pid for pid in values or [] if isinstance(pid, dict)]
+
+def _author_pid_schemes(record):
+    for author in record.get('authors') or []:
+        pid = (author.get('pid') or {}).get('id') or {}
+        if pid.get('scheme'):
+            yield pid['scheme'].lower()
+
+# Metadata fields whose completeness is estimated: name -> test of one research product record
+FIELDS = {
+    'doi': lambda record: any(str(pid.get('scheme', '')).lower() == 'doi' and pid.get('value') for pid in _pids(record.get('pids'))),
+    'abstract': lambda record: any(isinstance(text, str) and text.strip() for text in record.get('descriptions') or []),
+    'license': lambda record: any(instance.get('license') for instance in record.get('instances') or []),
+    'funder': lambda record: any(project.get('funder') for project in record.get('projects') or []),
+    'orcid': lambda record: any(scheme.startswith('orcid') for scheme in _author_pid_schemes(record)),
+    'publication_date': lambda record: bool(record.get('publicationDate')),
+    'publisher': lambda record: bool(record.get('publisher')),
+}
+
+# Wilson score interval of a proportion rate observed in n (effective) records
+def wilson_interval(rate, n, confidence=0.95):
+    if n <= 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    denominator = 1 + z * z / n
+    center = (rate + z * z / (2 * n)) / denominator
+    half = z / denominator * math.sqrt(rate * (1 - rate) / n + z * z / (4 * n * n))
+    return max(0.0, center - half), min(1.0, center + half)
+
+# Field completeness of randomly chosen result pages of one query, aggregated online: estimates()
+# can be called after every page that is added.
+#
+# A page is a cluster of records that are listed next to each other (e.g. from one source), so
+# the records of a page are not independent. The variance of a completeness rate is estimated
+# from the differences between the pages (ratio estimator, with a finite population correction
+# for the pages that can be sampled), and the Wilson interval is taken with the effective
+# number of records that variance corresponds to. When every page was sampled, the rates are
+# exact.
+#
+# Only the first MAX_PAGED_RESULTS results of a query can be paged through. For a query with more
+# results the pages are sampled from those first results (column reachable of the estimates),
+# which are not a random sample of all numFound: the estimates then only cover the first results,
+# and no finite population correction is applied since the pages are not the whole population.
+class CompletenessSample:
+    def __init__(self, num_found, page_size, fields=None, confidence=0.95):
+        self.num_found = num_found
+        self.page_size = page_size
+        self.fields = fields or FIELDS
+        self.confidence = confidence
+        # Only the pages within the first MAX_PAGED_RESULTS results can be sampled
+        self.reachable = min(num_found, MAX_PAGED_RESULTS)
+        self.total_pages = math.ceil(self.reachable / page_size)
+        # True when the query has results beyond the reachable ones
+        self.truncated = num_found > self.reachable
+        self.records = []
+        self.hits = {name: [] for name in self.fields}
+
+    # Add the results of one sampled page
+    def add(self, results):
+        self.records.append(len(results))
+        for name, test in self.fields.items():
+            self.hits[name].append(sum(1 for record in results if test(record)))
+
+    @property
+    def pages(self):
+        return len(self.records)
+
+    def _estimate(self, hits):
+        records = pd.Series(self.records, dtype='float64')
+        hits = pd.Series(hits, dtype='float64')
+        total = records.sum()
+        if total == 0:
+            return float('nan'), 0.0, 1.0
+        rate = hits.sum() / total
+        if self.pages >= self.total_pages and not self.truncated:
+            return rate, rate, rate
+        if self.pages < 2:
+            return (rate,) + wilson_interval(rate, total, self.confidence)
+        mean_records = total / self.pages
+        correction = 1 if self.truncated else 1 - self.pages / self.total_pages
+        variance = correction * ((hits - rate * records) ** 2).sum() / (self.pages * (self.pages - 1) * mean_records ** 2)
+        effective = total if variance == 0 else min(total, rate * (1 - rate) / variance)
+        return (rate,) + wilson_interval(rate, effective, self.confidence)
+
+    # Completeness rate per field with its confidence interval, and error: the larger distance
+    # from the rate to the bounds of the interval
+    def estimates(self):
+        rows = []
+        for name in self.fields:
+            rate, low, high = self._estimate(self.hits[name])
+            rows.append({
+                'field': name,
+                'rate': rate,
+                'low': low,
+                'high': high,
+                'error': max(rate - low, high - rate) if not math.isnan(rate) else float('nan'),
+            })
+        df = pd.DataFrame(rows)
+        df['sampled_records'] = sum(self.records)
+        df['sampled_pages'] = self.pages
+        df['numFound'] = self.num_found
+        df['reachable'] = self.reachable
+        return df
+
+    # Largest error of all fields; 1 when nothing was sampled yet
+    def max_error(self):
+        errors = self.estimates()['error']
+        return 1.0 if errors.isna().all() else float(errors.max())
+
+def _fetch_page(client, endpoint, params, page, page_size):
+    try:
+        return client.get(endpoint, dict(params, page=page, pageSize=page_size), cache=False).get('results') or []
+    except APIError as e:
+        print(f"Failed to retrieve page {page} of {endpoint} with {params}: {e.status_code}")
+        return None
+
+# Sample pages of a query in random order and yield the CompletenessSample after every batch of
+# pages (engine.max_in_flight pages at a time, fetched concurrently with a FetchEngine).
+# Stop iterating at any point: the estimates are valid for the pages sampled so far.
+def iter_sample(client, endpoint, params, pages=20, page_size=100, seed=None, engine=None, fields=None, confidence=0.95):
+    num_found = client.count(endpoint, params)
+    sample = CompletenessSample(num_found, page_size, fields, confidence)
+    if sample.truncated:
+        print(f"{endpoint} with {params} has {num_found} results, only the first {sample.reachable} can be sampled: the estimates cover those.")
+    order = random.Random(seed).sample(range(1, sample.total_pages + 1), min(pages, sample.total_pages))
+    batch_size = engine.max_in_flight if engine is not None else 1
+    for start in range(0, len(order), batch_size):
+        calls = [(_fetch_page, (client, endpoint, params, page, page_size), None) for page in order[start:start + batch_size]]
+        results = engine.fetch_all(calls) if engine is not None else [func(*args) for func, args, kwargs in calls]
+        for page_results in results:
+            if page_results is not None:
+                sample.add(page_results)
+        yield sample
+
+# Estimate the field completeness of the records of a query from at most pages random pages.
+# With max_error, sampling stops as soon as every interval is within max_error of its rate.
+def sample_completeness(client, endpoint, params, pages=20, page_size=100, max_error=None, seed=None, engine=None, fields=None, confidence=0.95):
+    sample = None
+    for sample in iter_sample(client, endpoint, params, pages, page_size, seed, engine, fields, confidence):
+        if max_error is not None and sample.pages >= 2 and sample.max_error() <= max_error:
+            break
+    if sample is None:
+        return CompletenessSample(0, page_size, fields, confidence).estimates()
+    return sample.estimates()
+
+# Completeness estimates of several queries, e.g. {org_id: {'relOrganizationId': org_id}}, as one
+# DataFrame with the key of each query in the column key
+def sample_many(client, queries, endpoint='researchProducts', key='id', **kwargs):
+    frames = []
+    for name, params in queries.items():
+        print(f"Sampling {endpoint} for {name}...")
+        df = sample_completeness(client, endpoint, params, **kwargs)
+        df.insert(0, key, name)
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+# Command line: python -m nlportal.sampling --org OPENORG_ID... --datasource DATASOURCE_ID... [--pages 20] [--max-error 0.05]
+def main():
+    parser = argparse.ArgumentParser(description="Estimate the metadata completeness of the research products of organisations and data sources from random result pages.")
+    parser.add_argument('--org', action='append', default=[], help="OpenOrg ID (relOrganizationId), can be repeated")
+    parser.add_argument('--datasource', action='append', default=[], help="data source ID (relCollectedFromDatasourceId), can be repeated")
+    parser.add_argument('--pages', type=int, default=20, help="maximum number of random pages per organisation or data source (default: 20)")
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--max-error', type=float, help="stop sampling when all confidence intervals are within this distance of their rate, e.g. 0.05")
+    parser.add_argument('--confidence', type=float, default=0.95)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--output', help="CSV file for the estimates (default: print them)")
+    parser.add_argument('--config', default='config.yaml')
+    args = parser.parse_args()
+
+    queries = {org_id: {'relOrganizationId': org_id} for org_id in args.org}
+    queries.update({datasource_id: {'relCollectedFromDatasourceId': datasource_id} for datasource_id in args.datasource})
+    if not queries:
+        raise Exception("Give at least one --org or --datasource")
+
+    with open(args.config) as file:
+        config = yaml.safe_load(file)
+    client = OpenAIREClient.from_config(config)
+    client.token.get()
+    engine = FetchEngine(config.get('Max_in_flight', 1))
+    try:
+        df = sample_many(client, queries, pages=args.pages, page_size=args.page_size, max_error=args.max_error,
+                         seed=args.seed, engine=engine, confidence=args.confidence)
+    finally:
+        engine.close()
+        client.close()
+    if args.output:
+        df.to_csv(args.output, index=False)
+        print(f"Estimates written to {args.output}")
+    else:
+        print(df.to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import heapq
+import json
+import os
+import numpy as np
+import pandas as pd
+from .client import COUNT_DROPPED_PARAMS
+from .instrumentation import request_label
+
+# Seconds per request when there is no trace of an earlier run to take the latencies from
+DEFAULT_LATENCY = 0.3
+SCHEDULES = ('file', 'largest-first')
+
+# The requests nl-stats.py makes per institution, per stage of fetch_institutions(): the lookup of
+# the ROR link, then 4 per OpenOrg, then 2 per data source
+ORG_LOOKUP = 'organizations[pid]'
+ORG_REQUESTS = ('organizations/{id}', 'researchProducts[relOrganizationId]', 'projects[relOrganizationId]', 'dataSources[relOrganizationId]')
+DATASOURCE_REQUESTS = ('researchProducts[relCollectedFromDatasourceId]', 'researchProducts[relCollectedFromDatasourceId,relOrganizationId]')
+
+# numFound of the researchProducts queries of an nl-stats output file: (relOrganizationId,
+# relCollectedFromDatasourceId) -> count, with None for the parameter that is not used
+def result_sizes(snapshot):
+    sizes = {}
+    for index, row in snapshot[snapshot['OpenOrg_ID'].notna()].iterrows():
+        sizes[(row['OpenOrg_ID'], None)] = row['Num_Found_ResearchProducts_for_OpenOrg']
+        if pd.notna(row['DataSource_ID']):
+            sizes[(None, row['DataSource_ID'])] = row['Num_Found_ResearchProducts_for_DataSource']
+            sizes[(row['OpenOrg_ID'], row['DataSource_ID'])] = row['Num_Found_ResearchProducts_for_OpenOrg_AND_DataSource']
+    return {key: value for key, value in sizes.items() if pd.notna(value)}
+
+# Latency model per request label from the API requests in a trace file (see Instrumentation):
+# label -> (seconds, seconds per result). Counts over more results take longer, so where the
+# trace has enough requests whose numFound is in the snapshot, latency = a + b * numFound is
+# fitted; for the other labels the mean latency is used. Cache hits and failed requests are left out.
+def latency_model(path, snapshot=None):
+    sizes = result_sizes(snapshot) if snapshot is not None else {}
+    rows = []
+    with open(path) as file:
+        for line in file:
+            record = json.loads(line)
+            if record.get('type') == 'request' and record.get('cache') != 'hit' and record.get('status') == 200:
+                # Counts are traced with pageSize, the labels of the model are without it
+                params = {name: value for name, value in (record.get('params') or {}).items() if name not in COUNT_DROPPED_PARAMS}
+                label = request_label(record['endpoint'].split('[')[0], params)
+                size = sizes.get((params.get('relOrganizationId'), params.get('relCollectedFromDatasourceId')), np.nan)
+                rows.append((label, record['latency'], size))
+    model = {}
+    for label, requests in pd.DataFrame(rows, columns=['endpoint', 'latency', 'size']).groupby('endpoint'):
+        model[label] = (requests['latency'].mean(), 0.0)
+        known = requests[requests['size'].notna()]
+        if len(known) >= 10 and known['size'].std() > 0:
+            slope, intercept = np.polyfit(known['size'], known['latency'], 1)
+            if slope > 0:
+                model[label] = (max(0.0, intercept), slope)
+    return model
+
+# Expected requests and seconds per institution, from the rows of the institution in a previous
+# nl-stats output (snapshot): its OpenOrgs and their data sources give the requests, the latency
+# model (see latency_model()) their duration. One row per ROR link of institutions, with the
+# seconds of each stage and numFound, the products of the OpenOrgs and their data sources.
+# Institutions that are not in the snapshot get the median of the others (source 'median').
+def estimate_costs(institutions, snapshot, model=None, default_latency=DEFAULT_LATENCY):
+    model = model or {}
+    def latency(label, size=0):
+        seconds, per_result = model.get(label, (default_latency, 0.0))
+        return seconds + per_result * (0 if pd.isna(size) else size)
+
+    by_ror = {ror: rows for ror, rows in snapshot.groupby(snapshot['ROR_ID'].astype(str))} if snapshot is not None else {}
+    rows = []
+    for index, row in institutions.iterrows():
+        ror_link = str(row['ROR_LINK'])
+        found = by_ror.get(ror_link)
+        if found is None:
+            rows.append({'ROR_LINK': ror_link, 'name': row.get('full_name_in_English'), 'source': 'median'})
+            continue
+        found = found[found['OpenOrg_ID'].notna()]
+        orgs = found.drop_duplicates(subset='OpenOrg_ID')
+        datasources = found[found['DataSource_ID'].notna()]
+        rows.append({
+            'ROR_LINK': ror_link,
+            'name': row.get('full_name_in_English'),
+            'source': 'snapshot',
+            'openorgs': len(orgs),
+            'datasources': len(datasources),
+            'numFound': int(orgs['Num_Found_ResearchProducts_for_OpenOrg'].fillna(0).sum() + datasources['Num_Found_ResearchProducts_for_DataSource'].fillna(0).sum()),
+            'requests': 1 + len(ORG_REQUESTS) * len(orgs) + len(DATASOURCE_REQUESTS) * len(datasources),
+            'stage_1': latency(ORG_LOOKUP),
+            'stage_2': sum(
+                latency(label, org['Num_Found_ResearchProducts_for_OpenOrg'] if label.startswith('researchProducts') else 0)
+                for index, org in orgs.iterrows() for label in ORG_REQUESTS
+            ),
+            'stage_3': sum(
+                latency(DATASOURCE_REQUESTS[0], ds['Num_Found_ResearchProducts_for_DataSource'])
+                + latency(DATASOURCE_REQUESTS[1], ds['Num_Found_ResearchProducts_for_OpenOrg_AND_DataSource'])
+                for index, ds in datasources.iterrows()
+            ),
+        })
+    costs = pd.DataFrame(rows, columns=[
+        'ROR_LINK', 'name', 'source', 'openorgs', 'datasources', 'numFound', 'requests', 'stage_1', 'stage_2', 'stage_3',
+    ])
+    known = costs['source'] == 'snapshot'
+    for column in ('openorgs', 'datasources', 'numFound', 'requests', 'stage_2', 'stage_3'):
+        costs[column] = pd.to_numeric(costs[column]).fillna(costs.loc[known, column].median() if known.any() else 0)
+    costs['stage_1'] = pd.to_numeric(costs['stage_1']).fillna(latency(ORG_LOOKUP))
+    costs['requests'] = costs['requests'].clip(lower=1)
+    costs['seconds'] = costs['stage_1'] + costs['stage_2'] + costs['stage_3']
+    return costs
+
+# Pending (index, row) pairs of nl-stats.py, the most expensive institutions first. Institutions
+# with the same expected seconds are ordered by numFound, and otherwise keep their order.
+def largest_first(pending, costs):
+    by_ror = costs.set_index('ROR_LINK')[['seconds', 'numFound']].to_dict('index')
+    key = lambda item: by_ror.get(str(item[1]['ROR_LINK']), {'seconds': 0, 'numFound': 0})
+    return sorted(pending, key=lambda item: (-key(item)['seconds'], -key(item)['numFound']))
+
+# Seconds for one batch: the stages run one after the other, the requests of a stage run
+# max_in_flight at a time (but a stage takes at least as long as its slowest request)
+def batch_seconds(batch_costs, max_in_flight=1):
+    seconds = 0.0
+    for stage in ('stage_1', 'stage_2', 'stage_3'):
+        seconds += max(batch_costs[stage].max(), batch_costs[stage].sum() / max_in_flight) if len(batch_costs) else 0.0
+    return seconds
+
+# Expected duration of a run over the institutions in the given order (ROR links): batches of
+# batch_size taken from one queue by the shards, each batch as in batch_seconds(), but never
+# faster than the rate limit allows for all requests
+def simulate(costs, order, batch_size=10, max_in_flight=1, shards=1, rate=None):
+    costs = costs.set_index('ROR_LINK').loc[[str(ror_link) for ror_link in order]]
+    workers = [0.0] * max(1, shards)
+    for start in range(0, len(costs), batch_size):
+        heapq.heappush(workers, heapq.heappop(workers) + batch_seconds(costs.iloc[start:start + batch_size], max_in_flight))
+    duration = max(workers)
+    if rate:
+        duration = max(duration, costs['requests'].sum() / rate)
+    return duration
+
+# The dry-run plan of a run as text: expected requests and duration for the file order and for the
+# largest-first order, and the most expensive institutions
+def plan_text(costs, schedule, batch_size=10, max_in_flight=1, shards=1, rate=None, top=10):
+    file_order = list(costs['ROR_LINK'])
+    largest = list(costs.sort_values(['seconds', 'numFound'], ascending=False, kind='stable')['ROR_LINK'])
+    durations = {
+        'file': simulate(costs, file_order, batch_size, max_in_flight, shards, rate),
+        'largest-first': simulate(costs, largest, batch_size, max_in_flight, shards, rate),
+    }
+    estimated = int((costs['source'] == 'median').sum())
+    lines = [
+        f"Plan for {len(costs)} institutions ({estimated} not in the snapshot, estimated with the median): "
+        f"{int(costs['requests'].sum())} requests, {int(costs['datasources'].sum())} data sources",
+        f"Expected duration with Max_in_flight {max_in_flight}, {shards} shard(s), batches of {batch_size}"
+        f"{f' and at most {rate:g} requests/s' if rate else ''}:",
+    ]
+    for name, seconds in durations.items():
+        lines.append(f"  {name:<14} {seconds:8.1f} s{'  <- schedule of this run' if name == schedule else ''}")
+    lines.append("Most expensive institutions:")
+    for index, row in costs.sort_values(['seconds', 'numFound'], ascending=False, kind='stable').head(top).iterrows():
+        lines.append(
+            f"  {str(row['name'])[:50]:<50} {int(row['openorgs'])} OpenOrg(s) {int(row['datasources']):3d} data sources "
+            f"{int(row['numFound']):9d} products {int(row['requests']):4d} requests {row['seconds']:6.1f} s ({row['source']})"
+        )
+    return '\n'.join(lines)
+
+# The latency model of the trace file of earlier runs (Trace_file or --trace), when there is one
+def latency_model_for(config, snapshot, trace_file=None):
+    for path in (trace_file, config.get('Trace_file')):
+        if path and os.path.exists(path):
+            model = latency_model(path, snapshot)
+            if model:
+                print(f"Request latencies taken from {path}.")
+                return model
+    return {}
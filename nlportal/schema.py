@@ -0,0 +1,133 @@
+import argparse
+import ast
+import os
+import pandas as pd
+
+# Columns of the wide nl-metadata-stats output, per table they are normalized into
+ORGANIZATION_COLUMNS = [
+    'full_name_in_English', 'acronym_EN', 'acronym_AGG', 'main_grouping', 'ROR', 'ROR_LINK',
+    'OpenAlex_ID', 'OpenAlex_LINK', 'OpenAIRE_ID', 'OpenAIRE_LINK', 'OpenAIRE_Org_ID', 'OpenAIRE_Org_ID_Explore_URL',
+    'numFound_ResearchProducts_OpenOrgs', 'numFound_ResearchProjects_OpenOrgs',
+]
+DATASOURCE_COLUMNS = [
+    'DataSource_ID', 'DataSource_Name', 'DataSource_Compatibility', 'DataSource_LastValidated', 'DataSource_URL',
+    'DataSource_Explore_URL', 'numFound_ResearchProducts_DataSource',
+]
+# Keys of the dicts in the DataSources column of the wide view
+DATASOURCE_LIST_KEYS = ['DataSource_ID', 'DataSource_Name', 'DataSource_Compatibility', 'DataSource_LastValidated', 'DataSource_URL']
+COUNT_COLUMNS = [
+    'numFound_ResearchProducts_OpenOrgs', 'numFound_ResearchProjects_OpenOrgs',
+    'numFound_ResearchProducts_DataSource', 'numFound_ResearchProducts_DataSource_AND_OpenOrgs',
+]
+# Column order of the wide view
+WIDE_COLUMNS = ORGANIZATION_COLUMNS + ['DataSources'] + DATASOURCE_LIST_KEYS + [
+    'DataSource_Explore_URL', 'numFound_ResearchProducts_DataSource', 'numFound_ResearchProducts_DataSource_AND_OpenOrgs',
+    'numMissing_ResearchProducts_in_DataSource', 'numMissing_ResearchProducts_in_OpenOrgs', 'retrieved on',
+]
+TABLES = ('organizations', 'datasources', 'links')
+
+def _datasource_ids(value):
+    if isinstance(value, str):
+        value = ast.literal_eval(value)
+    if not isinstance(value, list):
+        return None
+    return [ds['DataSource_ID'] for ds in value]
+
+def _typed(df):
+    for column in df.columns:
+        if column in COUNT_COLUMNS:
+            df[column] = df[column].astype('Int64')
+        elif column not in ('org_key', 'DataSource_IDs', 'retrieved_on'):
+            df[column] = df[column].astype('string')
+    return df
+
+# Split a wide nl-metadata-stats frame (as written by the notebook, or read back from its CSV)
+# into three typed tables:
+#   organizations: one row per institution of the data file, with its OpenOrg and counts
+#   datasources:   one row per data source, with its research product count
+#   links:         one row per row of the wide frame (institution, data source), with the joint count
+# The numMissing columns, and the DataSources list, are derived again by wide_view().
+def normalize(wide):
+    wide = wide.reset_index(drop=True)
+    organizations = wide[ORGANIZATION_COLUMNS].copy()
+    organizations['DataSource_IDs'] = wide['DataSources'].map(_datasource_ids)
+    organizations['retrieved_on'] = pd.to_datetime(wide['retrieved on'])
+    # The same institution on consecutive or distant rows gets one key
+    values = organizations.astype(object).where(organizations.notna(), None)
+    identity = pd.Series(list(zip(*[values[column] for column in values.columns if column != 'DataSource_IDs'], organizations['DataSource_IDs'].map(str))))
+    org_keys = pd.Series(pd.factorize(identity)[0], index=wide.index)
+    organizations = organizations.loc[~identity.duplicated()].reset_index(drop=True)
+    organizations.insert(0, 'org_key', range(len(organizations)))
+
+    datasources = wide.loc[wide['DataSource_ID'].notna(), DATASOURCE_COLUMNS].drop_duplicates(subset='DataSource_ID').reset_index(drop=True)
+
+    links = pd.DataFrame({
+        'org_key': org_keys,
+        'DataSource_ID': wide['DataSource_ID'],
+        'numFound_ResearchProducts_DataSource_AND_OpenOrgs': wide['numFound_ResearchProducts_DataSource_AND_OpenOrgs'],
+    })
+    return {
+        'organizations': _typed(organizations),
+        'datasources': _typed(datasources),
+        'links': _typed(links),
+    }
+
+# Rebuild the wide frame from the tables of normalize(), rows in their original order
+def wide_view(tables):
+    organizations = tables['organizations']
+    datasources = tables['datasources'].set_index('DataSource_ID')
+    wide = tables['links'].merge(organizations, on='org_key', how='left', sort=False)
+    wide = wide.merge(datasources, left_on='DataSource_ID', right_index=True, how='left', sort=False)
+
+    # Rows without a data source were counted as 0 products in the data source
+    wide['numFound_ResearchProducts_DataSource'] = wide['numFound_ResearchProducts_DataSource'].fillna(0)
+    for column in COUNT_COLUMNS:
+        wide[column] = wide[column].astype('float64')
+    wide['numFound_ResearchProducts_DataSource'] = wide['numFound_ResearchProducts_DataSource'].astype('int64')
+    wide['numMissing_ResearchProducts_in_DataSource'] = wide['numFound_ResearchProducts_DataSource'] - wide['numFound_ResearchProducts_DataSource_AND_OpenOrgs']
+    wide['numMissing_ResearchProducts_in_OpenOrgs'] = wide['numFound_ResearchProducts_OpenOrgs'] - wide['numFound_ResearchProducts_DataSource_AND_OpenOrgs']
+    wide['retrieved on'] = wide['retrieved_on'].dt.strftime('%Y-%m-%d %H:%M:%S')
+
+    # The DataSources list of each organization, as the notebook builds it from the API response
+    attributes = datasources[DATASOURCE_LIST_KEYS[1:]].astype(object)
+    attributes = attributes.where(attributes.notna(), None)
+    lookup = {ds_id: dict(zip(DATASOURCE_LIST_KEYS, (ds_id,) + tuple(values))) for ds_id, values in zip(attributes.index, attributes.itertuples(index=False))}
+    lists = {
+        org_key: None if ids is None else [lookup[ds_id] for ds_id in ids]
+        for org_key, ids in zip(organizations['org_key'], organizations['DataSource_IDs'])
+    }
+    wide['DataSources'] = wide['org_key'].map(lists)
+    text = [column for column in WIDE_COLUMNS if column not in COUNT_COLUMNS and column != 'DataSources' and not column.startswith('numMissing')]
+    wide[text] = wide[text].astype(object).where(wide[text].notna(), None)
+    return wide[WIDE_COLUMNS]
+
+# Write the tables as Parquet files into a directory
+def write_tables(tables, directory):
+    os.makedirs(directory, exist_ok=True)
+    for name in TABLES:
+        tables[name].to_parquet(os.path.join(directory, f"{name}.parquet"), index=False)
+    return directory
+
+def read_tables(directory):
+    return {name: pd.read_parquet(os.path.join(directory, f"{name}.parquet")) for name in TABLES}
+
+# Load the wide view straight from a directory written by write_tables()
+def read_wide(directory):
+    return wide_view(read_tables(directory))
+
+def _size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path)
+
+# Command line: convert wide nl-metadata-stats CSV files into table directories next to them
+def main():
+    parser = argparse.ArgumentParser(description="Convert wide nl-metadata-stats CSV files into normalized Parquet tables.")
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args()
+    for path in args.files:
+        directory = write_tables(normalize(pd.read_csv(path)), os.path.splitext(path)[0])
+        print(f"{path} ({_size(path) / 1024:.0f} KB) -> {directory}/ ({_size(directory) / 1024:.0f} KB)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+import argparse
+import glob
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+import pandas as pd
+from .incremental import find_latest_snapshot
+
+# Output files the index is built from, besides the latest nl-stats output: one per publication window
+SOURCES = ('org_stats_*_*.csv', 'grouped_stats_*_*.csv', 'org_shared-costs_*_*.csv')
+COST_COLUMNS = {'Category': 'category', 'annual OpenAIRE membership costs': 'membership_costs', 'portal_costs': 'portal_costs', 'total_costs': 'total_costs'}
+
+# The files of directory that make up the index: the latest nl-stats output and the org_stats,
+# grouped_stats and org_shared-costs files of all windows
+def source_files(directory='.'):
+    latest = find_latest_snapshot(directory)
+    files = [latest] if latest else []
+    for pattern in SOURCES:
+        files.extend(sorted(glob.glob(os.path.join(directory, pattern))))
+    return files
+
+# Changes when a file of the index is added, replaced or rewritten
+def signature(files):
+    return tuple((path, os.path.getmtime(path), os.path.getsize(path)) for path in files if os.path.exists(path))
+
+def _value(value):
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        return int(value) if value.is_integer() else value
+    if hasattr(value, 'item'):
+        return _value(value.item())
+    return value
+
+def _record(row, columns):
+    return {name: _value(row[column]) for column, name in columns.items() if column in row}
+
+# The window of an org_stats_2021_2024.csv file, e.g. '2021_2024'
+def _window(path):
+    return '_'.join(os.path.splitext(os.path.basename(path))[0].split('_')[-2:])
+
+def ror_link(value):
+    value = str(value)
+    return value if value.startswith('http') else f"https://ror.org/{value}"
+
+# Read-only index of the output files of the latest runs.
+#
+# Every response is built when the index is built: a JSON body and its ETag per path, e.g.
+# /institutions/https://ror.org/04pp8hn57, /organizations/openorgs____::..., /datasources/...,
+# /groups/UNL and /groups. A request is then a dict lookup; a new run means a new index.
+class StatsIndex:
+    def __init__(self, files):
+        self.files = list(files)
+        self.signature = signature(self.files)
+        self.built_at = time.time()
+        self.responses = {}
+        runs = [path for path in self.files if path.endswith('_nl-stats.csv')]
+        stats = pd.read_csv(runs[0]) if runs else pd.DataFrame(columns=['ROR_ID', 'OpenOrg_ID', 'DataSource_ID', 'ROR_Group'])
+        windows = {_window(path): pd.read_csv(path) for path in self.files if os.path.basename(path).startswith('org_stats_')}
+        grouped = {_window(path): pd.read_csv(path) for path in self.files if os.path.basename(path).startswith('grouped_stats_')}
+        costs = {_window(path): pd.read_csv(path) for path in self.files if os.path.basename(path).startswith('org_shared-costs_')}
+        self._build(stats, windows, grouped, costs)
+
+    @classmethod
+    def from_directory(cls, directory='.'):
+        return cls(source_files(directory))
+
+    def _put(self, path, data):
+        body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+        self.responses[path] = (body, f'"{hashlib.md5(body).hexdigest()[:20]}"')
+
+    def _build(self, stats, windows, grouped, costs):
+        datasource_columns = {
+            'DataSource_ID': 'id', 'DataSource_Name': 'name', 'DataSource_Compatibility': 'compatibility',
+            'DataSource_LastValidated': 'last_validated', 'DataSource_URL': 'url',
+            'Num_Found_ResearchProducts_for_DataSource': 'numFound',
+            'Num_Found_ResearchProducts_for_OpenOrg_AND_DataSource': 'numFound_for_OpenOrg',
+            'Num_Missing_ResearchProducts_in_DataSource': 'numMissing_in_DataSource',
+            'Num_Missing_ResearchProducts_in_OpenOrg': 'numMissing_in_OpenOrg',
+        }
+        # Organisation -> its record, with the counts of every window and the costs
+        organizations = {}
+        for openorg_id, rows in stats[stats['OpenOrg_ID'].notna()].groupby('OpenOrg_ID', sort=False):
+            first = rows.iloc[0]
+            organizations[openorg_id] = dict(
+                _record(first, {'OpenOrg_ID': 'id', 'OpenOrg_Name': 'name', 'OpenOrg_Website': 'website', 'ROR_ID': 'ror'}),
+                numFound=_value(first['Num_Found_ResearchProducts_for_OpenOrg']),
+                windows={},
+                costs={},
+                datasources=[_record(row, datasource_columns) for index, row in rows[rows['DataSource_ID'].notna()].iterrows()],
+            )
+        for window, df in windows.items():
+            for index, row in df[df['OpenAIRE_Org_ID'].notna()].iterrows():
+                organization = organizations.setdefault(row['OpenAIRE_Org_ID'], {
+                    'id': row['OpenAIRE_Org_ID'], 'name': None, 'website': None, 'ror': _value(row['ROR_LINK']),
+                    'numFound': _value(row['numFound_ResearchProducts_OpenOrgs']), 'windows': {}, 'costs': {}, 'datasources': [],
+                })
+                organization['windows'][window] = _value(row[f"numFound_ResearchProducts_{window}"])
+        for window, df in costs.items():
+            for index, row in df[df['OpenAIRE_Org_ID'].isin(list(organizations))].iterrows():
+                organizations[row['OpenAIRE_Org_ID']]['costs'][window] = _record(row, COST_COLUMNS)
+
+        # Institution (ROR link) -> its details from the data file columns and its organisations
+        institutions = {}
+        def institution(link, name, acronym, acronym_agg, group):
+            return institutions.setdefault(link, {
+                'ror': link, 'name': _value(name), 'acronym': _value(acronym), 'acronym_agg': _value(acronym_agg),
+                'main_grouping': _value(group), 'retrieved_on': None, 'organizations': [],
+            })
+        for link, rows in stats[stats['ROR_ID'].notna()].groupby('ROR_ID', sort=False):
+            first = rows.iloc[0]
+            record = institution(link, first['ROR_Name'], first['ROR_Acronym'], first['ROR_Acronym_Agg'], first['ROR_Group'])
+            record['retrieved_on'] = _value(first.get('Retrieved_On'))
+        for df in windows.values():
+            for index, row in df[df['ROR_LINK'].notna()].iterrows():
+                institution(row['ROR_LINK'], row['full_name_in_English'], row['acronym_EN'], row['acronym_AGG'], row['main_grouping'])
+        for openorg_id, organization in organizations.items():
+            if organization['ror'] in institutions and openorg_id not in institutions[organization['ror']]['organizations']:
+                institutions[organization['ror']]['organizations'].append(openorg_id)
+
+        for link, record in institutions.items():
+            self._put(f"/institutions/{link}", dict(record, organizations=[organizations[openorg_id] for openorg_id in record['organizations']]))
+        self._put('/institutions', [
+            {key: record[key] for key in ('ror', 'name', 'acronym', 'main_grouping')} for record in institutions.values()
+        ])
+        for openorg_id, organization in organizations.items():
+            self._put(f"/organizations/{openorg_id}", dict(organization, institution=institutions.get(organization['ror'], {}).get('name')))
+
+        # Data source -> the organisations it is linked to
+        datasources = {}
+        for openorg_id, organization in organizations.items():
+            for datasource in organization['datasources']:
+                entry = datasources.setdefault(datasource['id'], {key: datasource.get(key) for key in ('id', 'name', 'compatibility', 'last_validated', 'url', 'numFound')})
+                entry.setdefault('organizations', []).append({
+                    'id': openorg_id, 'ror': organization['ror'], 'numFound_for_OpenOrg': datasource.get('numFound_for_OpenOrg'),
+                    'numMissing_in_DataSource': datasource.get('numMissing_in_DataSource'), 'numMissing_in_OpenOrg': datasource.get('numMissing_in_OpenOrg'),
+                })
+        for datasource_id, datasource in datasources.items():
+            self._put(f"/datasources/{datasource_id}", datasource)
+
+        # main_grouping -> aggregates over its institutions, and the grouped_stats of every window
+        groups = {}
+        for link, record in institutions.items():
+            if record['main_grouping'] is None:
+                continue
+            group = groups.setdefault(record['main_grouping'], {
+                'main_grouping': record['main_grouping'], 'institutions': 0, 'organizations': 0, 'datasources': 0,
+                'numFound': 0, 'windows': {}, 'costs': {}, 'members': [],
+            })
+            group['institutions'] += 1
+            group['members'].append(link)
+            for openorg_id in record['organizations']:
+                organization = organizations[openorg_id]
+                group['organizations'] += 1
+                group['datasources'] += len(organization['datasources'])
+                group['numFound'] += organization['numFound'] or 0
+                for window, costs_of_window in organization['costs'].items():
+                    group['costs'][window] = group['costs'].get(window, 0) + (costs_of_window.get('total_costs') or 0)
+        for window, df in grouped.items():
+            for index, row in df.iterrows():
+                if row['main_grouping'] in groups:
+                    groups[row['main_grouping']]['windows'][window] = {
+                        column.replace(f"_numFound_{window}", ''): _value(row[column]) for column in df.columns if column != 'main_grouping'
+                    }
+        for name, group in groups.items():
+            self._put(f"/groups/{name}", group)
+        self._put('/groups', [{key: value for key, value in group.items() if key != 'members'} for group in groups.values()])
+
+        self._put('/status', {
+            'files': [os.path.basename(path) for path in self.files],
+            'built_at': self.built_at,
+            'institutions': len(institutions), 'organizations': len(organizations),
+            'datasources': len(datasources), 'groups': len(groups),
+        })
+
+    # Body and ETag of the response for a path, or None. Institutions are also found by their ROR ID.
+    def response(self, path):
+        found = self.responses.get(path)
+        if found is None and path.startswith('/institutions/'):
+            found = self.responses.get(f"/institutions/{ror_link(path[len('/institutions/'):])}")
+        return found
+
+# Request handler; server.index is the current StatsIndex
+class StatsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without this each keep-alive response waits for
+    # the delayed ACK of the client (about 40 ms)
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, etag=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+            # Clients may keep the response, but have to check with the ETag whether it is still current
+            self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = unquote(urlsplit(self.path).path).rstrip('/') or '/status'
+        found = self.server.index.response(path)
+        if found is None:
+            return self.send_body(404, json.dumps({'error': f"Not found: {path}"}).encode())
+        body, etag = found
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match and (if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_body(200, body, etag)
+
+# HTTP server answering from a StatsIndex of directory, which is rebuilt when the files of the
+# index change (checked every reload_interval seconds, on a background thread). nl-stats.py writes
+# its output while it runs, so a change is only taken once the files were the same at two checks
+# in a row. The old index keeps answering until the new one is complete; when building fails,
+# the old one stays.
+class StatsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, directory='.', reload_interval=10):
+        super().__init__(address, StatsHandler)
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self.index = StatsIndex.from_directory(directory)
+        self._seen = self.index.signature
+        self._stop = threading.Event()
+        self._watcher = None
+        if reload_interval:
+            self._watcher = threading.Thread(target=self._watch, name='reload', daemon=True)
+            self._watcher.start()
+
+    # Build a new index when files were added or changed and have not changed since the previous
+    # check (or right away with wait=False); True when the index was replaced
+    def reload(self, wait=True):
+        files = source_files(self.directory)
+        current = signature(files)
+        seen, self._seen = self._seen, current
+        if current == self.index.signature or (wait and current != seen):
+            return False
+        try:
+            index = StatsIndex(files)
+        except Exception as e:
+            print(f"Reloading the index failed, keeping the previous one: {e}")
+            return False
+        self.index = index
+        print(f"Index reloaded from {', '.join(os.path.basename(path) for path in files)}")
+        return True
+
+    def _watch(self):
+        while not self._stop.wait(self.reload_interval):
+            self.reload()
+
+    def server_close(self):
+        self._stop.set()
+        super().server_close()
+
+# Command line: python -m nlportal.service [--dir .] [--port 8050]
+def main():
+    parser = argparse.ArgumentParser(description="Serve the output of the latest runs as JSON: institutions, organisations, data sources and groups.")
+    parser.add_argument('--dir', default='.', help="directory with the output files (default: current directory)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--reload-interval', type=float, default=10, help="seconds between checks for new output files (0: never reload)")
+    args = parser.parse_args()
+
+    server = StatsServer((args.host, args.port), args.dir, args.reload_interval)
+    status = json.loads(server.index.response('/status')[0])
+    print(f"Serving {status['institutions']} institutions from {', '.join(status['files']) or 'no files'} on http://{args.host}:{server.server_address[1]}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import multiprocessing
+import os
+import pandas as pd
+from .ratelimit import AdaptiveRateLimiter
+
+def _shared(index):
+    return property(lambda self: self._state[index], lambda self, value: self._state.__setitem__(index, value))
+
+# AdaptiveRateLimiter whose state lives in shared memory, so the worker processes of a sharded
+# run draw from one rate budget: Rate_limit is the rate of the whole run, not of each worker,
+# and a 429 seen by one worker slows all of them down.
+# Pass it to the workers when they are started (as an argument of the Process).
+class SharedRateLimiter(AdaptiveRateLimiter):
+    rate = _shared(0)
+    throttled = _shared(1)
+    _tokens = _shared(2)
+    _updated = _shared(3)
+    _paused_until = _shared(4)
+    _decreased_at = _shared(5)
+
+    def __init__(self, *args, context=None, **kwargs):
+        context = context or multiprocessing.get_context()
+        self._state = context.RawArray('d', 6)
+        super().__init__(*args, **kwargs)
+        # time.monotonic() is the same clock in all processes
+        self._lock = context.Lock()
+
+# Run worker(shard, queue, *args) in the given number of processes. The items are put on a
+# shared queue in batches of batch_size, so a worker that is done with a batch takes the
+# next one and slow institutions do not hold up a whole shard. Each worker gets a None
+# when the queue is empty.
+def run_shards(items, worker, shards, args=(), batch_size=10, context=None):
+    context = context or multiprocessing.get_context()
+    queue = context.Queue()
+    for start in range(0, len(items), batch_size):
+        queue.put(items[start:start + batch_size])
+    for shard in range(shards):
+        queue.put(None)
+    processes = [
+        context.Process(target=worker, args=(shard, queue) + tuple(args), name=f"shard-{shard}")
+        for shard in range(shards)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    failed = [process.name for process in processes if process.exitcode != 0]
+    if failed:
+        raise Exception(f"Shards failed: {', '.join(failed)}, run again with --resume to finish the remaining institutions")
+
+# Output part of one shard of a run writing to output_file, e.g. 2025-05-09_13-00_nl-stats.shards/part-0.csv
+def part_file(output_file, shard):
+    return os.path.join(f"{os.path.splitext(output_file)[0]}.shards", f"part-{shard}.csv")
+
+# The part files written so far for output_file
+def part_files(output_file):
+    directory = os.path.dirname(part_file(output_file, 0))
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith('.csv')]
+
+# Merge the CSV parts of a sharded run into output_file. Rows are put in the order of their
+# key_column value in order (the institution list); the rows of one key keep the order of
+# their part. The values are copied as text, so the file is the same as a run without shards.
+def merge_parts(parts, output_file, key_column, order):
+    frames = [pd.read_csv(part, dtype=str, keep_default_na=False) for part in parts if os.path.getsize(part)]
+    if not frames:
+        return 0
+    merged = pd.concat(frames, ignore_index=True)
+    # A missing key is an empty field in the parts
+    position = {}
+    for number, key in enumerate(order):
+        position.setdefault('' if pd.isna(key) else str(key), number)
+    merged = merged.iloc[merged[key_column].map(position).fillna(len(position)).argsort(kind='stable')]
+    merged.to_csv(output_file, index=False)
+    return len(merged)
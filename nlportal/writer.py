@@ -0,0 +1,104 @@
+import datetime
+import json
+import os
+import pandas as pd
+
+# Write a DataFrame as a Parquet file. Text columns are typed explicitly, a column that is empty
+# in one part would otherwise get a different type than in the other parts
+def write_parquet(df, path):
+    text_columns = [column for column in df.columns if df[column].dtype == object]
+    df.astype({column: 'string' for column in text_columns}).to_parquet(path, index=False)
+
+# Write result rows to the output file(s) as soon as they are available.
+#
+# Rows are appended to a CSV file; when parquet_dir is given every write also becomes
+# one part file in that directory (read it back with pd.read_parquet(parquet_dir)).
+# Nothing is kept in memory, so a crash only loses the rows that were not written yet.
+class StreamingWriter:
+    def __init__(self, csv_path, columns, parquet_dir=None, append=False):
+        self.csv_path = csv_path
+        # Column order of the output, a 'Retrieved_On' timestamp is added to every row
+        self.columns = list(columns) + ['Retrieved_On']
+        self.parquet_dir = parquet_dir
+        self.rows_written = 0
+        self._header = not (append and os.path.exists(csv_path))
+        self._part = 0
+        if parquet_dir:
+            os.makedirs(parquet_dir, exist_ok=True)
+            # A new run replaces the parts of an earlier run with the same output name, like the CSV file
+            if not append:
+                for name in os.listdir(parquet_dir):
+                    if name.endswith('.parquet'):
+                        os.remove(os.path.join(parquet_dir, name))
+            self._part = len([name for name in os.listdir(parquet_dir) if name.endswith('.parquet')])
+
+    # Reopen the output of an interrupted run, keeping only the rows of the given ROR links.
+    # Rows of institutions that were not completed are removed, they will be written again.
+    @classmethod
+    def resume(cls, csv_path, columns, keep_ror_links, parquet_dir=None, ror_column='ROR_ID'):
+        if os.path.exists(csv_path):
+            df = pd.read_csv(csv_path)
+            df[df[ror_column].astype(str).isin(keep_ror_links)].to_csv(csv_path, index=False)
+        if parquet_dir and os.path.isdir(parquet_dir):
+            for name in sorted(os.listdir(parquet_dir)):
+                part = os.path.join(parquet_dir, name)
+                df = pd.read_parquet(part)
+                kept = df[df[ror_column].astype(str).isin(keep_ror_links)]
+                if len(kept) < len(df):
+                    if len(kept):
+                        kept.to_parquet(part, index=False)
+                    else:
+                        os.remove(part)
+        return cls(csv_path, columns, parquet_dir=parquet_dir, append=True)
+
+    def write_rows(self, rows):
+        if not rows:
+            return
+        df = pd.DataFrame(rows, columns=self.columns)
+        # Rows reused from an earlier snapshot keep their own timestamp
+        df['Retrieved_On'] = pd.to_datetime(df['Retrieved_On']).fillna(pd.Timestamp(datetime.datetime.now()))
+        df.to_csv(self.csv_path, mode='w' if self._header else 'a', header=self._header, index=False)
+        self._header = False
+        if self.parquet_dir:
+            write_parquet(df, os.path.join(self.parquet_dir, f"part-{self._part:05d}.parquet"))
+            self._part += 1
+        self.rows_written += len(rows)
+
+# Manifest of the institutions (ROR links) whose rows have been written.
+#
+# The first line records the output file of the run, every following line one completed
+# ROR link. Lines are appended and flushed one by one, so the manifest survives a crash.
+# ROR links are stored as strings, so a missing link (NaN) is recognised again as 'nan'.
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self.output_file = None
+        self.completed = set()
+
+    # Start a new manifest for a run writing to output_file
+    def start(self, output_file):
+        self.output_file = output_file
+        self.completed = set()
+        with open(self.path, 'w') as file:
+            file.write(json.dumps({'output_file': output_file}) + '\n')
+
+    # Read the manifest of an earlier run, returns False when there is none
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'r') as file:
+            lines = [json.loads(line) for line in file if line.strip()]
+        if not lines:
+            return False
+        self.output_file = lines[0]['output_file']
+        self.completed = {line['ROR_LINK'] for line in lines[1:]}
+        return True
+
+    def mark(self, ror_link):
+        self.completed.add(str(ror_link))
+        with open(self.path, 'a') as file:
+            file.write(json.dumps({'ROR_LINK': str(ror_link)}) + '\n')
+            file.flush()
+
+    def __contains__(self, ror_link):
+        return str(ror_link) in self.completed
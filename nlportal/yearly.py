@@ -0,0 +1,118 @@
+import sqlite3
+import threading
+import time
+import pandas as pd
+from .client import APIError
+
+# Research product counts per organisation and publication year, kept in SQLite.
+#
+# A publication window (e.g. 2021-2024) is the sum of the counts of its years, so once the
+# years are stored any window over them is derived without API calls: org_stats_2020_2023
+# and org_stats_2021_2024 together need the counts of 5 years instead of two sweeps of
+# 4-year windows. Counts older than max_age_days are fetched again, records keep being
+# added to the graph for recent years.
+class YearlyCounts:
+    def __init__(self, path, max_age_days=30):
+        self.path = path
+        self.max_age = max_age_days * 24 * 3600 if max_age_days else None
+        self.fetched = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS year_counts ('
+            ' org_id TEXT NOT NULL,'
+            ' year INTEGER NOT NULL,'
+            ' count INTEGER NOT NULL,'
+            ' fetched_at REAL NOT NULL,'
+            ' PRIMARY KEY (org_id, year))'
+        )
+        self._conn.commit()
+
+    # The query for the research products of one organisation published in one year
+    @staticmethod
+    def query(org_id, year):
+        return {
+            'relOrganizationId': org_id,
+            'fromPublicationDate': f"{year}-01-01",
+            'toPublicationDate': f"{year}-12-31",
+        }
+
+    # Stored counts as a DataFrame with org_id, year, count and fetched_at (a timestamp)
+    def frame(self, org_ids=None):
+        with self._lock:
+            df = pd.read_sql_query('SELECT org_id, year, count, fetched_at FROM year_counts', self._conn)
+        if org_ids is not None:
+            df = df[df['org_id'].isin(list(org_ids))]
+        df['fetched_at'] = pd.to_datetime(df['fetched_at'], unit='s')
+        return df.reset_index(drop=True)
+
+    # (org_id, year) pairs that are not stored, or stored longer ago than max_age_days
+    def missing(self, org_ids, years):
+        with self._lock:
+            stored = dict(((org_id, year), fetched_at) for org_id, year, fetched_at in self._conn.execute('SELECT org_id, year, fetched_at FROM year_counts'))
+        now = time.time()
+        return [
+            (org_id, year) for org_id in dict.fromkeys(org_ids) for year in years
+            if (org_id, year) not in stored or (self.max_age is not None and now - stored[(org_id, year)] > self.max_age)
+        ]
+
+    def _fetch_one(self, client, org_id, year):
+        try:
+            return client.count('researchProducts', self.query(org_id, year))
+        except APIError as e:
+            print(f"Failed to retrieve research products for {org_id} in {year}: {e.status_code}")
+            return None
+
+    # Fetch the counts of the given years that are missing or too old; with an engine
+    # (nlportal.engine.FetchEngine) the requests run concurrently
+    def fetch(self, client, org_ids, years, engine=None):
+        org_ids = [org_id for org_id in org_ids if isinstance(org_id, str) and org_id]
+        years = [int(year) for year in years]
+        pairs = self.missing(org_ids, years)
+        print(f"Fetching {len(pairs)} yearly counts ({len(org_ids) * len(years) - len(pairs)} stored)...")
+        calls = [(self._fetch_one, (client, org_id, year), None) for org_id, year in pairs]
+        counts = engine.fetch_all(calls) if engine is not None else [func(*args) for func, args, kwargs in calls]
+        now = time.time()
+        rows = [(org_id, year, int(count), now) for (org_id, year), count in zip(pairs, counts) if count is not None]
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO year_counts (org_id, year, count, fetched_at) VALUES (?, ?, ?, ?)', rows)
+            self._conn.commit()
+        self.fetched += len(rows)
+        return len(rows)
+
+    # Number of research products published from from_year up to and including to_year, for each
+    # of org_ids (a list or Series, the result has the same index), as nullable integers so the
+    # window column is written as whole numbers. Organisations without a stored count for every
+    # year of the window get <NA> rather than a partial sum.
+    def window(self, org_ids, from_year, to_year):
+        org_ids = pd.Series(org_ids)
+        years = range(int(from_year), int(to_year) + 1)
+        df = self.frame(org_ids.dropna().unique())
+        df = df[df['year'].isin(years)]
+        totals = df.groupby('org_id')['count'].agg(['sum', 'size'])
+        totals = totals.loc[totals['size'] == len(years), 'sum']
+        return org_ids.map(totals).astype('Int64')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# Statistics of a count column per main_grouping, as written to grouped_stats_<from>_<to>.csv
+def main_grouping_stats(df, column, from_date, to_date):
+    stats = df.groupby('main_grouping')[column].agg(['sum', 'mean', 'min', 'max', 'std']).reset_index()
+
+    # Round the numbers to 0 decimal places where applicable, 2 for the standard deviation
+    for name in ('sum', 'mean', 'min', 'max'):
+        stats[name] = stats[name].round(0).astype(int)
+    stats['std'] = stats['std'].round(2)
+
+    stats.columns = [
+        'main_grouping',
+        f'total_numFound_{from_date}_{to_date}',
+        f'average_numFound_{from_date}_{to_date}',
+        f'min_numFound_{from_date}_{to_date}',
+        f'max_numFound_{from_date}_{to_date}',
+        f'std_numFound_{from_date}_{to_date}',
+    ]
+    return stats
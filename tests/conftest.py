@@ -0,0 +1,103 @@
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import pandas as pd
+import pytest
+import yaml
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, os.path.join(os.path.dirname(TESTS_DIR), 'benchmarks'))
+from mock_graph_api import REPO_DIR, GraphData, make_server
+
+NL_STATS = os.path.join(REPO_DIR, 'arxiv', 'nl-stats.py')
+LONG_LIST = 'rpo_nl_list_long_20240201.csv'
+
+# The data of the mock API is read once, building it takes a moment
+@pytest.fixture(scope='session')
+def graph_data():
+    return GraphData()
+
+# Start mock API servers on free ports, e.g. make_mock(error_rate=0.2); all are stopped after the test
+@pytest.fixture
+def make_mock(graph_data):
+    servers = []
+
+    def start(**settings):
+        server = make_server(0, graph_data, **settings)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+# One mock API without injected latency or failures, shared by all tests
+@pytest.fixture(scope='session')
+def mock_api(graph_data):
+    server = make_server(0, graph_data)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def api_url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/graph/"
+
+def aai_url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/oidc/token"
+
+# Requests answered by a mock server so far, see GraphAPIHandler.stats
+def mock_stats(server):
+    return dict(server.RequestHandlerClass.stats)
+
+# Settings of config.yaml for a run against a mock server
+def mock_config(server, **settings):
+    config = {
+        'CLIENT_ID': 'test',
+        'CLIENT_SECRET': 'test',
+        'OpenAIRE_API': api_url(server),
+        'OpenAIRE_AAI_URL': aai_url(server),
+        'Org_data_file': LONG_LIST,
+        'Rate_limit': 500,
+        'Rate_limit_max': 1000,
+    }
+    config.update(settings)
+    return config
+
+# Run arxiv/nl-stats.py in a directory of its own (created with the long RPO list when it does not
+# exist yet) against the mock API. Returns the finished process; fails the test when the script failed
+# and check is set.
+@pytest.fixture
+def nl_stats(tmp_path, mock_api):
+    def run(name='run', args=(), check=True, timeout=None, **settings):
+        workdir = tmp_path / name
+        if not workdir.exists():
+            workdir.mkdir()
+            shutil.copy(os.path.join(REPO_DIR, LONG_LIST), workdir)
+        with open(workdir / 'config.yaml', 'w') as file:
+            yaml.safe_dump(mock_config(mock_api, **settings), file)
+        try:
+            process = subprocess.run([sys.executable, NL_STATS] + list(args), cwd=workdir, capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired as e:
+            return e
+        if check:
+            assert process.returncode == 0, process.stdout[-2000:] + process.stderr[-2000:]
+        return process
+
+    return run
+
+# The output file of the latest run in a directory
+def output_file(workdir):
+    files = sorted(glob.glob(os.path.join(workdir, '*_nl-stats.csv')))
+    assert files, f"No output file in {workdir}"
+    return files[-1]
+
+# The rows of the output file as text, without the Retrieved_On timestamps
+def output_rows(workdir):
+    return pd.read_csv(output_file(workdir), dtype=str, keep_default_na=False).drop(columns=['Retrieved_On'])
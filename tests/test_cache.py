@@ -0,0 +1,80 @@
+import pytest
+from conftest import mock_stats, output_rows
+from test_client import ORG, make_client
+from nlportal.cache import ResponseCache
+
+def test_cache_hit_and_miss(make_mock, tmp_path):
+    server = make_mock()
+    client = make_client(server, cache=ResponseCache(str(tmp_path / 'cache.sqlite')))
+    try:
+        first = client.get('projects', {'relOrganizationId': ORG})
+        requests = mock_stats(server)['requests']
+        assert client.get('projects', {'relOrganizationId': ORG}) == first
+        assert mock_stats(server)['requests'] == requests
+        assert (client.cache.hits, client.cache.misses) == (1, 1)
+    finally:
+        client.close()
+
+# Parameters in the url and in params, in any order, are the same query
+def test_cache_key_is_normalized():
+    assert ResponseCache.make_key('https://api/graph/projects?b=2', {'a': 1}) == ResponseCache.make_key('https://api/graph/projects/', {'b': '2', 'a': '1'})
+
+def test_expired_entries_are_fetched_again(make_mock, tmp_path):
+    server = make_mock()
+    client = make_client(server, cache=ResponseCache(str(tmp_path / 'cache.sqlite'), ttls={'projects': -1}))
+    try:
+        client.get('projects', {'relOrganizationId': ORG})
+        client.get('projects', {'relOrganizationId': ORG})
+        assert mock_stats(server)['requests'] == 2
+        assert client.cache.hits == 0
+    finally:
+        client.close()
+
+# Offline, cached responses are used however old, anything else fails without calling the API
+def test_offline_mode(make_mock, tmp_path):
+    server = make_mock()
+    client = make_client(server, cache=ResponseCache(str(tmp_path / 'cache.sqlite')))
+    cached = client.get('projects', {'relOrganizationId': ORG})
+    client.close()
+
+    client = make_client(server, cache=ResponseCache(str(tmp_path / 'cache.sqlite'), ttls={'projects': -1}, mode='offline'))
+    try:
+        requests = mock_stats(server)['requests']
+        assert client.get('projects', {'relOrganizationId': ORG}) == cached
+        with pytest.raises(Exception, match='offline mode'):
+            client.get('researchProducts', {'relOrganizationId': ORG})
+        assert mock_stats(server)['requests'] == requests
+    finally:
+        client.close()
+
+def test_refresh_mode_ignores_the_cache(make_mock, tmp_path):
+    server = make_mock()
+    for mode in ('normal', 'refresh'):
+        client = make_client(server, cache=ResponseCache(str(tmp_path / 'cache.sqlite'), mode=mode))
+        client.get('projects', {'relOrganizationId': ORG})
+        client.close()
+    assert mock_stats(server)['requests'] == 2
+
+# A second run with Cache_file only reads the cache, --offline as well, and both write the same output
+def test_cached_run(nl_stats, mock_api, tmp_path):
+    nl_stats('first', Cache_file=str(tmp_path / 'cache.sqlite'))
+    requests = mock_stats(mock_api)['requests']
+    nl_stats('cached', Cache_file=str(tmp_path / 'cache.sqlite'))
+    nl_stats('offline', args=['--offline'], Cache_file=str(tmp_path / 'cache.sqlite'))
+    assert mock_stats(mock_api)['requests'] == requests
+    first = output_rows(tmp_path / 'first')
+    for name in ('cached', 'offline'):
+        assert output_rows(tmp_path / name).equals(first)
+
+# A count caches only the header of its response, a full request for the same query is not answered with it
+def test_counts_and_full_responses_are_cached_apart(make_mock, tmp_path, graph_data):
+    server = make_mock()
+    client = make_client(server, cache=ResponseCache(str(tmp_path / 'cache.sqlite')))
+    try:
+        params = {'relOrganizationId': ORG, 'pageSize': 1}
+        assert client.count('researchProducts', params) == graph_data.orgs[ORG]['products']
+        assert len(client.get('researchProducts', params)['results']) == 1
+        assert client.count('researchProducts', params) == graph_data.orgs[ORG]['products']
+        assert mock_stats(server)['requests'] == 2
+    finally:
+        client.close()
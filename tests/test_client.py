@@ -0,0 +1,90 @@
+import pytest
+from conftest import aai_url, api_url, mock_stats
+from nlportal.client import APIError, OpenAIREClient
+
+# An OpenOrg of the long RPO list with two data sources
+ORG = 'openorgs____::79a0e60afef2e753b0dc12425ecb3f8c'
+
+def make_client(server, **kwargs):
+    return OpenAIREClient('test', 'test', api_url=api_url(server), aai_url=aai_url(server), **kwargs)
+
+# Answer 401 to requests with one of the given tokens, as when a token was revoked
+def reject_tokens(server, tokens):
+    handler = server.RequestHandlerClass
+    do_get = handler.do_GET
+
+    def do_GET(self):
+        if self.headers.get('Authorization', '').split(' ')[-1] in tokens:
+            self.count('requests')
+            return self.send_json(401, {'error': 'Invalid access token'})
+        return do_get(self)
+
+    handler.do_GET = do_GET
+
+def test_count_returns_num_found(make_mock, graph_data):
+    client = make_client(make_mock())
+    try:
+        assert client.count('researchProducts', {'relOrganizationId': ORG}) == graph_data.orgs[ORG]['products']
+    finally:
+        client.close()
+
+# A 401 drops the token, the request is sent once more with a new one
+def test_token_is_refreshed_after_401(make_mock, graph_data):
+    server = make_mock()
+    reject_tokens(server, {'mock-token-1'})
+    client = make_client(server)
+    try:
+        assert client.count('researchProducts', {'relOrganizationId': ORG}) == graph_data.orgs[ORG]['products']
+        assert client.token.get() == 'mock-token-2'
+        assert mock_stats(server)['token'] == 2
+    finally:
+        client.close()
+
+# A new token that is refused as well is not retried forever
+def test_second_401_is_raised(make_mock):
+    server = make_mock()
+    reject_tokens(server, {'mock-token-1', 'mock-token-2'})
+    client = make_client(server)
+    try:
+        with pytest.raises(APIError) as error:
+            client.get('researchProducts', {'relOrganizationId': ORG})
+        assert error.value.status_code == 401
+        assert mock_stats(server)['token'] == 2
+    finally:
+        client.close()
+
+# The token is fetched once and reused until it is about to expire
+def test_token_is_refreshed_before_it_expires(make_mock):
+    server = make_mock()
+    client = make_client(server)
+    try:
+        for _ in range(3):
+            client.get('projects', {'relOrganizationId': ORG})
+        assert mock_stats(server)['token'] == 1
+        # The mock hands out tokens for an hour, a margin of an hour makes every token due
+        client.token.refresh_margin = 3600
+        client.get('projects', {'relOrganizationId': ORG})
+        assert mock_stats(server)['token'] == 2
+    finally:
+        client.close()
+
+# Requests reuse the keep-alive connection of the session
+def test_requests_share_one_connection(make_mock):
+    server = make_mock()
+    handler = server.RequestHandlerClass
+    connections = []
+    setup = handler.setup
+
+    def count_connection(self):
+        connections.append(self.client_address)
+        return setup(self)
+
+    handler.setup = count_connection
+    client = make_client(server)
+    try:
+        for _ in range(5):
+            client.get('projects', {'relOrganizationId': ORG})
+        # One connection for the token request and the API requests
+        assert len(connections) == 1
+    finally:
+        client.close()
@@ -0,0 +1,27 @@
+import time
+from nlportal.engine import FetchEngine
+
+def _slow(value, delay):
+    time.sleep(delay)
+    return value
+
+# Later calls finish first, the results still come back in the order of the calls
+def test_fetch_all_keeps_the_order_of_the_calls():
+    calls = [(_slow, (value, 0.05 - value * 0.01), None) for value in range(5)]
+    with FetchEngine(8) as engine:
+        assert engine.concurrent
+        assert engine.fetch_all(calls) == list(range(5))
+    with FetchEngine(1) as engine:
+        assert not engine.concurrent
+        assert engine.fetch_all(calls) == list(range(5))
+
+def test_map_keeps_the_order_of_the_items():
+    with FetchEngine(4) as engine:
+        assert engine.map(lambda value: _slow(value * 2, 0.02 - value * 0.002), range(8)) == [value * 2 for value in range(8)]
+
+# A task waiting on its own requests does not starve the request pool
+def test_tasks_can_fan_out_requests():
+    with FetchEngine(2) as engine:
+        def task(value):
+            return sum(engine.fetch_all([(_slow, (value, 0.01), None) for _ in range(3)]))
+        assert engine.map(task, range(4)) == [0, 3, 6, 9]
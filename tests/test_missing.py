@@ -0,0 +1,56 @@
+import gzip
+import pandas as pd
+from conftest import output_file
+from test_client import ORG, make_client
+from nlportal.export import iter_records
+from nlportal.missing import HashedIdSet, difference, write_missing_lists
+
+def test_difference_of_id_sets(tmp_path):
+    a = HashedIdSet(str(tmp_path / 'a'), partitions=4, buffer_size=10)
+    b = HashedIdSet(str(tmp_path / 'b'), partitions=4, buffer_size=10)
+    a.add(f"id-{number}" for number in range(100))
+    a.add(['id-5'])
+    a.flush()
+    b.add(f"id-{number}" for number in range(50, 150))
+    b.flush()
+    assert sorted(difference(a, b)) == sorted(f"id-{number}" for number in range(50))
+    assert sorted(difference(b, a)) == sorted(f"id-{number}" for number in range(100, 150))
+
+# The lists hold exactly the IDs of one query that are not in the other, as many as nl-stats.py counted
+def test_missing_lists_are_exact(nl_stats, mock_api, tmp_path):
+    nl_stats()
+    stats_file = output_file(tmp_path / 'run')
+    client = make_client(mock_api)
+    fetch = lambda endpoint, params: client.get(endpoint, params, cache=False)
+    try:
+        summary = pd.read_csv(write_missing_lists(fetch, stats_file, str(tmp_path / 'missing'), org_ids=[ORG]))
+        org_ids = {record['id'] for record in iter_records(fetch, 'researchProducts', {'relOrganizationId': ORG})}
+        stats = pd.read_csv(stats_file)
+        stats = stats[stats['OpenOrg_ID'] == ORG].set_index('DataSource_ID')
+        assert sorted(summary['DataSource_ID']) == sorted(stats.index)
+        for row in summary.itertuples():
+            datasource_ids = {record['id'] for record in iter_records(fetch, 'researchProducts', {'relCollectedFromDatasourceId': row.DataSource_ID})}
+            with gzip.open(tmp_path / 'missing' / row.File, 'rt') as file:
+                missing = pd.read_csv(file)
+            assert set(missing.loc[missing['missing_in'] == 'DataSource', 'id']) == datasource_ids - org_ids
+            assert set(missing.loc[missing['missing_in'] == 'OpenOrg', 'id']) == org_ids - datasource_ids
+            assert len(missing) == len(datasource_ids ^ org_ids)
+            assert row.Num_Missing_ResearchProducts_in_DataSource == stats.loc[row.DataSource_ID, 'Num_Missing_ResearchProducts_in_DataSource']
+            assert row.Num_Missing_ResearchProducts_in_OpenOrg == stats.loc[row.DataSource_ID, 'Num_Missing_ResearchProducts_in_OpenOrg']
+    finally:
+        client.close()
+
+# Pairs already in summary.csv are skipped, so an interrupted run continues where it stopped
+def test_missing_lists_continue(nl_stats, mock_api, tmp_path):
+    nl_stats()
+    stats_file = output_file(tmp_path / 'run')
+    client = make_client(mock_api)
+    fetch = lambda endpoint, params: client.get(endpoint, params, cache=False)
+    try:
+        summary_file = write_missing_lists(fetch, stats_file, str(tmp_path / 'missing'), org_ids=[ORG])
+        summary = pd.read_csv(summary_file)
+        summary.iloc[:1].to_csv(summary_file, index=False)
+        write_missing_lists(fetch, stats_file, str(tmp_path / 'missing'), org_ids=[ORG])
+        pd.testing.assert_frame_equal(pd.read_csv(summary_file), summary)
+    finally:
+        client.close()
@@ -0,0 +1,117 @@
+import os
+import shutil
+import pandas as pd
+from conftest import LONG_LIST, REPO_DIR, mock_stats, output_file, output_rows
+
+# Rows of the long RPO list against the mock API
+LONG_LIST_ROWS = 136
+ERASMUS = 'https://ror.org/057w15z03'
+OPEN_UNIVERSITY = 'https://ror.org/018dfmf50'
+
+# Requests on a thread pool (Max_in_flight) give the same output file as one request at a time
+def test_thread_pool_output_equals_sequential(nl_stats, tmp_path):
+    nl_stats('sequential', Max_in_flight=1)
+    nl_stats('threads', Max_in_flight=8, Batch_size=5)
+    sequential = output_rows(tmp_path / 'sequential')
+    assert len(sequential) == LONG_LIST_ROWS
+    pd.testing.assert_frame_equal(output_rows(tmp_path / 'threads'), sequential)
+
+# Leave a run as if it was stopped after completed institutions: the rows of the institutions
+# after those were written, but not recorded in the checkpoint manifest
+def interrupt(workdir, completed):
+    with open(workdir / 'nl-stats-checkpoint.jsonl') as file:
+        lines = file.readlines()
+    assert len(lines) > completed + 1
+    with open(workdir / 'nl-stats-checkpoint.jsonl', 'w') as file:
+        file.writelines(lines[:completed + 1])
+
+def test_resume_after_an_interrupted_run(nl_stats, mock_api, tmp_path):
+    requests = mock_stats(mock_api)['requests']
+    nl_stats('complete')
+    full_run = mock_stats(mock_api)['requests'] - requests
+    nl_stats('interrupted', Output_parquet=True)
+    interrupt(tmp_path / 'interrupted', 40)
+
+    requests = mock_stats(mock_api)['requests']
+    process = nl_stats('interrupted', args=['--resume'], Output_parquet=True)
+    assert '40 institutions were already completed' in process.stdout
+    # Only the remaining institutions are fetched again
+    assert mock_stats(mock_api)['requests'] - requests < full_run
+    expected = output_rows(tmp_path / 'complete')
+    pd.testing.assert_frame_equal(output_rows(tmp_path / 'interrupted'), expected)
+    parquet = pd.read_parquet(output_file(tmp_path / 'interrupted')[:-4] + '.parquet')
+    assert sorted(parquet['ROR_ID']) == sorted(expected['ROR_ID'])
+
+def test_resume_without_checkpoint_starts_a_new_run(nl_stats, tmp_path):
+    process = nl_stats(args=['--resume'])
+    assert 'No checkpoint found, starting a new run.' in process.stdout
+    assert len(output_rows(tmp_path / 'run')) == LONG_LIST_ROWS
+
+# An incremental run only fetches the institutions that changed in the data file or are too old
+# in the snapshot, and reuses the rows of all others
+def test_incremental_run_reuses_the_snapshot(nl_stats, mock_api, tmp_path):
+    requests = mock_stats(mock_api)['requests']
+    nl_stats('previous')
+    full_run = mock_stats(mock_api)['requests'] - requests
+    previous = output_rows(tmp_path / 'previous')
+    # The snapshot is a week and a day old for the Open University
+    snapshot = pd.read_csv(output_file(tmp_path / 'previous'), dtype=str, keep_default_na=False)
+    snapshot.loc[snapshot['ROR_ID'] == OPEN_UNIVERSITY, 'Retrieved_On'] = str(pd.Timestamp.now() - pd.Timedelta(days=8))
+    snapshot.to_csv(tmp_path / 'snapshot.csv', index=False)
+    # and the English name of the Erasmus University changed in the data file
+    (tmp_path / 'incremental').mkdir()
+    institutions = pd.read_csv(os.path.join(REPO_DIR, LONG_LIST), dtype=str, keep_default_na=False)
+    institutions.loc[institutions['ROR_LINK'] == ERASMUS, 'full_name_in_English'] = 'Erasmus University Rotterdam (EUR)'
+    institutions.to_csv(tmp_path / 'incremental' / LONG_LIST, index=False)
+
+    requests = mock_stats(mock_api)['requests']
+    process = nl_stats('incremental', args=['--incremental', str(tmp_path / 'snapshot.csv')])
+    # Institutions without an OpenOrg have no rows in the snapshot and are looked up again as new ones
+    assert "'changed': 1, 'stale': 1}" in process.stdout
+    assert 0 < mock_stats(mock_api)['requests'] - requests < full_run / 5
+    previous.loc[previous['ROR_ID'] == ERASMUS, 'ROR_Name'] = 'Erasmus University Rotterdam (EUR)'
+    pd.testing.assert_frame_equal(output_rows(tmp_path / 'incremental'), previous)
+    # Reused rows keep the time they were retrieved
+    output = pd.read_csv(output_file(tmp_path / 'incremental'), dtype=str, keep_default_na=False)
+    reused = ~output['ROR_ID'].isin([ERASMUS, OPEN_UNIVERSITY])
+    assert pd.to_datetime(output.loc[reused, 'Retrieved_On']).equals(pd.to_datetime(snapshot.loc[reused, 'Retrieved_On']))
+
+# Worker processes write parts that are merged into the same output file as a run without shards
+def test_sharded_run_equals_unsharded(nl_stats, tmp_path):
+    nl_stats('unsharded')
+    process = nl_stats('sharded', args=['--shards', '3'], Output_parquet=True)
+    assert f"Merged {LONG_LIST_ROWS} rows of 3 parts." in process.stdout
+    expected = output_rows(tmp_path / 'unsharded')
+    pd.testing.assert_frame_equal(output_rows(tmp_path / 'sharded'), expected)
+    parquet = pd.read_parquet(output_file(tmp_path / 'sharded')[:-4] + '.parquet')
+    assert list(parquet['ROR_ID']) == list(expected['ROR_ID'])
+
+def test_resume_sharded_run(nl_stats, tmp_path):
+    nl_stats('complete')
+    nl_stats('interrupted', args=['--shards', '3'])
+    interrupt(tmp_path / 'interrupted', 40)
+    nl_stats('interrupted', args=['--resume', '--shards', '3'])
+    pd.testing.assert_frame_equal(output_rows(tmp_path / 'interrupted'), output_rows(tmp_path / 'complete'))
+
+# A run without shards resumed with --shards keeps the rows it had written
+def test_resume_with_shards_after_a_run_without(nl_stats, tmp_path):
+    nl_stats('complete')
+    nl_stats('interrupted')
+    interrupt(tmp_path / 'interrupted', 40)
+    process = nl_stats('interrupted', args=['--resume', '--shards', '3'])
+    assert 'part-resumed.csv' in process.stdout
+    pd.testing.assert_frame_equal(output_rows(tmp_path / 'interrupted'), output_rows(tmp_path / 'complete'))
+    # Resuming once more does not duplicate them
+    nl_stats('interrupted', args=['--resume', '--shards', '3'])
+    pd.testing.assert_frame_equal(output_rows(tmp_path / 'interrupted'), output_rows(tmp_path / 'complete'))
+
+# Largest first, the institutions are fetched in the order of their cost in the previous output,
+# and the output file is put back in the order of the data file
+def test_largest_first_output_equals_data_file_order(nl_stats, tmp_path):
+    nl_stats('previous')
+    (tmp_path / 'largest-first').mkdir()
+    shutil.copy(os.path.join(REPO_DIR, LONG_LIST), tmp_path / 'largest-first')
+    shutil.copy(output_file(tmp_path / 'previous'), tmp_path / 'largest-first' / '2000-01-01_00-00_nl-stats.csv')
+    process = nl_stats('largest-first', args=['--schedule', 'largest-first'], Max_in_flight=4)
+    assert 'Fetching the institutions largest first' in process.stdout
+    pd.testing.assert_frame_equal(output_rows(tmp_path / 'largest-first'), output_rows(tmp_path / 'previous'))
@@ -0,0 +1,42 @@
+import re
+from conftest import mock_stats
+from nlportal.engine import FetchEngine
+from nlportal.plan import QueryPlan
+
+def test_identical_requests_are_executed_once():
+    calls = []
+    plan = QueryPlan(lambda endpoint, params: calls.append(('fetch', endpoint, params)) or {'endpoint': endpoint},
+                     count=lambda endpoint, params: calls.append(('count', endpoint, params)) or 7)
+    plan.add('projects', {'relOrganizationId': 'a'})
+    plan.add('projects', {'relOrganizationId': 'a'})
+    # Parameter values are compared as text
+    plan.add('researchProducts', {'relOrganizationId': 'a', 'pageSize': 1}, count=True)
+    plan.add('researchProducts', {'pageSize': '1', 'relOrganizationId': 'a'}, count=True)
+    plan.add('researchProducts', {'relOrganizationId': 'a', 'pageSize': 1})
+    with FetchEngine(4) as engine:
+        plan.execute(engine)
+    assert len(calls) == 3
+    assert plan.result('researchProducts', {'relOrganizationId': 'a', 'pageSize': 1}, count=True) == 7
+    assert (plan.requested, plan.executed, plan.saved) == (5, 3, 2)
+
+# Results are kept for the whole run: a later batch reuses them, and provided results are not fetched
+def test_later_batches_reuse_results():
+    calls = []
+    plan = QueryPlan(lambda endpoint, params: calls.append(endpoint) or {})
+    plan.add('projects', {'relOrganizationId': 'a'})
+    plan.execute(FetchEngine(1))
+    plan.add('projects', {'relOrganizationId': 'a'})
+    plan.provide('organizations', {'pid': 'ror'}, {'results': []})
+    plan.add('organizations', {'pid': 'ror'})
+    plan.execute(FetchEngine(1))
+    assert calls == ['projects']
+    assert (plan.requested, plan.executed, plan.provided, plan.saved) == (3, 1, 1, 1)
+
+# The requests nl-stats.py reports as executed are the requests the API received
+def test_run_makes_each_request_once(nl_stats, mock_api):
+    requests = mock_stats(mock_api)['requests']
+    process = nl_stats(Max_in_flight=4)
+    planned, executed, saved = map(int, re.search(r"(\d+) API requests planned, (\d+) unique requests executed, (\d+) duplicate requests saved", process.stdout).groups())
+    assert mock_stats(mock_api)['requests'] - requests == executed
+    assert planned == executed + saved
+    assert saved > 0
@@ -0,0 +1,115 @@
+import email.utils
+import time
+import pytest
+from conftest import mock_stats
+from test_client import ORG, make_client
+from nlportal.client import APIError
+from nlportal.ratelimit import AdaptiveRateLimiter, CircuitBreaker, CircuitOpenError, RetryPolicy, parse_retry_after
+
+# Additive increase on success, multiplicative decrease on throttling, within min_rate and max_rate
+def test_aimd():
+    limiter = AdaptiveRateLimiter(rate=10, min_rate=2, max_rate=11, increase=0.5, decrease=0.5, hold=0)
+    limiter.on_success()
+    assert limiter.rate == 10.5
+    limiter.on_success()
+    limiter.on_success()
+    assert limiter.rate == 11
+    limiter.on_throttle()
+    assert limiter.rate == 5.5
+    limiter.on_throttle()
+    limiter.on_throttle()
+    assert limiter.rate == 2
+    assert limiter.throttled == 3
+
+# Throttled answers to one burst cut the rate once
+def test_throttling_within_hold_cuts_the_rate_once():
+    limiter = AdaptiveRateLimiter(rate=10, hold=60)
+    for _ in range(5):
+        limiter.on_throttle()
+    assert limiter.rate == 5
+
+def test_retry_after_pauses_all_requests():
+    limiter = AdaptiveRateLimiter(rate=1000)
+    limiter.on_throttle(retry_after=0.3)
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.25
+
+def test_parse_retry_after():
+    now = time.time()
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after(email.utils.formatdate(now + 10, usegmt=True), now=now) == pytest.approx(10, abs=1)
+    assert parse_retry_after(email.utils.formatdate(now - 10, usegmt=True), now=now) == 0.0
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(None) is None
+
+def test_retry_delay():
+    retry = RetryPolicy(base_delay=1.0, max_delay=5.0)
+    assert retry.delay(0, retry_after=2) == 2
+    assert retry.delay(0, retry_after=30) == 5.0
+    assert all(0 <= retry.delay(attempt) <= min(5.0, 2 ** attempt) for attempt in range(6) for _ in range(20))
+
+# The mock answers the first request with 429 and Retry-After; the client waits that long and retries
+def test_client_waits_for_retry_after(make_mock, graph_data):
+    server = make_mock()
+    handler = server.RequestHandlerClass
+    do_get = handler.do_GET
+
+    def do_GET(self):
+        if mock_stats(server)['requests'] == 0:
+            self.count('requests')
+            return self.send_json(429, {'error': 'Too many requests'}, {'Retry-After': '1'})
+        return do_get(self)
+
+    handler.do_GET = do_GET
+    client = make_client(server, limiter=AdaptiveRateLimiter(rate=10))
+    try:
+        start = time.monotonic()
+        assert client.count('researchProducts', {'relOrganizationId': ORG}) == graph_data.orgs[ORG]['products']
+        assert time.monotonic() - start >= 1.0
+        assert mock_stats(server)['requests'] == 2
+        assert client.limiter.throttled == 1
+        # Halved by the 429, raised again by the successful retry
+        assert client.limiter.rate == 5.5
+    finally:
+        client.close()
+
+# After cooldown one trial request is let through; its failure opens the circuit again, its success closes it
+def test_circuit_breaker_half_open():
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=0.1)
+    breaker.record_failure('researchProducts')
+    breaker.check('researchProducts')
+    breaker.record_failure('researchProducts')
+    with pytest.raises(CircuitOpenError):
+        breaker.check('researchProducts')
+    # Other endpoints are not affected
+    breaker.check('projects')
+
+    time.sleep(0.15)
+    breaker.check('researchProducts')
+    # Only one trial at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.check('researchProducts')
+    breaker.record_failure('researchProducts')
+    with pytest.raises(CircuitOpenError):
+        breaker.check('researchProducts')
+
+    time.sleep(0.15)
+    breaker.check('researchProducts')
+    breaker.record_success('researchProducts')
+    breaker.check('researchProducts')
+    breaker.check('researchProducts')
+
+# Once the circuit of an endpoint is open, the client stops sending it requests
+def test_client_stops_calling_a_failing_endpoint(make_mock):
+    server = make_mock(error_rate=1.0)
+    client = make_client(server, breaker=CircuitBreaker(failure_threshold=2, cooldown=60), retry=RetryPolicy(max_retries=0))
+    try:
+        for _ in range(2):
+            with pytest.raises(APIError):
+                client.get('projects', {'relOrganizationId': ORG})
+        with pytest.raises(CircuitOpenError):
+            client.get('projects', {'relOrganizationId': ORG})
+        assert mock_stats(server)['requests'] == 2
+    finally:
+        client.close()
@@ -0,0 +1,41 @@
+import os
+import pandas as pd
+import pytest
+from conftest import REPO_DIR
+from test_client import make_client
+from nlportal.yearly import YearlyCounts, main_grouping_stats
+
+# The windows of org_stats_<from>_<to>.csv derived from yearly counts of the mock API, and the
+# grouped_stats file written from them, are the ones in the repository
+@pytest.mark.parametrize('from_year, to_year', [(2020, 2023), (2021, 2024)])
+def test_windows_from_yearly_counts(mock_api, tmp_path, from_year, to_year):
+    column = f"numFound_ResearchProducts_{from_year}_{to_year}"
+    org_stats = pd.read_csv(os.path.join(REPO_DIR, f"org_stats_{from_year}_{to_year}.csv"))
+    client = make_client(mock_api)
+    yearly = YearlyCounts(str(tmp_path / 'yearly.sqlite'))
+    try:
+        yearly.fetch(client, org_stats['OpenAIRE_Org_ID'].dropna(), range(from_year, to_year + 1))
+        window = yearly.window(org_stats['OpenAIRE_Org_ID'], from_year, to_year)
+    finally:
+        yearly.close()
+        client.close()
+    assert window.dtype == 'Int64'
+    assert window.astype('Float64').equals(org_stats[column].astype('Float64'))
+    stats = main_grouping_stats(org_stats.assign(**{column: window}), column, str(from_year), str(to_year))
+    stats.to_csv(tmp_path / 'grouped_stats.csv', index=False)
+    with open(tmp_path / 'grouped_stats.csv') as written, open(os.path.join(REPO_DIR, f"grouped_stats_{from_year}_{to_year}.csv")) as expected:
+        assert written.read() == expected.read()
+
+# A window with a year that is not stored is <NA>, not a partial sum
+def test_window_needs_every_year(mock_api, tmp_path):
+    org_stats = pd.read_csv(os.path.join(REPO_DIR, 'org_stats_2021_2024.csv'))
+    org_ids = org_stats['OpenAIRE_Org_ID'].dropna().head(3)
+    client = make_client(mock_api)
+    yearly = YearlyCounts(str(tmp_path / 'yearly.sqlite'))
+    try:
+        yearly.fetch(client, org_ids, range(2021, 2024))
+        assert yearly.window(org_ids, 2021, 2024).isna().all()
+        assert yearly.window(org_ids, 2021, 2023).notna().all()
+    finally:
+        yearly.close()
+        client.close()